@@ -17,8 +17,10 @@
 from typing import Optional
 from fastapi import FastAPI, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 import uvicorn
+import json
 import sys
 from pathlib import Path
 from collections import deque
@@ -39,6 +41,10 @@ from agents.agent_manager import agent_manager
 
 from agents.tracing_plugin import tracing_plugin
 
+from common.utils.warehouses import available_warehouses
+
+from common.utils.memoize import tool_cache_stats, clear_tool_caches
+
 # Configure logging
 logger = setup_logger('api.IA_api')
 
@@ -62,12 +68,16 @@ app.add_middleware(
 class AgentQuery(BaseModel):
     message: str
     session_id: str = "default_session"
+    warehouse: Optional[str] = None  # None analyses all warehouses
+    bypass_cache: bool = False  # Always ask the agents, even for a cached question
+    bypass_fast_path: bool = False  # Ask the agents even for a canonical question
 
 # Response model
 class AgentResponse(BaseModel):
     response: str
     status: str
     session_id: str
+    served_by: str = "agents"  # "fast_path", "cache" or "agents"
 
 @app.get("/")
 async def root():
@@ -83,6 +93,14 @@ async def health_check():
         "service": "Warehouse AI Agent API"
     }
 
+def check_warehouse(warehouse: Optional[str]):
+    """Reject queries filtered by an unknown warehouse"""
+    if warehouse and warehouse not in available_warehouses():
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown warehouse '{warehouse}'. Available: {available_warehouses()}"
+        )
+
 @app.post("/query", response_model=AgentResponse)
 async def query_agent(query: AgentQuery):
     """
@@ -90,18 +108,26 @@ async def query_agent(query: AgentQuery):
     """
     try:
         logger.info(f"Received query: {query.message}")
+        check_warehouse(query.warehouse)
         
-        response = await agent_manager.query_orchestrator(
+        response, served_by = await agent_manager.answer_query(
             user_message=query.message,
-            session_id=query.session_id
+            session_id=query.session_id,
+            warehouse=query.warehouse,
+            use_cache=not query.bypass_cache,
+            use_fast_path=not query.bypass_fast_path
         )
+        logger.info(f"Query served by {served_by}")
         
         return AgentResponse(
             response=response,
             status="success",
-            session_id=query.session_id
+            session_id=query.session_id,
+            served_by=served_by
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error processing query: {e}")
         raise HTTPException(
@@ -109,6 +135,34 @@ async def query_agent(query: AgentQuery):
             detail=f"Error processing query: {str(e)}"
         )
 
+@app.post("/query/stream")
+async def query_agent_stream(query: AgentQuery):
+    """
+    Send a query to the AI agent and stream its progress as Server-Sent Events
+
+    Each event is named after its type (agent_start, tool_start, tool_end,
+    text, final, error) and carries the event as JSON data.
+    """
+    logger.info(f"Received streamed query: {query.message}")
+    check_warehouse(query.warehouse)
+
+    async def event_stream():
+        async for event in agent_manager.stream_orchestrator(
+            user_message=query.message,
+            session_id=query.session_id,
+            warehouse=query.warehouse,
+            use_cache=not query.bypass_cache,
+            use_fast_path=not query.bypass_fast_path
+        ):
+            yield f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False, default=str)}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        # Flush every event through proxies instead of buffering the response
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/agents")
 async def get_agents_info():
     """Get information about available agents"""
@@ -121,6 +175,23 @@ async def get_agents_info():
         ]
     }
 
+@app.get("/warehouses")
+async def get_warehouses():
+    """List the warehouses the analyses can be filtered by"""
+    return {"warehouses": available_warehouses()}
+
+@app.get("/cache")
+async def get_cache_stats():
+    """Hit/miss statistics of the response cache and of every tool cache"""
+    return {"response_cache": agent_manager.response_cache.stats(), "tools": tool_cache_stats()}
+
+@app.delete("/cache")
+async def clear_cache():
+    """Drop every cached response and tool result"""
+    agent_manager.response_cache.clear()
+    clear_tool_caches()
+    return {"status": "cleared"}
+
 @app.get("/trajectory")
 async def get_all_trajectories():
     """Get trajectory data for all sessions"""
@@ -14,16 +14,23 @@
 # Debería haber recibido una copia de la Licencia Pública General de GNU
 # junto con este programa. Si no, vea <https://www.gnu.org/licenses/>.
 
+import asyncio
+
 from google.adk.agents import LlmAgent
+from google.adk.events.event_actions import EventActions
 from google.adk.tools import AgentTool
+from google.adk.tools.tool_context import ToolContext
 from config import WAREHOUSE_MODEL_orq, WAREHOUSE_MODEL_esp
 
 
 # Import our utility functions
-from common.utils.expedition_analysis import get_top_clients, get_client_service_level, get_expedition_metrics
+from common.utils.expedition_analysis import get_top_clients, get_client_service_level, get_expedition_metrics, get_client_analytics
 from common.utils.reference_analysis import get_top_references_expeditions, get_reference_time_series, forecast_next_month_demand
-from common.utils.stock_analysis import get_top_references_stock, get_avg_time_in_warehouse, get_stock_metrics
+from common.utils.stock_analysis import get_top_references_stock, get_avg_time_in_warehouse, get_stock_aging, get_stock_metrics
 from common.utils.data_loader import load_expeditions_data
+from common.utils.warehouses import available_warehouses
+from common.utils.memoize import memoize_tools
+from common.utils import settings
 
 # Setup logging
 from common.utils.logger import setup_logger
@@ -73,20 +80,24 @@ RESPONSIBILITIES:
 TOOLS AVAILABLE:
 - avaible_years: Get list of available years in expeditions data.
 - avaible_months: Get list of available months in expeditions data.
-- get_top_clients: Get top clients by total ordered quantity. Args: limit (from 1 to 8, default 5), year, month
-- get_client_service_level: Calculate service level (shipped/ordered) for clients. Args: client_list (obtained from top clients), year, month  
-- get_expedition_metrics: Get expedition metrics for clients. Args: client_list (obtained from top clients), year, month
+- available_warehouses: Get list of warehouses.
+- get_client_analytics: Get top clients, their service levels and expedition metrics in ONE call. Args: limit (from 1 to 8, default 5), year, month, warehouse
+- get_top_clients: Get top clients by total ordered quantity. Args: limit (from 1 to 8, default 5), year, month, warehouse
+- get_client_service_level: Calculate service level (shipped/ordered) for clients. Args: client_list (obtained from top clients), year, month, warehouse
+- get_expedition_metrics: Get expedition metrics for clients. Args: client_list (obtained from top clients), year, month, warehouse
+
+The warehouse argument is optional: leave it empty to analyse all warehouses together, or pass a name from available_warehouses to analyse a single one.
 
 ANALYSIS APPROACH:
-1. First identify top clients using get_top_clients
-2. Then analyze their service levels with get_client_service_level
-3. Finally get detailed metrics with get_expedition_metrics
-4. Provide actionable recommendations to improve service levels
+1. For the standard analysis of top clients, call get_client_analytics once: it returns the top clients, their service levels and their metrics together
+2. Use get_top_clients, get_client_service_level and get_expedition_metrics only when the user asks about a specific list of clients or a single aspect
+3. Provide actionable recommendations to improve service levels
 
 Always provide clear explanations of service level calculations and business implications.
 Focus on identifying improvement opportunities for underperforming clients.
 """,
-    tools=[avalaible_years,avalaible_months,get_top_clients, get_client_service_level, get_expedition_metrics],
+    # Repeated calls with the same arguments on unchanged data are answered from a cache
+    tools=memoize_tools([avalaible_years,avalaible_months,available_warehouses,get_client_analytics,get_top_clients, get_client_service_level, get_expedition_metrics]),
 )
 
 reference_expeditions_agent = LlmAgent(
@@ -103,9 +114,12 @@ RESPONSIBILITIES:
 TOOLS AVAILABLE:
 - avaible_years: Get list of available years in expeditions data.
 - avaible_months: Get list of available months in expeditions data.
-- get_top_references_expeditions: Get top references by ordered quantity. Args: limit (1 to 8, default 5), year, month
-- get_reference_time_series: Get time series of shipped quantities. Args: reference_list, year, month
-- forecast_next_month_demand: Forecast next month demand. Args: reference_list
+- available_warehouses: Get list of warehouses.
+- get_top_references_expeditions: Get top references by ordered quantity. Args: limit (1 to 8, default 5), year, month, warehouse
+- get_reference_time_series: Get time series of shipped quantities. Args: reference_list, year, month, warehouse
+- forecast_next_month_demand: Forecast next month demand. Args: reference_list, model (optional: "moving_average" (default), "exponential_smoothing", "holt" for trending references, "croston" for intermittent demand), warehouse
+
+The warehouse argument is optional: leave it empty to analyse all warehouses together, or pass a name from available_warehouses to analyse a single one.
 
 ANALYSIS APPROACH:
 1. Identify high-demand references using get_top_references_expeditions
@@ -116,7 +130,7 @@ ANALYSIS APPROACH:
 Focus on identifying seasonal patterns, growth trends, and forecasting accuracy.
 Provide clear explanations of demand patterns and their business implications.
 """,
-    tools=[avalaible_years,avalaible_months,get_top_references_expeditions, get_reference_time_series, forecast_next_month_demand],
+    tools=memoize_tools([avalaible_years,avalaible_months,available_warehouses,get_top_references_expeditions, get_reference_time_series, forecast_next_month_demand]),
 )
 
 stock_analysis_agent = LlmAgent(
@@ -131,9 +145,14 @@ RESPONSIBILITIES:
 - Identify slow-moving or obsolete inventory
 
 TOOLS AVAILABLE:
-- get_top_references_stock: Find references with highest stock
-- get_avg_time_in_warehouse: Calculate inventory aging
-- get_stock_metrics: Get detailed stock information
+- available_warehouses: Get list of warehouses.
+- get_top_references_stock: Find references with highest stock. Args: limit, warehouse
+- get_avg_time_in_warehouse: Calculate inventory aging. Args: reference_list, warehouse, as_of
+- get_stock_aging: Get age percentiles and age buckets of the HUs. Args: reference_list, warehouse, as_of
+- get_stock_metrics: Get detailed stock information (pieces, locations, HUs, oldest/newest entry date). Args: reference_list, warehouse
+
+The warehouse argument is optional: leave it empty to analyse all warehouses together, or pass a name from available_warehouses to analyse a single one.
+The as_of argument (YYYY-MM-DD) measures ages at a given date; leave it empty to measure them today.
 
 ANALYSIS APPROACH:
 1. Identify high-stock references using get_top_references_stock
@@ -144,7 +163,7 @@ ANALYSIS APPROACH:
 Focus on identifying slow-moving inventory, stock optimization opportunities, and warehouse efficiency improvements.
 Provide clear explanations of inventory turnover and aging implications.
 """,
-    tools=[get_top_references_stock, get_avg_time_in_warehouse, get_stock_metrics],
+    tools=memoize_tools([available_warehouses, get_top_references_stock, get_avg_time_in_warehouse, get_stock_aging, get_stock_metrics]),
 )
 
 # Create AgentTools for each specialized agent
@@ -152,6 +171,74 @@ client_agent_tool = AgentTool(agent=client_service_agent)
 reference_agent_tool = AgentTool(agent=reference_expeditions_agent)  
 stock_agent_tool = AgentTool(agent=stock_analysis_agent)
 
+
+def _specialist_context(tool_context: ToolContext) -> ToolContext:
+    """Context of one concurrent specialist call: its own copy of the session state and its own deltas"""
+    invocation_context = tool_context._invocation_context
+    session = invocation_context.session.model_copy(update={"state": dict(invocation_context.session.state)})
+    return ToolContext(
+        invocation_context.model_copy(update={"session": session}),
+        function_call_id=tool_context.function_call_id,
+        event_actions=EventActions(),
+    )
+
+
+async def consult_specialists(
+    tool_context: ToolContext, client_request: str = "", reference_request: str = "", stock_request: str = ""
+) -> dict:
+    """
+    Ask several specialized agents at the same time and collect their answers.
+    Use it for multi-domain questions whose parts do not depend on each other.
+
+    Args:
+        client_request (str): Question for client_service_agent, empty to skip it
+        reference_request (str): Question for reference_expeditions_agent, empty to skip it
+        stock_request (str): Question for stock_analysis_agent, empty to skip it
+
+    Returns:
+        dict: Answer of each consulted agent, by agent name
+    """
+    requests = {
+        tool: request.strip()
+        for tool, request in ((client_agent_tool, client_request), (reference_agent_tool, reference_request), (stock_agent_tool, stock_request))
+        if request and request.strip()
+    }
+    if not requests:
+        return {"error": "Give a request for at least one specialist."}
+    logger.info(f"Consulting {[tool.name for tool in requests]} concurrently")
+    # The specialists wait on the model most of the time: run them together, so
+    # the latency is the slowest specialist's instead of their sum. Each one
+    # works on its own context, so their state and artifact changes do not
+    # interleave; they are applied to this call's context afterwards, in
+    # client, reference, stock order.
+    contexts = [_specialist_context(tool_context) for _ in requests]
+    answers = await asyncio.gather(
+        *(tool.run_async(args={"request": request}, tool_context=context) for (tool, request), context in zip(requests.items(), contexts)),
+        return_exceptions=True,
+    )
+    for context in contexts:
+        tool_context.state.update(context.actions.state_delta)
+        tool_context.actions.artifact_delta.update(context.actions.artifact_delta)
+    results = {}
+    for tool, answer in zip(requests, answers):
+        if isinstance(answer, Exception):
+            logger.error(f"Specialist {tool.name} failed: {answer}")
+            answer = f"Error: {answer}"
+        results[tool.name] = answer
+    return results
+
+
+if settings.PARALLEL_SPECIALISTS:
+    MULTI_DOMAIN_GUIDELINE = (
+        "- Complex multi-domain questions → call **consult_specialists** ONCE with a request for every specialist needed: "
+        "they work at the same time. Call the agents one after another only when a request needs the results of "
+        "another agent (e.g. the stock of the references the demand agent found)."
+    )
+    ORCHESTRATOR_TOOLS = [client_agent_tool, reference_agent_tool, stock_agent_tool, consult_specialists]
+else:
+    MULTI_DOMAIN_GUIDELINE = "- Complex multi-domain questions → **You MUST determine the optimal sequence and use multiple agents as needed.**"
+    ORCHESTRATOR_TOOLS = [client_agent_tool, reference_agent_tool, stock_agent_tool]
+
 # ============================================================================
 # ORCHESTRATOR AGENT
 # ============================================================================
@@ -159,7 +246,7 @@ stock_agent_tool = AgentTool(agent=stock_analysis_agent)
 orchestrator_agent = LlmAgent(
     name="warehouse_orchestrator_agent",
     model=WAREHOUSE_MODEL_orq,
-    instruction="""You are the Warehouse Analytics Orchestrator. You coordinate between specialized agents to provide comprehensive warehouse insights.
+    instruction=f"""You are the Warehouse Analytics Orchestrator. You coordinate between specialized agents to provide comprehensive warehouse insights.
 
 **PRIORITY RULE: ALWAYS use your SPECIALIZED AGENTS (tools) to answer the user's query before generating a final response. Do not use conversational filler or unnecessary steps.**
 
@@ -183,7 +270,7 @@ ROUTING GUIDELINES:
 - Client-focused questions → client_service_agent
 - Demand and forecasting questions → reference_expeditions_agent  
 - Stock and inventory questions → stock_analysis_agent
-- Complex multi-domain questions → **You MUST determine the optimal sequence and use multiple agents as needed.**
+{MULTI_DOMAIN_GUIDELINE}
 
 RESPONSE STRUCTURE:
 **AFTER receiving the tool outputs (findings from the agents), structure the final response as follows:**
@@ -194,7 +281,7 @@ RESPONSE STRUCTURE:
 
 Always ensure the user receives a comprehensive answer that addresses all aspects of their query.
 """,
-    tools=[client_agent_tool, reference_agent_tool, stock_agent_tool],
+    tools=ORCHESTRATOR_TOOLS,
 )
 
 print("✅ Orchestrator agent created successfully!")
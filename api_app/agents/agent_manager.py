@@ -14,16 +14,39 @@
 # Debería haber recibido una copia de la Licencia Pública General de GNU
 # junto con este programa. Si no, vea <https://www.gnu.org/licenses/>.
 
+import asyncio
+import re
+import unicodedata
+
+from google.adk.agents.run_config import RunConfig, StreamingMode
+from google.adk.events import Event
 from google.adk.runners import Runner
 from google.adk.sessions import InMemorySessionService
 from google.genai import types
 
 from common.utils.logger import setup_logger
+from common.utils.query_router import route_query
+from common.utils.result_cache import ResultCache
+from common.utils.warehouses import data_version
+from common.utils import settings
 from agents.agent import orchestrator_agent, client_service_agent, reference_expeditions_agent, stock_analysis_agent
 from agents.tracing_plugin import tracing_plugin
+from agents.streaming_plugin import streaming_plugin, stream_events
 
 logger = setup_logger('api.agents.agent_manager')
 
+# Model responses of streamed queries arrive as partial text events
+STREAMING_RUN_CONFIG = RunConfig(streaming_mode=StreamingMode.SSE)
+
+NO_RESPONSE = "No response generated"
+ERROR_PREFIX = "I encountered an error"
+
+
+def normalize_query(text):
+    """Case, spacing and trailing punctuation insensitive form of a question"""
+    text = unicodedata.normalize("NFKC", text).casefold()
+    return re.sub(r"\s+", " ", text).strip().rstrip("?!. ")
+
 class WarehouseAgentManager:
     """Manager for all warehouse analytics AI agents"""
     
@@ -31,58 +54,235 @@ class WarehouseAgentManager:
         self.session_service = InMemorySessionService()
         self.orchestrator = orchestrator_agent
         self.APP_NAME = "agents"
-        self.runner = Runner(agent=self.orchestrator, app_name=self.APP_NAME, session_service=self.session_service,plugins=[tracing_plugin])
+        self.runner = Runner(agent=self.orchestrator, app_name=self.APP_NAME, session_service=self.session_service,plugins=[tracing_plugin, streaming_plugin])
         self.specialized_agents = {
             'client': client_service_agent,
             'reference': reference_expeditions_agent, 
             'stock': stock_analysis_agent
         }
+        # Answers to the first question of a session by (normalized question, warehouse, data version)
+        self.response_cache = ResultCache(settings.RESPONSE_CACHE_SIZE, settings.RESPONSE_CACHE_TTL)
         self._initialized = True
         
-    async def query_orchestrator(self, user_message, session_id="default_session", USER_ID="default_user"):
+    async def query_orchestrator(self, user_message, session_id="default_session", USER_ID="default_user", warehouse=None):
         """
         Send query to orchestrator agent (recommended for most queries)
+
+        When a warehouse is given the agents are told to pass it to every tool,
+        so the analysis covers that warehouse only.
         """
         try:
-            if type(user_message) is str:
-                user_message = [user_message]
-                for query in user_message:
-                    logger.info(f"Orchestrator processing query: {query}")
-                    # Convert the query string to the ADK Content format
-                    query = types.Content(role="user", parts=[types.Part(text=query)])
-            
-            session = await self.session_service.get_session(
-                app_name=self.APP_NAME,
-                user_id=USER_ID,
-                session_id=session_id
-            )
-            if not session:
-                logger.info(f"Failed to retrieve session: {session_id}")
-                session = await self.session_service.create_session(
-                app_name=self.APP_NAME, 
-                user_id=USER_ID, 
-                session_id=session_id
-            )
+            query = self._user_content(user_message, warehouse)
+            session = await self._get_session(session_id, USER_ID)
             
+            response = None
             async for event in self.runner.run_async(
                 user_id=USER_ID, 
                 session_id=session.id, 
                 new_message=query
             ):
-                # Check if the event contains valid content
-                if event.content and event.content.parts:
-                    # Filter out empty or "None" responses before printing
-                    if (
-                        event.content.parts[0].text != "None"
-                        and event.content.parts[0].text
-                    ):
-                        response = event.content.parts[0].text
+                text = self._event_text(event)
+                if text:
+                    response = text
             
-            return response if response else "No response generated"
+            return response if response else NO_RESPONSE
             
         except Exception as e:
             logger.error(f"Error in orchestrator query: {e}")
-            return f"I encountered an error: {str(e)}"
+            return f"{ERROR_PREFIX}: {str(e)}"
+
+    async def answer_query(self, user_message, session_id="default_session", USER_ID="default_user", warehouse=None, use_cache=True, use_fast_path=True):
+        """
+        Answer a query with the fast path, from the response cache, or with the orchestrator
+
+        Canonical questions are answered from the analytics functions without
+        calling the agents; such answers are not added to the session history.
+        The first question of a session is answered from the cache when it was
+        asked before on unchanged data, and the cached answer is added to the
+        session history; follow-ups depend on the conversation and always go
+        to the agents.
+
+        Returns:
+            tuple: (response, served_by), served_by being "fast_path", "cache" or "agents"
+        """
+        response = await self._fast_path(user_message, warehouse) if use_fast_path else None
+        if response is not None:
+            return response, "fast_path"
+        key = await self._session_cache_key(user_message, session_id, USER_ID, warehouse) if use_cache else None
+        if key is not None:
+            found, response = self.response_cache.get(key)
+            if found:
+                logger.info(f"Answered from the response cache: {user_message}")
+                await self._record_cached_turn(user_message, session_id, USER_ID, response)
+                return response, "cache"
+        response = await self.query_orchestrator(user_message, session_id, USER_ID, warehouse)
+        self._store_response(key, response)
+        return response, "agents"
+
+    async def stream_orchestrator(self, user_message, session_id="default_session", USER_ID="default_user", warehouse=None, use_cache=True, use_fast_path=True):
+        """
+        Send query to orchestrator agent and yield its progress as it happens
+
+        Events are dicts with a "type":
+        - agent_start: an agent started (the orchestrator, or a specialist it handed off to)
+        - tool_start / tool_end: a tool call started or finished (specialists are agent tools)
+        - text: partial text of a model response
+        - final: the complete answer and served_by, as returned by answer_query
+        - error: the query failed
+        """
+        response = await self._fast_path(user_message, warehouse) if use_fast_path else None
+        if response is not None:
+            yield {"type": "final", "response": response, "served_by": "fast_path"}
+            return
+        key = await self._session_cache_key(user_message, session_id, USER_ID, warehouse) if use_cache else None
+        if key is not None:
+            found, response = self.response_cache.get(key)
+            if found:
+                logger.info(f"Answered from the response cache: {user_message}")
+                await self._record_cached_turn(user_message, session_id, USER_ID, response)
+                yield {"type": "final", "response": response, "served_by": "cache"}
+                return
+
+        queue = asyncio.Queue()
+
+        async def run(query, session):
+            response = None
+            try:
+                async for event in self.runner.run_async(
+                    user_id=USER_ID,
+                    session_id=session.id,
+                    new_message=query,
+                    run_config=STREAMING_RUN_CONFIG
+                ):
+                    text = self._event_text(event)
+                    if not text:
+                        continue
+                    if event.partial:
+                        queue.put_nowait({"type": "text", "agent": event.author, "text": text})
+                    else:
+                        # The complete text of the partial events before it
+                        response = text
+                response = response or NO_RESPONSE
+                self._store_response(key, response)
+                queue.put_nowait({"type": "final", "response": response, "served_by": "agents"})
+            except Exception as e:
+                logger.error(f"Error in streamed orchestrator query: {e}")
+                queue.put_nowait({"type": "error", "message": f"{ERROR_PREFIX}: {str(e)}"})
+            finally:
+                queue.put_nowait(None)
+
+        try:
+            query = self._user_content(user_message, warehouse)
+            session = await self._get_session(session_id, USER_ID)
+        except Exception as e:
+            logger.error(f"Error in streamed orchestrator query: {e}")
+            yield {"type": "error", "message": f"{ERROR_PREFIX}: {str(e)}"}
+            return
+
+        # The task copies the current context: the plugin callbacks of this run publish to this queue
+        token = stream_events.set(queue)
+        try:
+            task = asyncio.create_task(run(query, session))
+        finally:
+            stream_events.reset(token)
+        try:
+            while (event := await queue.get()) is not None:
+                yield event
+        finally:
+            # The client went away: stop the agents
+            if not task.done():
+                task.cancel()
+
+    async def _fast_path(self, user_message, warehouse=None):
+        """Templated answer of a canonical question, None when the agents must answer"""
+        if type(user_message) is not str or not settings.FAST_PATH:
+            return None
+        # The analytics functions block: keep the event loop serving other requests
+        response = await asyncio.to_thread(route_query, user_message, warehouse)
+        if response is not None:
+            logger.info(f"Answered by the fast path: {user_message}")
+        return response
+
+    def _cache_key(self, user_message, warehouse=None):
+        """Response cache key of a text query, None when it cannot be cached (blocking: reads the data version)"""
+        if type(user_message) is not str or self.response_cache.max_entries <= 0:
+            return None
+        try:
+            return (normalize_query(user_message), warehouse or "", data_version(warehouse))
+        except Exception as e:
+            logger.error(f"Could not read the data version, skipping the response cache: {e}")
+            return None
+
+    async def _session_cache_key(self, user_message, session_id, USER_ID, warehouse=None):
+        """Response cache key of the first question of a session, None for follow-ups"""
+        try:
+            session = await self._get_session(session_id, USER_ID)
+        except Exception as e:
+            logger.error(f"Could not read session {session_id}, skipping the response cache: {e}")
+            return None
+        if session.events:
+            return None
+        return await asyncio.to_thread(self._cache_key, user_message, warehouse)
+
+    async def _record_cached_turn(self, user_message, session_id, USER_ID, response):
+        """Add a question answered from the cache and its answer to the session history"""
+        try:
+            session = await self._get_session(session_id, USER_ID)
+            invocation_id = Event.new_id()
+            await self.session_service.append_event(session, Event(
+                invocation_id=invocation_id, author="user",
+                content=types.Content(role="user", parts=[types.Part(text=user_message)])
+            ))
+            await self.session_service.append_event(session, Event(
+                invocation_id=invocation_id, author=self.orchestrator.name,
+                content=types.Content(role="model", parts=[types.Part(text=response)])
+            ))
+        except Exception as e:
+            logger.error(f"Could not add the cached answer to session {session_id}: {e}")
+
+    def _store_response(self, key, response):
+        """Cache an answer; errors and empty answers are not cached"""
+        if key is not None and response != NO_RESPONSE and not response.startswith(ERROR_PREFIX):
+            self.response_cache.put(key, response)
+
+    def _user_content(self, user_message, warehouse=None):
+        """
+        Convert a query string to the ADK Content format
+
+        When a warehouse is given the agents are told to pass it to every tool,
+        so the analysis covers that warehouse only.
+        """
+        if type(user_message) is not str:
+            return user_message
+        if warehouse:
+            user_message = f"{user_message}\n\n(Analyse warehouse '{warehouse}' only: pass warehouse=\"{warehouse}\" to every tool.)"
+        logger.info(f"Orchestrator processing query: {user_message}")
+        return types.Content(role="user", parts=[types.Part(text=user_message)])
+
+    async def _get_session(self, session_id, USER_ID):
+        """Return the session, creating it on first use"""
+        session = await self.session_service.get_session(
+            app_name=self.APP_NAME,
+            user_id=USER_ID,
+            session_id=session_id
+        )
+        if not session:
+            logger.info(f"Failed to retrieve session: {session_id}")
+            session = await self.session_service.create_session(
+                app_name=self.APP_NAME, 
+                user_id=USER_ID, 
+                session_id=session_id
+            )
+        return session
+
+    @staticmethod
+    def _event_text(event):
+        """Text of an event's first part, None for empty or "None" responses"""
+        if event.content and event.content.parts:
+            text = event.content.parts[0].text
+            if text and text != "None":
+                return text
+        return None
     
     
     
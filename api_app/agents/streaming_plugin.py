@@ -0,0 +1,59 @@
+import asyncio
+from contextvars import ContextVar
+from typing import Any, Optional
+from google.adk.agents.base_agent import BaseAgent
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.plugins.base_plugin import BasePlugin
+from google.adk.tools.agent_tool import AgentTool
+from google.adk.tools.base_tool import BaseTool
+from google.adk.tools.tool_context import ToolContext
+
+# Queue of the streamed request being served, set by
+# WarehouseAgentManager.stream_orchestrator. The specialists run inside the
+# orchestrator's task (AgentTool awaits their runner), so the callbacks of
+# every nested agent see the queue of the request that started them.
+stream_events: ContextVar[Optional[asyncio.Queue]] = ContextVar("stream_events", default=None)
+
+
+class StreamingPlugin(BasePlugin):
+    """Publishes agent starts and tool calls to the stream of the current request."""
+
+    def __init__(self) -> None:
+        super().__init__(name="streaming_plugin")
+
+    def _publish(self, event: dict) -> None:
+        queue = stream_events.get()
+        if queue is not None:
+            queue.put_nowait(event)
+
+    async def before_agent_callback(
+        self, *, agent: BaseAgent, callback_context: CallbackContext
+    ) -> None:
+        """An agent took over: the orchestrator, or a specialist it handed off to."""
+        self._publish({"type": "agent_start", "agent": agent.name})
+
+    async def before_tool_callback(
+        self, *, tool: BaseTool, tool_args: dict[str, Any], tool_context: ToolContext
+    ) -> None:
+        """A tool call started; specialists are called as agent tools."""
+        self._publish({
+            "type": "tool_start",
+            "agent": tool_context.agent_name,
+            "tool": tool.name,
+            "kind": "agent" if isinstance(tool, AgentTool) else "function",
+            "args": tool_args,
+        })
+
+    async def after_tool_callback(
+        self, *, tool: BaseTool, tool_args: dict[str, Any], tool_context: ToolContext, result: dict
+    ) -> None:
+        """A tool call finished."""
+        self._publish({
+            "type": "tool_end",
+            "agent": tool_context.agent_name,
+            "tool": tool.name,
+            "kind": "agent" if isinstance(tool, AgentTool) else "function",
+        })
+
+# Global instance
+streaming_plugin = StreamingPlugin()
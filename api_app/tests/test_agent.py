@@ -0,0 +1,99 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+
+api_root = os.path.abspath(os.path.join(current_dir, ".."))
+project_root = os.path.abspath(os.path.join(api_root, ".."))
+
+for path in (project_root, api_root):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+pytest.importorskip("google.adk")
+
+# config.py requires a key; no request reaches the model in these tests
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.sessions import InMemorySessionService
+from google.adk.tools.tool_context import ToolContext
+
+from agents import agent
+
+
+class StubAgentTool:
+    """Specialist answering after a pause, recording how many specialists ran at once."""
+
+    running = 0
+    most_running = 0
+
+    def __init__(self, name, error=None):
+        self.name = name
+        self.error = error
+
+    async def run_async(self, *, args, tool_context):
+        StubAgentTool.running += 1
+        StubAgentTool.most_running = max(StubAgentTool.most_running, StubAgentTool.running)
+        try:
+            tool_context.state[f"{self.name}:request"] = args["request"]
+            tool_context.state["last_specialist"] = self.name
+            await asyncio.sleep(0.05)
+            # Another specialist's writes are not visible while it runs
+            seen = sorted(key for key in tool_context.state.to_dict() if key.endswith(":request"))
+            if self.error:
+                raise self.error
+            return f"{self.name} saw {seen}"
+        finally:
+            StubAgentTool.running -= 1
+
+
+async def _tool_context():
+    service = InMemorySessionService()
+    session = await service.create_session(app_name="agents", user_id="user", state={"shared": 1})
+    context = InvocationContext(session_service=service, invocation_id="test", agent=agent.orchestrator_agent, session=session)
+    return ToolContext(context, function_call_id="call")
+
+
+def test_consult_specialists_runs_requests_concurrently_and_merges_their_state(monkeypatch):
+    monkeypatch.setattr(agent, "client_agent_tool", StubAgentTool("client_service_agent"))
+    monkeypatch.setattr(agent, "reference_agent_tool", StubAgentTool("reference_expeditions_agent", error=RuntimeError("quota")))
+    monkeypatch.setattr(agent, "stock_agent_tool", StubAgentTool("stock_analysis_agent"))
+    StubAgentTool.most_running = 0
+
+    async def consult():
+        tool_context = await _tool_context()
+        results = await agent.consult_specialists(
+            tool_context, client_request="top clients", reference_request="demand", stock_request="stock"
+        )
+        return tool_context, results
+
+    tool_context, results = asyncio.run(consult())
+    assert StubAgentTool.most_running == 3
+    assert results == {
+        "client_service_agent": "client_service_agent saw ['client_service_agent:request']",
+        "reference_expeditions_agent": "Error: quota",
+        "stock_analysis_agent": "stock_analysis_agent saw ['stock_analysis_agent:request']",
+    }
+    # Every specialist's changes reach the caller, applied in dispatch order
+    assert tool_context.state["client_service_agent:request"] == "top clients"
+    assert tool_context.state["reference_expeditions_agent:request"] == "demand"
+    assert tool_context.state["last_specialist"] == "stock_analysis_agent"
+    assert tool_context.state["shared"] == 1
+    assert set(tool_context.actions.state_delta) == {
+        "client_service_agent:request", "reference_expeditions_agent:request", "stock_analysis_agent:request", "last_specialist",
+    }
+
+
+def test_consult_specialists_skips_empty_requests(monkeypatch):
+    monkeypatch.setattr(agent, "client_agent_tool", StubAgentTool("client_service_agent"))
+    monkeypatch.setattr(agent, "stock_agent_tool", StubAgentTool("stock_analysis_agent"))
+
+    async def consult(**requests):
+        return await agent.consult_specialists(await _tool_context(), **requests)
+
+    assert list(asyncio.run(consult(client_request="top clients", stock_request="  "))) == ["client_service_agent"]
+    assert "error" in asyncio.run(consult())
@@ -0,0 +1,123 @@
+import asyncio
+import json
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+
+api_root = os.path.abspath(os.path.join(current_dir, ".."))
+project_root = os.path.abspath(os.path.join(api_root, ".."))
+
+for path in (project_root, api_root):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+pytest.importorskip("google.adk")
+pytest.importorskip("fastapi")
+
+# config.py requires a key; no request reaches the model in these tests
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+
+from fastapi import HTTPException
+from google.adk.events import Event
+from google.genai import types
+
+import IA_api
+from agents.agent import stock_agent_tool
+from agents.agent_manager import agent_manager, ERROR_PREFIX
+from agents.streaming_plugin import streaming_plugin, stream_events
+
+
+class StubRunner:
+    """Replays model events, and the plugin callbacks of a specialist call, like the ADK runner."""
+
+    def __init__(self, texts, error=None):
+        self.texts = texts
+        self.error = error
+
+    async def run_async(self, user_id, session_id, new_message, run_config=None):
+        context = SimpleNamespace(agent_name=agent_manager.orchestrator.name)
+        await streaming_plugin.before_agent_callback(agent=agent_manager.orchestrator, callback_context=context)
+        await streaming_plugin.before_tool_callback(tool=stock_agent_tool, tool_args={"request": "stock"}, tool_context=context)
+        await streaming_plugin.after_tool_callback(tool=stock_agent_tool, tool_args={"request": "stock"}, tool_context=context, result={})
+        for text in self.texts:
+            yield Event(author=agent_manager.orchestrator.name, partial=True, content=types.Content(role="model", parts=[types.Part(text=text)]))
+        if self.error:
+            raise self.error
+        yield Event(author=agent_manager.orchestrator.name, content=types.Content(role="model", parts=[types.Part(text="".join(self.texts))]))
+
+
+async def _collect(events):
+    return [event async for event in events]
+
+
+def _stream(message, **kwargs):
+    kwargs.setdefault("use_fast_path", False)
+    kwargs.setdefault("session_id", "stream-test")
+    return asyncio.run(_collect(agent_manager.stream_orchestrator(message, **kwargs)))
+
+
+def test_stream_orchestrator_yields_progress_then_final(monkeypatch):
+    monkeypatch.setattr(agent_manager, "runner", StubRunner(["Stock is ", "fine."]))
+    agent_manager.response_cache.clear()
+
+    events = _stream("How is the stock doing?")
+    assert [event["type"] for event in events] == ["agent_start", "tool_start", "tool_end", "text", "text", "final"]
+    assert events[1] == {
+        "type": "tool_start", "agent": "warehouse_orchestrator_agent", "tool": "stock_analysis_agent",
+        "kind": "agent", "args": {"request": "stock"},
+    }
+    assert [event["text"] for event in events if event["type"] == "text"] == ["Stock is ", "fine."]
+    assert events[-1] == {"type": "final", "response": "Stock is fine.", "served_by": "agents"}
+    # The queue is only published to the run's task
+    assert stream_events.get() is None
+
+    # The answer was cached: the same question opening another session is answered without the agents
+    monkeypatch.setattr(agent_manager, "runner", None)
+    assert _stream("how is the stock doing", session_id="stream-cache-test") == [
+        {"type": "final", "response": "Stock is fine.", "served_by": "cache"}
+    ]
+    session = asyncio.run(agent_manager._get_session("stream-cache-test", "default_user"))
+    assert [event.content.parts[0].text for event in session.events] == ["how is the stock doing", "Stock is fine."]
+
+    # A follow-up depends on the conversation: the agents answer it
+    monkeypatch.setattr(agent_manager, "runner", StubRunner(["Still fine."]))
+    assert _stream("how is the stock doing", session_id="stream-cache-test")[-1] == {
+        "type": "final", "response": "Still fine.", "served_by": "agents"
+    }
+
+
+def test_stream_orchestrator_reports_errors_without_caching(monkeypatch):
+    monkeypatch.setattr(agent_manager, "runner", StubRunner(["Partial"], error=RuntimeError("model unavailable")))
+    agent_manager.response_cache.clear()
+
+    events = _stream("Which references are running out?")
+    assert [event["type"] for event in events] == ["agent_start", "tool_start", "tool_end", "text", "error"]
+    assert events[-1]["message"] == f"{ERROR_PREFIX}: model unavailable"
+    assert agent_manager.response_cache.stats()["entries"] == 0
+
+
+def test_stream_endpoint_frames_events_as_server_sent_events(monkeypatch):
+    monkeypatch.setattr(agent_manager, "runner", StubRunner(["Hello"]))
+
+    async def body(query):
+        response = await IA_api.query_agent_stream(query)
+        assert response.media_type == "text/event-stream"
+        return "".join([chunk async for chunk in response.body_iterator])
+
+    text = asyncio.run(body(IA_api.AgentQuery(message="Hi", session_id="sse-test", bypass_cache=True, bypass_fast_path=True)))
+    assert text.endswith("\n\n")
+    frames = [frame.split("\n") for frame in text[:-2].split("\n\n")]
+    names = [frame[0] for frame in frames]
+    assert names == ["event: agent_start", "event: tool_start", "event: tool_end", "event: text", "event: final"]
+    for name, data in frames:
+        assert data.startswith("data: ")
+        assert json.loads(data[len("data: "):])["type"] == name[len("event: "):]
+    assert json.loads(frames[-1][1][len("data: "):])["response"] == "Hello"
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(IA_api.query_agent_stream(IA_api.AgentQuery(message="Hi", warehouse="unknown")))
+    assert error.value.status_code == 400
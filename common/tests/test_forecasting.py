@@ -0,0 +1,55 @@
+import os
+import sys
+import numpy as np
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+
+project_root = os.path.abspath(os.path.join(current_dir, "..", ".."))
+
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from common.utils import forecast_models
+from common.utils.forecast_models import FORECAST_MODELS, fit_model
+
+
+def test_models_handle_gaps_and_empty_rows():
+    served = np.array([
+        [np.nan, 10.0, 10.0, 10.0],
+        [np.nan, np.nan, np.nan, np.nan],
+        [5.0, np.nan, np.nan, 5.0],
+    ])
+    for name in FORECAST_MODELS:
+        forecasts = fit_model(name, served)
+        assert forecasts.shape == (3,)
+        assert forecasts[1] == 0.0
+        assert np.all(forecasts >= 0)
+        assert abs(forecasts[0] - 10.0) < 1e-9
+
+    # Croston: demand of 5 every 3 months
+    assert abs(fit_model("croston", served)[2] - 5.0 / 1.2) < 1e-9
+
+
+def test_parallel_fit_matches_in_process_fit():
+    rng = np.random.default_rng(3)
+    served = rng.integers(0, 20, size=(300, 24)).astype(float)
+    served[rng.random(served.shape) < 0.4] = np.nan
+    for name in ("holt", "croston"):
+        serial = fit_model(name, served, workers=1)
+        parallel = fit_model(name, served, workers=2, chunk_size=70, parallel_min_rows=1)
+        np.testing.assert_allclose(serial, parallel)
+    # Later fits reuse the same spawned workers
+    assert forecast_models._process_pool(2) is forecast_models._process_pool(2)
+    forecast_models.shutdown_pool()
+
+
+def test_rolling_origin_backtest_reports_every_model():
+    from common.utils.forecast_backtest import rolling_origin_backtest, synthetic_demand_matrix
+
+    served = synthetic_demand_matrix(n_skus=200, n_months=12, seed=1)
+    results = rolling_origin_backtest(served, min_train=6)
+    assert set(results) == set(FORECAST_MODELS)
+    for metrics in results.values():
+        assert metrics["forecasts"] > 0
+        assert np.isfinite(metrics["wape"]) and metrics["wape"] >= 0
+        assert metrics["skus_per_second"] > 0
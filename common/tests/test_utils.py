@@ -73,3 +73,739 @@ def test_get_expedition_metrics():
         assert isinstance(metrics[client]["expedition_count"], int)
         assert isinstance(metrics[client]["total_ordered"], (int, float))
         assert isinstance(metrics[client]["total_shipped"], (int, float))
+
+
+def test_columnar_cache_rebuilds_when_source_changes(tmp_path):
+    from common.utils.columnar_cache import read_excel_cached
+
+    source = tmp_path / "expediciones.xlsx"
+    cache_dir = tmp_path / "cache"
+    pd.DataFrame({"idLine": [1, 2], "Stock": ["5", 7]}).to_excel(source, index=False)
+
+    def normalize(df):
+        df["Stock"] = pd.to_numeric(df["Stock"], errors="coerce").fillna(0)
+        return df
+
+    first = read_excel_cached(str(source), normalize, str(cache_dir))
+    cached = read_excel_cached(str(source), normalize, str(cache_dir))
+    pd.testing.assert_frame_equal(first, cached)
+    assert len(list(cache_dir.glob("*.arrow"))) == 1
+
+    pd.DataFrame({"idLine": [1, 2, 3], "Stock": [5, 7, 9]}).to_excel(source, index=False)
+    os.utime(source, ns=(0, os.stat(source).st_mtime_ns + 1_000_000))
+    rebuilt = read_excel_cached(str(source), normalize, str(cache_dir))
+    assert len(rebuilt) == 3
+    assert len(list(cache_dir.glob("*.arrow"))) == 1
+
+
+def test_compact_frame_keeps_aggregates():
+    from common.utils.compact import compact_expeditions, memory_footprint
+
+    df = pd.DataFrame({
+        "id": [1, 2, 3],
+        "idLine": [10, 11, 12],
+        "idMaterial": ["A", "B", "A"],
+        "Material": ["m1", "m2", "m1"],
+        "Purchased": [2_000_000_000.0, 2_000_000_000.0, 5.0],
+        "Served": [1.5, 2.0, 3.0],
+        "Client": ["c1", "c1", "c2"],
+        "Date": pd.to_datetime(["2025-01-01", "2025-01-02", "2025-02-01"]),
+        "date_inserted": ["x", "y", "z"],
+    })
+    compact = compact_expeditions(df.copy())
+
+    assert "id" not in compact.columns and "date_inserted" not in compact.columns
+    assert isinstance(compact["Client"].dtype, pd.CategoricalDtype)
+    assert compact["Served"].dtype == "float64"
+    totals = compact.groupby("Client", observed=True)["Purchased"].sum()
+    assert totals["c1"] == 4_000_000_000
+    assert memory_footprint(compact)["rows"] == 3
+
+
+def test_snapshot_manager_appends_new_rows(tmp_path):
+    import sqlite3
+    from common.utils.snapshot import SnapshotManager, TableSpec
+
+    db_path = str(tmp_path / "logistics_data.db")
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("CREATE TABLE Ubicaciones (id INTEGER PRIMARY KEY AUTOINCREMENT, HU TEXT, Stock REAL)")
+        conn.executemany("INSERT INTO Ubicaciones (HU, Stock) VALUES (?, ?)", [("a", 1), ("b", 2)])
+
+    manager = SnapshotManager(db_path, {"stock": TableSpec("Ubicaciones", lambda df: df)}, check_interval=0)
+    first = manager.current()
+    assert len(first.stock) == 2
+    assert manager.current() is first
+
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("INSERT INTO Ubicaciones (HU, Stock) VALUES ('c', 3)")
+    second = manager.current()
+    assert second.version == first.version + 1
+    assert second.stock["HU"].tolist() == ["a", "b", "c"]
+    assert len(first.stock) == 2
+
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("DELETE FROM Ubicaciones WHERE HU = 'a'")
+    third = manager.current()
+    assert third.version == second.version + 1
+    assert third.stock["HU"].tolist() == ["b", "c"]
+
+    # Updated in place: same ids and count, still picked up
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("UPDATE Ubicaciones SET Stock = Stock + 1000000 WHERE id = (SELECT MIN(id) FROM Ubicaciones)")
+    fourth = manager.current()
+    assert fourth.version == third.version + 1
+    assert fourth.stock["Stock"].tolist() == [1000002, 3]
+    assert manager.current() is fourth
+    manager.close()
+
+
+def test_date_index_slices_match_boolean_filters():
+    from common.utils.date_index import DateIndex, slice_ranges
+
+    df = pd.DataFrame({
+        "Date": pd.to_datetime(["2024-02-10", "2024-12-31", "2025-01-01", "2025-01-20", "2025-02-03", "2025-12-05"]),
+        "Served": [1, 2, 3, 4, 5, 6],
+    })
+    index = DateIndex(df["Date"])
+
+    for year, month in [(2025, 1), (2025, None), (None, 2), (None, 12), (2023, None), (None, None)]:
+        expected = df
+        if year:
+            expected = expected[expected["Date"].dt.year == year]
+        if month:
+            expected = expected[expected["Date"].dt.month == month]
+        result = slice_ranges(df, index.period_ranges(year, month))
+        assert result["Served"].tolist() == expected["Served"].tolist()
+
+    start, stop = index.range_bounds("2024-12-31", "2025-02-03")
+    assert df.iloc[start:stop]["Served"].tolist() == [2, 3, 4]
+    assert index.years() == [2024, 2025]
+
+
+def test_client_cube_incremental_update_matches_rebuild(tmp_path):
+    import sqlite3
+    from common.utils.data_loader import prepare_expeditions
+    from common.utils.snapshot import SnapshotManager, TableSpec
+    from common.utils.client_cube import build_client_month_cube, merge_client_month_cube
+
+    db_path = str(tmp_path / "logistics_data.db")
+    insert = "INSERT INTO Expediciones (idLine, idMaterial, Material, Purchased, Served, Client, Date) VALUES (?, ?, ?, ?, ?, ?, ?)"
+    with sqlite3.connect(db_path) as conn:
+        conn.execute(
+            "CREATE TABLE Expediciones (id INTEGER PRIMARY KEY AUTOINCREMENT, idLine TEXT, idMaterial TEXT, "
+            "Material TEXT, Purchased REAL, Served REAL, Client TEXT, Date TEXT)"
+        )
+        conn.executemany(insert, [
+            ("1", "A", "a", 10, 8, "c1", "2025-01-05 10:00:00"),
+            ("2", "B", "b", 5, 5, "c2", "2025-02-01 09:00:00"),
+        ])
+
+    manager = SnapshotManager(
+        db_path, {"expeditions": TableSpec("Expediciones", prepare_expeditions, sort_by="Date")}, check_interval=0
+    )
+    manager.register_view("cube", lambda s: build_client_month_cube(s.expeditions), merge_client_month_cube)
+    assert manager.view("cube").loc[(2025, 1, "c1"), "Purchased"] == 10
+
+    with sqlite3.connect(db_path) as conn:
+        conn.executemany(insert, [
+            ("3", "A", "a", 4, 1, "c1", "2025-01-20 10:00:00"),
+            ("4", "C", "c", 7, 7, "c3", "2024-12-31 23:00:00"),
+        ])
+    snapshot = manager.current()
+    assert "cube" in snapshot.derived_cache
+    updated = manager.view("cube")
+    rebuilt = build_client_month_cube(snapshot.expeditions)
+    pd.testing.assert_frame_equal(updated, rebuilt, check_like=True)
+    assert updated.loc[(2025, 1, "c1"), "lines"] == 2
+    manager.close()
+
+
+def test_get_client_analytics_matches_individual_calls():
+    from common.utils.expedition_analysis import (
+        get_client_analytics,
+        get_client_service_level,
+        get_expedition_metrics,
+        get_top_clients,
+    )
+
+    analytics = get_client_analytics(month=2, limit=4, year=2025)
+    top_clients = get_top_clients(month=2, limit=4, year=2025)
+    assert analytics["top_clients"] == top_clients
+    assert analytics["service_levels"] == get_client_service_level(month=2, client_list=top_clients, year=2025)
+    assert analytics["metrics"] == get_expedition_metrics(month=2, client_list=top_clients, year=2025)
+
+
+def test_vectorized_moving_average_matches_per_reference_loop():
+    import numpy as np
+    from common.utils.forecasting import build_demand_matrix, moving_average_forecast
+
+    rng = np.random.default_rng(0)
+    n = 400
+    df = pd.DataFrame({
+        "idMaterial": rng.choice(["A", "B", "C", "D", "E"], size=n),
+        "Date": pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 540, size=n), unit="D"),
+        "Served": rng.integers(0, 50, size=n).astype(float),
+    })
+    # "E" only has two months of history, with a gap between them
+    df = df[(df["idMaterial"] != "E") | df["Date"].dt.month.isin([1, 6])]
+
+    matrix = build_demand_matrix(df)
+    forecasts = dict(zip(matrix.materials, np.round(moving_average_forecast(matrix.served), 2)))
+
+    for ref, ref_data in df.groupby("idMaterial"):
+        monthly = ref_data.groupby(ref_data["Date"].dt.to_period("M"))["Served"].sum()
+        expected = monthly.tail(3).mean() if len(monthly) >= 3 else monthly.mean()
+        assert forecasts[ref] == round(expected, 2)
+
+
+def test_incremental_ingest_skips_existing_rows(tmp_path, monkeypatch):
+    import sqlite3
+    from common.utils import data_to_sql
+
+    expeditions = pd.DataFrame({
+        "idLine": [1, 2, 3],
+        "idMaterial": ["m1", "m2", "m1"],
+        "Material": ["a", "b", "a"],
+        "Purchased": [10.0, 5.0, 7.0],
+        "Served": [10.0, 4.0, 7.0],
+        "Client": ["c1", "c2", "c1"],
+        "Date": pd.to_datetime(["2025-01-02 08:00:00", "2025-01-03 00:00:00", "2025-02-01 00:00:00"]),
+    })
+    stock = pd.DataFrame({
+        "Location": ["L1", "L1", "L2"],
+        "Material": ["a", "a", "b"],
+        "HU": ["h1", "h1", "h2"],
+        "Stock": [1.0, 2.0, 3.0],
+        "Date": pd.to_datetime(["2025-01-01", "2025-03-01", "2025-01-01"]),
+    })
+    db_path = str(tmp_path / "logistics_data.db")
+
+    assert data_to_sql.dataframes_to_sql(expeditions, stock, db_path=db_path) == {"expeditions": 3, "stock": 3}
+    more = pd.concat([expeditions, expeditions.assign(idLine=[4, 5, 6])], ignore_index=True)
+    assert data_to_sql.dataframes_to_sql(more, stock, db_path=db_path) == {"expeditions": 3, "stock": 0}
+
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute("SELECT idLine, datetime(Date, 'unixepoch') FROM Expediciones WHERE id = 1").fetchone() == ("1", "2025-01-02 08:00:00")
+        assert conn.execute("SELECT high_watermark FROM IngestState WHERE source = 'expeditions'").fetchone() == ("6",)
+
+    # A late line below the recorded high-watermark is still inserted
+    late = pd.concat([more, expeditions.head(1).assign(idLine=[0])], ignore_index=True)
+    assert data_to_sql.dataframes_to_sql(late, stock, db_path=db_path) == {"expeditions": 1, "stock": 0}
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute("SELECT high_watermark FROM IngestState WHERE source = 'expeditions'").fetchone() == ("6",)
+
+    # An unchanged source workbook is not read again
+    source = tmp_path / "expediciones.xlsx"
+    source.write_bytes(b"workbook")
+    loads = []
+    monkeypatch.setattr(data_to_sql, "EXPEDITIONS_SOURCE", str(source))
+    monkeypatch.setattr(data_to_sql, "STOCK_SOURCE", str(tmp_path / "missing.xlsx"))
+    monkeypatch.setattr(data_to_sql, "read_excel_cached", lambda *args: loads.append(1) or more)
+    assert data_to_sql.dataframes_to_sql(db_path=db_path)["expeditions"] == 0
+    assert data_to_sql.dataframes_to_sql(db_path=db_path)["expeditions"] == 0
+    assert len(loads) == 1
+
+
+def test_streaming_ingest_matches_full_load(tmp_path):
+    import sqlite3
+    from common.utils import data_to_sql
+    from common.utils.data_loader import iter_source_batches, normalize_expeditions
+
+    source = str(tmp_path / "expediciones.xlsx")
+    pd.DataFrame({
+        "idLine": [5, 3, 9, 4, 7],
+        "idMaterial": ["m1", "m2", "m1", "m3", "m2"],
+        "Material": ["a", "b", "a", "c", "b"],
+        "Purchased": [10, 5, 7, 1, 2],
+        "Served": [10, 4, 7, 1, 2],
+        "Client": [11, 12, 11, 13, 12],
+        "Date": pd.to_datetime(["2025-01-02 08:00:00", "2025-01-03 00:00:00", "2025-02-01 00:00:00", "2025-02-05 10:30:00", "2025-03-01 00:00:00"]),
+    }).to_excel(source, index=False)
+
+    batches = list(iter_source_batches(source, normalize_expeditions, batch_size=2))
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+    streamed = pd.concat(batches, ignore_index=True)
+    pd.testing.assert_frame_equal(streamed, normalize_expeditions(pd.read_excel(source)), check_dtype=False)
+
+    full_db, stream_db = str(tmp_path / "full.db"), str(tmp_path / "stream.db")
+    empty_stock = pd.DataFrame()
+    data_to_sql.dataframes_to_sql(normalize_expeditions(pd.read_excel(source)), empty_stock, db_path=full_db)
+    inserted = data_to_sql.dataframes_to_sql(df_stock=empty_stock, db_path=stream_db, stream=True, batch_size=2, expeditions_source=source)
+    assert inserted["expeditions"] == 5
+
+    query = "SELECT idLine, idMaterial, Material, Purchased, Served, Client, Date FROM Expediciones ORDER BY id"
+    with sqlite3.connect(full_db) as full, sqlite3.connect(stream_db) as stream:
+        assert full.execute(query).fetchall() == stream.execute(query).fetchall()
+
+
+def test_schema_migration_keeps_rows_and_types_dates(tmp_path):
+    import sqlite3
+    import pytest
+    from common.utils import sql_backend
+    from common.utils.schema import SCHEMA_VERSION, migrate
+    from common.utils.data_loader import normalize_expeditions
+
+    db_path = str(tmp_path / "logistics_data.db")
+    with sqlite3.connect(db_path) as conn:
+        # Layout written by the original ingest: text dates, no indexes
+        conn.execute(
+            "CREATE TABLE Expediciones (id INTEGER PRIMARY KEY AUTOINCREMENT, idLine TEXT NOT NULL, "
+            "idMaterial TEXT NOT NULL, Material TEXT, Purchased REAL, Served REAL, Client TEXT, Date TEXT, "
+            "date_inserted TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+        )
+        conn.executemany(
+            "INSERT INTO Expediciones (id, idLine, idMaterial, Purchased, Served, Client, Date) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(3, "7", "m1", 5, 5, "c1", "2025-01-16 18:47:15"), (8, "9", "m2", 2, 1, "c2", None)],
+        )
+        before = pd.read_sql_query("SELECT * FROM Expediciones", conn)
+
+    # Text dates cannot be filtered by the SQL queries: refused rather than answered empty
+    with pytest.raises(RuntimeError, match="migrate"):
+        sql_backend.client_totals(2025, 1, db_path)
+
+    with sqlite3.connect(db_path) as conn:
+        assert migrate(conn) == SCHEMA_VERSION
+        assert migrate(conn) == SCHEMA_VERSION
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert conn.execute("SELECT id, typeof(Date) FROM Expediciones ORDER BY id").fetchall() == [(3, "integer"), (8, "null")]
+        plan = conn.execute("EXPLAIN QUERY PLAN SELECT SUM(Served) FROM Expediciones WHERE Date >= 0 AND Client = 'c1'").fetchall()
+        assert "ix_expediciones_date_client" in str(plan)
+        conn.execute("INSERT INTO Expediciones (idLine, idMaterial, Date) VALUES ('10', 'm1', 0)")
+        assert conn.execute("SELECT MAX(id) FROM Expediciones").fetchone()[0] == 9
+        after = pd.read_sql_query("SELECT * FROM Expediciones WHERE id < 9", conn)
+
+    pd.testing.assert_series_equal(
+        normalize_expeditions(after)["Date"], normalize_expeditions(before)["Date"]
+    )
+
+
+def test_sql_backend_matches_pandas_backend(monkeypatch):
+    from common.utils import settings
+    from common.utils.expedition_analysis import get_client_analytics
+    from common.utils.reference_analysis import get_top_references_expeditions, get_reference_time_series
+    from common.utils.stock_analysis import get_top_references_stock, get_stock_metrics, get_avg_time_in_warehouse
+
+    def run():
+        references = get_top_references_expeditions(month=2, limit=5, year=2025)
+        stock_references = get_top_references_stock(5) + ["missing"]
+        return {
+            "clients": [get_client_analytics(month=m, limit=5, year=y) for y, m in [(2025, 2), (2025, 0), (None, 1), (None, None)]],
+            "references": references,
+            "time_series": get_reference_time_series(0, references + ["missing"], 2025),
+            "empty_period": get_reference_time_series(1, references[:2], 1999),
+            "stock": stock_references,
+            "stock_metrics": get_stock_metrics(stock_references),
+            "avg_time": get_avg_time_in_warehouse(stock_references),
+        }
+
+    monkeypatch.setattr(settings, "ANALYTICS_BACKEND", "pandas")
+    expected = run()
+    assert expected["empty_period"] == {ref: {"dates": [], "quantities": []} for ref in expected["references"][:2]}
+    monkeypatch.setattr(settings, "ANALYTICS_BACKEND", "sql")
+    assert run() == expected
+
+
+def test_projected_read_matches_filtered_snapshot():
+    df = data_loader.expeditions_data_sql()
+    clients = df["Client"].astype(str).value_counts().index[:3].tolist()
+    start, end = pd.Timestamp("2025-01-01"), pd.Timestamp("2025-03-01")
+
+    projected = data_loader.read_expeditions(
+        columns=["idMaterial", "Date", "Served", "Client"], start=start, end=end, clients=clients
+    )
+    assert list(projected.columns) == ["idMaterial", "Date", "Served", "Client"]
+    assert pd.api.types.is_datetime64_any_dtype(projected["Date"])
+
+    expected = df[(df["Date"] >= start) & (df["Date"] < end) & df["Client"].astype(str).isin(clients)]
+    assert len(projected) == len(expected) > 0
+    assert projected["Served"].sum() == expected["Served"].sum()
+    assert data_loader.read_expeditions(columns=["Served"], materials=[]).empty
+    assert len(data_loader.read_stock(columns=["Material", "Stock"])) == len(data_loader.stock_data_sql())
+
+
+def test_shared_snapshot_is_published_and_attached(tmp_path, monkeypatch):
+    import sqlite3
+    from common.utils import shared_snapshot
+    from common.utils.snapshot import SnapshotManager, TableSpec
+    from common.utils.shared_snapshot import SharedSnapshotManager, publish_snapshot
+
+    db_path, shared_dir = str(tmp_path / "logistics_data.db"), str(tmp_path / "shared")
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("CREATE TABLE Ubicaciones (id INTEGER PRIMARY KEY AUTOINCREMENT, HU TEXT, Stock REAL)")
+        conn.executemany("INSERT INTO Ubicaciones (HU, Stock) VALUES (?, ?)", [("a", 1), ("b", 2)])
+    tables = {"stock": TableSpec("Ubicaciones", lambda df: df)}
+
+    manager = SharedSnapshotManager(shared_dir, db_path, tables, check_interval=0)
+    assert manager.current().stock["HU"].tolist() == ["a", "b"]
+
+    publish_snapshot(db_path, shared_dir, tables)
+    attached = manager.current()
+    assert attached.version == 2
+    assert attached.stock["Stock"].to_numpy().flags.writeable is False
+    pd.testing.assert_frame_equal(attached.stock, SnapshotManager(db_path, tables).current().stock)
+
+    # Writes that are not published yet are read from the database
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("INSERT INTO Ubicaciones (HU, Stock) VALUES ('c', 3)")
+    assert manager.current().version == 3
+    assert manager.current().stock["HU"].tolist() == ["a", "b", "c"]
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("UPDATE Ubicaciones SET Stock = 30 WHERE HU = 'c'")
+    assert manager.current().version == 4
+    assert manager.current().stock["Stock"].tolist() == [1, 2, 30]
+    assert SharedSnapshotManager(shared_dir, db_path, tables).current().stock["Stock"].tolist() == [1, 2, 30]
+
+    # A failed attach is retried on the next check
+    def fail_once(path):
+        monkeypatch.undo()
+        raise OSError("mapping failed")
+
+    monkeypatch.setattr(shared_snapshot, "attach_frame", fail_once)
+    manifest = publish_snapshot(db_path, shared_dir, tables)
+    assert manifest["version"] == 2
+    assert manager.current().version == 4
+    assert manager.current().version == 5
+    assert manager.current().stock["Stock"].to_numpy().flags.writeable is False
+    assert manager.current().stock["Stock"].tolist() == [1, 2, 30]
+    assert sorted(os.listdir(shared_dir)) == ["manifest.json", "stock-2.arrow"]
+
+    # A process starting after the publication gets the published version
+    assert SharedSnapshotManager(shared_dir, db_path, tables).current().version == 2
+
+
+def test_month_partitions_are_synced_read_and_compacted(tmp_path):
+    import sqlite3
+    from common.utils import data_to_sql
+    from common.utils.partitions import compact_partitions, read_manifest, read_partitions
+
+    expeditions = pd.DataFrame({
+        "idLine": [1, 2, 3],
+        "idMaterial": ["m1", "m2", "m1"],
+        "Material": ["a", "b", "a"],
+        "Purchased": [10.0, 5.0, 7.0],
+        "Served": [10.0, 4.0, 7.0],
+        "Client": ["c1", "c2", "c1"],
+        "Date": pd.to_datetime(["2025-01-20 00:00:00", "2025-01-03 00:00:00", "2025-02-01 00:00:00"]),
+    })
+    db_path, root = str(tmp_path / "logistics_data.db"), str(tmp_path / "partitions")
+    empty_stock = pd.DataFrame()
+    data_to_sql.dataframes_to_sql(expeditions, empty_stock, db_path=db_path, partition=True, partitions_dir=root)
+    more = expeditions.assign(idLine=[4, 5, 6], Date=pd.to_datetime(["2025-01-10", "2025-03-01", "2024-12-31"]))
+    data_to_sql.dataframes_to_sql(more, empty_stock, db_path=db_path, partition=True, partitions_dir=root)
+
+    manifest = read_manifest(root)
+    assert manifest["exported_id"] == 6 and manifest["rows"] == 6
+    assert list(manifest["partitions"]) == ["2024-12", "2025-01", "2025-02", "2025-03"]
+    assert len(manifest["partitions"]["2025-01"]) == 2
+
+    # Only the matching partitions are read, sorted by date like the snapshot
+    january = read_partitions(root, year=2025, month=1)
+    assert january["idLine"].tolist() == ["2", "4", "1"]
+    assert read_partitions(root, month=12)["idLine"].tolist() == ["6"]
+    assert read_partitions(root, year=2025, columns=["Served"]).columns.tolist() == ["Served"]
+    assert len(read_partitions(root)) == 6
+
+    compacted = compact_partitions(root)
+    assert all(len(files) == 1 for files in compacted["partitions"].values())
+    pd.testing.assert_frame_equal(read_partitions(root, year=2025, month=1), january)
+    assert len([name for name in os.listdir(os.path.join(root, "2025-01")) if name.endswith(".parquet")]) == 1
+
+    # Rows deleted from the database trigger a rebuild on the next sync
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("DELETE FROM Expediciones WHERE idLine = '2'")
+    data_to_sql.dataframes_to_sql(more.assign(idLine=[7, 8, 9]), empty_stock, db_path=db_path, partition=True, partitions_dir=root)
+    assert read_partitions(root, year=2025, month=1)["idLine"].tolist() == ["4", "7", "1"]
+    assert read_manifest(root)["rows"] == 8
+
+
+def test_warehouse_fan_out_merges_partial_aggregates(tmp_path, monkeypatch):
+    from datetime import datetime
+    from common.utils import data_to_sql, warehouses
+
+    expeditions = pd.DataFrame({
+        "idLine": [1, 2, 3, 4, 5, 6],
+        "idMaterial": ["m1", "m2", "m1", "m3", "m2", "m3"],
+        "Material": ["a", "b", "a", "c", "b", "c"],
+        "Purchased": [10.0, 5.0, 7.0, 6.0, 2.0, 3.0],
+        "Served": [10.0, 4.0, 7.0, 6.0, 2.0, 1.0],
+        "Client": ["c1", "c2", "c1", "c3", "c2", "c1"],
+        "Date": pd.to_datetime(["2025-01-02", "2025-01-03", "2025-02-01", "2025-02-05", "2025-03-01", "2025-03-02"]),
+    })
+    stock = pd.DataFrame({
+        "Location": ["N1", "N2", "S1", "S1"],
+        "Material": ["a", "b", "a", "c"],
+        "HU": ["h1", "h2", "h3", "h4"],
+        "Stock": [4.0, 9.0, 5.0, 1.0],
+        "Date": pd.to_datetime(["2025-01-01", "2025-02-01", "2025-01-15", "2025-03-01"]),
+    })
+    north, south = expeditions.index % 2 == 0, stock["Location"].str.startswith("N")
+    for name, lines, stored in [("north", expeditions[north], stock[south]), ("south", expeditions[~north], stock[~south]), ("all", expeditions, stock)]:
+        data_to_sql.dataframes_to_sql(lines, stored, db_path=str(tmp_path / f"{name}.db"))
+
+    monkeypatch.setattr(warehouses, "SHARDS", warehouses.parse_shards(f"north={tmp_path / 'north.db'},south={tmp_path / 'south.db'}"))
+    assert warehouses.available_warehouses() == ["north", "south"]
+    now = datetime(2025, 6, 1)
+
+    # Merged over both shards vs computed on one database holding every row
+    def merged_and_single(function, *args, **kwargs):
+        merged = function(*args, **kwargs)
+        with monkeypatch.context() as patched:
+            patched.setattr(warehouses, "SHARDS", warehouses.parse_shards(f"all={tmp_path / 'all.db'}"))
+            return merged, function(*args, **kwargs)
+
+    for function, args, kwargs in [
+        (warehouses.client_totals, (2025, None), {}),
+        (warehouses.top_references, (2025, 0, 2), {}),
+        (warehouses.reference_time_series, (2025, 0, ["m1", "m3", "x"]), {}),
+        (warehouses.reference_time_series, (1999, 1, ["m1", "x"]), {}),
+        (warehouses.top_stock_references, (3,), {}),
+        (warehouses.stock_metrics, (["a", "b", "x"],), {}),
+        (warehouses.avg_time_in_warehouse, (["a", "c"],), {"now": now}),
+        (warehouses.forecasts, ("moving_average",), {}),
+    ]:
+        merged, expected = merged_and_single(function, *args, **kwargs)
+        if isinstance(expected, pd.DataFrame):
+            pd.testing.assert_frame_equal(merged, expected)
+        else:
+            assert merged == expected
+
+    assert warehouses.top_stock_references(3, warehouse="north") == ["b", "a"]
+    assert warehouses.top_references(2025, 0, 5, warehouse="unknown") == []
+
+    # A lone warehouse in the default database reads the snapshot, even when selected by name
+    monkeypatch.setattr(warehouses, "SHARDS", warehouses.parse_shards(""))
+    assert not warehouses.sharded() and not warehouses.sharded(warehouses.DEFAULT_WAREHOUSE)
+    assert warehouses.sharded("unknown")
+    monkeypatch.setattr(warehouses, "SHARDS", warehouses.parse_shards(f"north={tmp_path / 'north.db'}"))
+    assert warehouses.sharded("north")
+
+
+def test_period_top_k_is_maintained_incrementally():
+    import numpy as np
+    from common.utils.topk import PeriodTopK
+
+    rng = np.random.default_rng(7)
+    rows = pd.DataFrame({
+        "idMaterial": [f"m{i}" for i in rng.integers(0, 40, 600)],
+        "Purchased": rng.integers(0, 50, 600).astype(float),
+        "Date": pd.Timestamp("2024-11-01") + pd.to_timedelta(rng.integers(0, 120, 600), unit="D"),
+    })
+
+    def expected(df, limit):
+        totals = df.groupby("idMaterial")["Purchased"].sum()
+        return [str(ref) for ref in totals.nlargest(limit).index]
+
+    full = PeriodTopK("idMaterial", "Purchased", count_undated=True, mode="exact", size=5).updated(rows)
+    incremental = PeriodTopK("idMaterial", "Purchased", count_undated=True, mode="exact", size=5)
+    for start in range(0, len(rows), 100):
+        incremental = incremental.updated(rows.iloc[start:start + 100])
+
+    # Updating returns a new tracker, the previous one is left unchanged
+    first = PeriodTopK("idMaterial", "Purchased", count_undated=True, mode="exact", size=5).updated(rows.iloc[:100])
+    first.updated(rows.iloc[100:])
+    assert first.top(limit=5) == expected(rows.iloc[:100], 5)
+
+    for year, month in [(None, None), (2025, None), (None, 1), (2024, 12), (2025, 2)]:
+        period = rows
+        if year:
+            period = period[period["Date"].dt.year == year]
+        if month:
+            period = period[period["Date"].dt.month == month]
+        for limit in (3, 5, 8):
+            assert full.top(year, month, limit) == expected(period, limit)
+            assert incremental.top(year, month, limit) == expected(period, limit)
+    assert incremental.top(2030, 1) == []
+
+    # A negative amount (a returned line) re-ranks before the tracker is published
+    returned = rows.iloc[:1].assign(idMaterial=expected(rows, 1)[0], Purchased=-10_000.0)
+    corrected = full.updated(returned)
+    assert not corrected.rollups[(0, 0)].stale
+    assert corrected.top(limit=5) == expected(pd.concat([rows, returned]), 5)
+    assert full.top(limit=5) == expected(rows, 5)
+
+    # With enough counters the sketch is exact, with fewer it keeps the heavy hitters
+    assert PeriodTopK("idMaterial", "Purchased", True, mode="sketch", capacity=40).updated(rows).top(limit=5) == expected(rows, 5)
+    heavy = pd.concat([rows, pd.DataFrame({"idMaterial": ["hot"], "Purchased": [10_000.0], "Date": [pd.Timestamp("2025-01-05")]})])
+    assert PeriodTopK("idMaterial", "Purchased", True, mode="sketch", capacity=10).updated(heavy).top(limit=1) == ["hot"]
+
+
+def test_aging_index_answers_any_as_of_date():
+    import numpy as np
+    from common.utils.aging import AgingIndex, as_of_ns
+
+    rng = np.random.default_rng(3)
+    rows = pd.DataFrame({
+        "Material": [f"m{i}" for i in rng.integers(0, 12, 400)],
+        "Date": pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 500 * 86400, 400), unit="s"),
+    })
+    rows.loc[::50, "Date"] = pd.NaT
+
+    full = AgingIndex.from_frame(rows)
+    incremental = AgingIndex()
+    for start in range(0, len(rows), 80):
+        incremental = incremental.updated(rows.iloc[start:start + 80])
+
+    for as_of in ["2025-03-01", "2024-09-15 13:30:00", "2025-12-31 23:59:59"]:
+        days = (pd.Timestamp(as_of) - rows["Date"]).dt.days
+        expected = days.groupby(rows["Material"]).mean().round(1).to_dict()
+        for index in (full, incremental):
+            assert index.mean_days(list(expected) + ["nope"], as_of_ns(as_of)) == expected
+        ages = days[rows["Material"] == "m0"].dropna().to_numpy()
+        assert full.percentile_days("m0", as_of_ns(as_of), 90) == round(float(np.percentile(ages, 90)), 1)
+        buckets = full.histogram("m0", as_of_ns(as_of), (30, 90))
+        assert list(buckets) == ["<30", "30-89", "90+"]
+        assert list(buckets.values()) == [int((ages < 30).sum()), int(((ages >= 30) & (ages < 90)).sum()), int((ages >= 90).sum())]
+
+
+def test_stock_summary_keeps_distinct_counts_on_update():
+    from common.utils.stock_summary import StockSummary
+
+    rows = pd.DataFrame({
+        "Material": ["a", "a", "b", "a", "b", "a"],
+        "Location": ["L1", "L2", "L1", "L1", None, "L3"],
+        "HU": ["h1", "h2", "h3", "h1", "h4", "h5"],
+        "Stock": [5, 3, 2, 1, 4, 6],
+        "Date": pd.to_datetime(["2025-01-03", "2025-02-01", None, "2024-12-30", "2025-03-01", "2025-01-10"]),
+    })
+    expected = {
+        "a": {"total_pieces": 15.0, "location_count": 3, "hu_count": 3, "oldest_entry": "2024-12-30", "newest_entry": "2025-02-01"},
+        "b": {"total_pieces": 6.0, "location_count": 1, "hu_count": 2, "oldest_entry": "2025-03-01", "newest_entry": "2025-03-01"},
+        "c": {"total_pieces": 0.0, "location_count": 0, "hu_count": 0, "oldest_entry": None, "newest_entry": None},
+    }
+
+    first = StockSummary.from_frame(rows.iloc[:3])
+    incremental = first.updated(rows.iloc[3:])
+    assert StockSummary.from_frame(rows).metrics(["a", "b", "c"]) == expected
+    assert incremental.metrics(["a", "b", "c"]) == expected
+    # The summary a snapshot published is left unchanged
+    assert first.metrics(["a"])["a"]["location_count"] == 2
+
+
+def test_result_cache_evicts_least_recently_used_and_expired_entries():
+    from common.utils.result_cache import ResultCache
+
+    now = [0.0]
+    cache = ResultCache(max_entries=2, ttl=10, clock=lambda: now[0])
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == (True, 1)
+    cache.put("c", 3)  # "b" is the least recently used
+    assert cache.get("b") == (False, None)
+    now[0] = 11
+    assert cache.get("a") == (False, None)
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"], stats["expirations"]) == (1, 2, 1, 1)
+
+    disabled = ResultCache(max_entries=0)
+    disabled.put("a", 1)
+    assert disabled.get("a") == (False, None)
+
+
+def test_memoized_tool_is_keyed_by_arguments_and_data_version(monkeypatch):
+    import inspect
+    from common.utils import memoize
+
+    calls = []
+
+    def tool(reference_list, limit: int = 5, warehouse=None):
+        """Example tool."""
+        calls.append((tuple(reference_list), limit, warehouse))
+        return {"refs": list(reference_list)[:limit]}
+
+    version = [1]
+    monkeypatch.setattr(memoize, "data_version", lambda warehouse=None: (warehouse, version[0]))
+    cached = memoize.memoize_tool(tool, max_entries=8, ttl=0)
+    assert memoize.memoize_tool(tool) is cached
+    assert cached.__name__ == "tool" and cached.__doc__ == "Example tool."
+    assert inspect.signature(cached) == inspect.signature(tool)
+
+    assert cached(["a", "b"]) == {"refs": ["a", "b"]}
+    assert cached(reference_list=["a", "b"], limit=5) == {"refs": ["a", "b"]}
+    cached(["a", "b"], warehouse="north")
+    version[0] = 2
+    cached(["a", "b"])
+    assert len(calls) == 3
+    assert memoize.tool_cache_stats()["tool"]["hits"] == 1
+
+
+def test_database_version_moves_on_writes_without_scanning(tmp_path, monkeypatch):
+    import sqlite3
+    from common.utils import sql_backend
+    from common.utils.schema import SCHEMA_VERSION
+
+    db_path = str(tmp_path / "logistics_data.db")
+    with sqlite3.connect(db_path) as conn:
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.execute("CREATE TABLE Ubicaciones (id INTEGER PRIMARY KEY AUTOINCREMENT, HU TEXT)")
+        conn.execute("INSERT INTO Ubicaciones (HU) VALUES ('a')")
+
+    queries = []
+    run_query = sql_backend.query
+    monkeypatch.setattr(sql_backend, "query", lambda sql, *args, **kwargs: queries.append(sql) or run_query(sql, *args, **kwargs))
+
+    version = sql_backend.database_version(db_path)
+    assert sql_backend.database_version(db_path) == version
+    assert sql_backend.table_signature("Ubicaciones", db_path) == (1, 1)
+    assert sql_backend.table_signature("Ubicaciones", db_path) == (1, 1)
+    assert len(queries) == 1
+
+    # A commit from another connection moves the version, and the signature is read again
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("INSERT INTO Ubicaciones (HU) VALUES ('b')")
+    assert sql_backend.database_version(db_path) > version
+    assert sql_backend.table_signature("Ubicaciones", db_path) == (2, 2)
+    assert len(queries) == 2
+
+
+def test_fast_path_matches_canonical_questions_only():
+    from datetime import date
+    from common.utils.expedition_analysis import get_top_clients
+    from common.utils.query_router import Intent, parse_query, route_query
+
+    today = date(2025, 6, 15)
+    assert parse_query("Show me the top 3 clients for this year in month 1", today) == Intent("top_clients", 3, 2025, 1)
+    assert parse_query("Forecast next month demand for our most shipped references", today) == Intent("forecast")
+    assert parse_query("Analyze inventory aging for our top five stock references", today) == Intent("stock_aging", 5)
+    assert parse_query("top 8 references in May 2024", today) == Intent("top_references", 8, 2024, 5)
+    assert parse_query("What are our top stock levels?", today) == Intent("top_stock")
+    for question in ["Why did the service level drop?", "Top clients and stock aging", "Generate a service level report", "hello"]:
+        assert parse_query(question, today) is None
+
+    # Relative months carry their year, January's last month is in the previous year
+    assert parse_query("top clients last month", today) == Intent("top_clients", 5, 2025, 5)
+    assert parse_query("top clients this month", today) == Intent("top_clients", 5, 2025, 6)
+    assert parse_query("top clients last month", date(2025, 1, 10)) == Intent("top_clients", 5, 2024, 12)
+
+    # Qualifiers the templates cannot honour are left to the agents
+    for question in [
+        "Which references have the oldest stock?",
+        "top clients with service below 90%",
+        "What are our top clients' service levels?",
+        "top references with more than 100 units shipped",
+        "top clients in month 13",
+        "top 10 clients",
+        "top 20 references in May 2024",
+        "the least ordered references",
+    ]:
+        assert parse_query(question, today) is None, question
+
+    # Ranges, windows, quarters and several periods too
+    for question in [
+        "top 5 clients between january and march",
+        "top 5 clients for months 1 to 3",
+        "top clients in the last 3 months",
+        "top 5 references for the first 3 months",
+        "top clients in q1 2025",
+        "top clients for each month of 2025",
+        "top 2 clients in 2019 and 2020",
+        "top clients in january and february",
+        "top references in month 1-3",
+    ]:
+        assert parse_query(question, today) is None, question
+
+    answer = route_query("show top 3 clients for january 2025")
+    for client in get_top_clients(month=1, limit=3, year=2025):
+        assert client in answer
+    # No data for the period: the agents answer
+    assert route_query("top clients in 2031") is None
@@ -0,0 +1,274 @@
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+from .data_loader import DB_PATH, parse_dates, snapshot_manager
+from .date_index import DateLike
+from .snapshot import DatasetSnapshot
+from . import sql_backend
+from . import settings
+from .logger import setup_logger
+
+logger = setup_logger('common.utils.aging')
+
+AGING_VIEW = "stock_aging"
+
+DAY_NS = 86_400 * 10**9
+
+# Database aging indexes with the Ubicaciones signature they were built for
+_database_cache: Dict[str, tuple] = {}
+
+
+class MaterialAges(NamedTuple):
+    """Entry dates of the dated HUs of one material."""
+    entries: np.ndarray  # sorted entry times, ns since the epoch
+    times_of_day: np.ndarray  # sorted entry times within their day, ns
+    day_sum: int  # sum of the entry days (entry // DAY_NS)
+
+
+def as_of_ns(as_of: Optional[DateLike] = None) -> int:
+    """Reference time in ns since the epoch, the current time if not given."""
+    return int(pd.Timestamp(as_of if as_of is not None else datetime.now()).value)
+
+
+def age_bucket_labels(bounds: Tuple[int, ...]) -> List[str]:
+    """Labels of the age histogram: ``<30``, ``30-89``, ..., ``365+``."""
+    labels = [f"<{bounds[0]}"]
+    labels += [f"{low}-{high - 1}" for low, high in zip(bounds, bounds[1:])]
+    return labels + [f"{bounds[-1]}+"]
+
+
+class AgingIndex:
+    """
+    Entry dates of the stock grouped by material.
+
+    The whole days an HU has spent in the warehouse at a reference time
+    ``A`` are ``floor((A - entry) / 1 day)``. Splitting both times into a
+    day and a time of day, that is ``day(A) - day(entry)``, minus one when
+    the HU entered later in its day than ``A``. The mean age of a material
+    is therefore ``day(A) - day_sum / count`` corrected by the number of
+    entry times of day above ``A``'s (a binary search), and histograms and
+    percentiles are binary searches in the sorted entry times: any as-of
+    date is answered without touching the rows. Updates return a new index
+    sharing the untouched materials.
+    """
+
+    def __init__(self, materials: Optional[Dict[str, MaterialAges]] = None):
+        self.materials: Dict[str, MaterialAges] = materials or {}
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> "AgingIndex":
+        """
+        Build the index of stock rows.
+
+        Args:
+            df (pd.DataFrame): Stock rows with Material and Date
+
+        Returns:
+            AgingIndex: Rows without a material are ignored, rows without a date
+            only register their material
+        """
+        if df.empty or "Material" not in df.columns:
+            return cls()
+        df = df[df["Material"].notna()]
+        materials = df["Material"].astype(str).to_numpy()
+        dates = df["Date"].astype("datetime64[ns]")
+        dated = dates.notna().to_numpy()
+        entries = dates.to_numpy().view("int64")
+
+        index = {str(material): _ages(np.array([], dtype="int64")) for material in pd.unique(materials[~dated])}
+        materials, entries = materials[dated], entries[dated]
+        order = np.lexsort((entries, materials))
+        materials, entries = materials[order], entries[order]
+        starts = np.flatnonzero(np.r_[True, materials[1:] != materials[:-1]]) if len(materials) else np.array([], dtype="int64")
+        for material, group in zip(materials[starts], np.split(entries, starts[1:])):
+            index[str(material)] = _ages(group)
+        return cls(index)
+
+    def merged(self, other: "AgingIndex") -> "AgingIndex":
+        """
+        Return an index holding the entries of both indexes.
+
+        Args:
+            other (AgingIndex): Index of other rows (new stock, another warehouse)
+
+        Returns:
+            AgingIndex: New index (self when other is empty)
+        """
+        if not other.materials:
+            return self
+        materials = dict(self.materials)
+        for material, ages in other.materials.items():
+            current = materials.get(material)
+            if current is None:
+                materials[material] = ages
+            elif len(ages.entries):
+                materials[material] = _ages(np.sort(np.concatenate([current.entries, ages.entries]), kind="mergesort"))
+        return AgingIndex(materials)
+
+    def updated(self, df: pd.DataFrame) -> "AgingIndex":
+        """Return an index including the given stock rows."""
+        return self.merged(AgingIndex.from_frame(df))
+
+    def total_days(self, material: str, as_of: int) -> Tuple[int, int]:
+        """
+        Sum of the whole days in warehouse and number of dated HUs of a material.
+
+        Args:
+            material (str): Material name
+            as_of (int): Reference time in ns since the epoch
+
+        Returns:
+            Tuple[int, int]: Days and HUs, (0, 0) for an unknown material
+        """
+        ages = self.materials.get(material)
+        if ages is None or not len(ages.entries):
+            return 0, 0
+        day, time_of_day = divmod(as_of, DAY_NS)
+        count = len(ages.entries)
+        later = count - int(np.searchsorted(ages.times_of_day, time_of_day, side="right"))
+        return count * day - ages.day_sum - later, count
+
+    def mean_days(self, reference_list: Iterable[str], as_of: int) -> Dict[str, float]:
+        """
+        Average whole days in warehouse, rounded to one decimal.
+
+        Args:
+            reference_list (Iterable[str]): Material names
+            as_of (int): Reference time in ns since the epoch
+
+        Returns:
+            Dict[str, float]: Average per material present in stock, sorted by
+            material, NaN when none of its HUs has a date
+        """
+        present = sorted({str(ref) for ref in reference_list} & self.materials.keys())
+        totals = np.array([self.total_days(material, as_of) for material in present], dtype="float64").reshape(-1, 2)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = np.round(totals[:, 0] / totals[:, 1], 1)
+        return {material: float(mean) for material, mean in zip(present, means)}
+
+    def _count_older(self, entries: np.ndarray, as_of: int, days: int) -> int:
+        """Number of entries at least ``days`` whole days old."""
+        return int(np.searchsorted(entries, as_of - days * DAY_NS, side="right"))
+
+    def histogram(self, material: str, as_of: int, bounds: Tuple[int, ...]) -> Dict[str, int]:
+        """
+        Number of HUs of a material per age bucket.
+
+        Args:
+            material (str): Material name
+            as_of (int): Reference time in ns since the epoch
+            bounds (Tuple[int, ...]): Increasing bucket limits in days
+
+        Returns:
+            Dict[str, int]: HUs per bucket label (see ``age_bucket_labels``)
+        """
+        ages = self.materials.get(material)
+        entries = ages.entries if ages is not None else np.array([], dtype="int64")
+        older = [len(entries)] + [self._count_older(entries, as_of, days) for days in bounds] + [0]
+        return {label: older[i] - older[i + 1] for i, label in enumerate(age_bucket_labels(bounds))}
+
+    def percentile_days(self, material: str, as_of: int, percentile: float) -> float:
+        """
+        Age percentile of the HUs of a material, interpolated like ``numpy.percentile``.
+
+        Args:
+            material (str): Material name
+            as_of (int): Reference time in ns since the epoch
+            percentile (float): Percentile between 0 and 100
+
+        Returns:
+            float: Whole days, rounded to one decimal; NaN without dated HUs
+        """
+        ages = self.materials.get(material)
+        if ages is None or not len(ages.entries):
+            return float("nan")
+        count = len(ages.entries)
+        # The youngest HU is the latest entry: ascending ages walk the entries backwards
+        position = (count - 1) * percentile / 100
+        low = int(np.floor(position))
+        high = min(low + 1, count - 1)
+        low_age = (as_of - int(ages.entries[count - 1 - low])) // DAY_NS
+        high_age = (as_of - int(ages.entries[count - 1 - high])) // DAY_NS
+        return float(np.round(low_age + (position - low) * (high_age - low_age), 1))
+
+
+def _ages(entries: np.ndarray) -> MaterialAges:
+    entries = np.asarray(entries, dtype="int64")
+    days, times_of_day = np.divmod(entries, DAY_NS)
+    return MaterialAges(entries, np.sort(times_of_day), int(days.sum()))
+
+
+def _build(snapshot: DatasetSnapshot) -> AgingIndex:
+    return AgingIndex.from_frame(snapshot.stock)
+
+
+def _update(index: AgingIndex, deltas: Dict[str, pd.DataFrame]) -> AgingIndex:
+    new_rows = deltas.get("stock")
+    if new_rows is None or new_rows.empty:
+        return index
+    logger.info(f"Updating the stock aging index with {len(new_rows)} new stock rows.")
+    return index.updated(new_rows)
+
+
+snapshot_manager.register_view(AGING_VIEW, _build, _update)
+
+
+def database_index(db_path: str = DB_PATH) -> AgingIndex:
+    """
+    Aging index of a database's Ubicaciones table, rebuilt when the table changes.
+
+    Args:
+        db_path (str): SQLite database file
+
+    Returns:
+        AgingIndex: Index of the stored stock
+    """
+    signature = sql_backend.table_signature("Ubicaciones", db_path)
+    cached = _database_cache.get(db_path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    df = sql_backend.query("SELECT Material, Date FROM Ubicaciones", db_path=db_path)
+    if not df.empty:
+        df["Date"] = parse_dates(df["Date"])
+    index = AgingIndex.from_frame(df)
+    _database_cache[db_path] = (signature, index)
+    return index
+
+
+def aging_index() -> AgingIndex:
+    """
+    Aging index of the stock the analyses read: the snapshot's, or the
+    database's with the SQL backend.
+
+    Returns:
+        AgingIndex: Current index (read-only)
+    """
+    if settings.ANALYTICS_BACKEND == "sql":
+        return database_index()
+    return snapshot_manager.view(AGING_VIEW)
+
+
+def aging_summary(index: AgingIndex, reference_list: List[str], as_of: Optional[DateLike] = None) -> Dict[str, dict]:
+    """
+    Age statistics of the HUs of the given references.
+
+    Args:
+        index (AgingIndex): Index to read
+        reference_list (List[str]): Material names
+        as_of: Reference date, defaults to the current time
+
+    Returns:
+        Dict[str, dict]: hu_count (dated HUs), avg_days, the configured
+        percentiles (p50_days, ...) and age_buckets per reference present in stock
+    """
+    now = as_of_ns(as_of)
+    bounds = settings.STOCK_AGE_BUCKETS
+    summary = {}
+    for material, avg_days in index.mean_days(reference_list, now).items():
+        entry = {"hu_count": len(index.materials[material].entries), "avg_days": avg_days}
+        for percentile in settings.STOCK_AGE_PERCENTILES:
+            entry[f"p{percentile:g}_days"] = index.percentile_days(material, now, percentile)
+        entry["age_buckets"] = index.histogram(material, now, bounds)
+        summary[material] = entry
+    return summary
@@ -0,0 +1,122 @@
+import pandas as pd
+from typing import Dict, Optional
+from .data_loader import snapshot_manager, read_expedition_partitions
+from .snapshot import DatasetSnapshot
+from .logger import setup_logger
+
+logger = setup_logger('common.utils.client_cube')
+
+CLIENT_CUBE_VIEW = "client_month_cube"
+
+CUBE_INDEX = ["year", "month", "Client"]
+CUBE_COLUMNS = ["Purchased", "Served", "lines"]
+
+
+def build_client_month_cube(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Aggregate expedition lines into a (year, month, Client) cube.
+
+    Args:
+        df (pd.DataFrame): Expeditions with Date, Client, Purchased and Served
+
+    Returns:
+        pd.DataFrame: Sorted cube indexed by year, month and Client with
+        the summed Purchased and Served quantities and the line count
+    """
+    if df.empty or "Date" not in df.columns:
+        empty_index = pd.MultiIndex.from_arrays([[], [], []], names=CUBE_INDEX)
+        return pd.DataFrame({column: pd.Series(dtype="float64") for column in CUBE_COLUMNS}, index=empty_index)
+    keys = [
+        df["Date"].dt.year.rename("year"),
+        df["Date"].dt.month.rename("month"),
+        df["Client"].astype(str).rename("Client"),
+    ]
+    cube = df.groupby(keys, observed=True).agg(
+        Purchased=("Purchased", "sum"),
+        Served=("Served", "sum"),
+        lines=("Purchased", "size"),
+    )
+    return cube.astype("float64").sort_index()
+
+
+def merge_client_month_cube(cube: pd.DataFrame, deltas: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+    """
+    Fold newly appended expeditions into an existing cube.
+
+    Args:
+        cube (pd.DataFrame): Cube of the previous snapshot
+        deltas (Dict[str, pd.DataFrame]): Appended rows per snapshot frame
+
+    Returns:
+        pd.DataFrame: Cube of the new snapshot
+    """
+    new_rows = deltas.get("expeditions")
+    if new_rows is None or new_rows.empty:
+        return cube
+    delta_cube = build_client_month_cube(new_rows)
+    logger.info(f"Updating client-month cube with {len(new_rows)} new expedition lines.")
+    return cube.add(delta_cube, fill_value=0).sort_index()
+
+
+def _build_view(snapshot: DatasetSnapshot) -> pd.DataFrame:
+    return build_client_month_cube(snapshot.expeditions)
+
+
+snapshot_manager.register_view(CLIENT_CUBE_VIEW, _build_view, merge_client_month_cube)
+
+
+def client_month_cube() -> pd.DataFrame:
+    """
+    Return the client-month cube of the current expeditions snapshot.
+
+    Returns:
+        pd.DataFrame: Cube built once per data version (see ``build_client_month_cube``)
+    """
+    return snapshot_manager.view(CLIENT_CUBE_VIEW)
+
+
+def client_totals(year: Optional[int] = None, month: Optional[int] = None) -> pd.DataFrame:
+    """
+    Per-client totals for a year and/or month, answered from the cube.
+
+    A falsy year or month means no filter on that field. Results are kept
+    per snapshot version, so repeated filters are a dictionary lookup.
+
+    Args:
+        year (int): Year to filter
+        month (int): Month to filter
+
+    Returns:
+        pd.DataFrame: Purchased, Served and lines per Client, sorted by Client
+    """
+    snapshot = snapshot_manager.current()
+    return snapshot.derived(
+        f"{CLIENT_CUBE_VIEW}:{year or 0}:{month or 0}",
+        lambda s: _filter_totals(s.derived(CLIENT_CUBE_VIEW, _build_view), year, month),
+    )
+
+
+def _filter_totals(cube: pd.DataFrame, year: Optional[int], month: Optional[int]) -> pd.DataFrame:
+    if year:
+        cube = cube[cube.index.get_level_values("year") == year]
+    if month:
+        cube = cube[cube.index.get_level_values("month") == month]
+    return cube.groupby(level="Client").sum()
+
+
+def partition_client_totals(year: Optional[int] = None, month: Optional[int] = None) -> pd.DataFrame:
+    """
+    Per-client totals for a year and/or month, read from the month partitions.
+
+    Only the partitions the filter needs are read (see
+    ``data_loader.read_expedition_partitions``).
+
+    Args:
+        year (int): Year to filter
+        month (int): Month to filter
+
+    Returns:
+        pd.DataFrame: Purchased, Served and lines per Client, sorted by Client
+    """
+    df = read_expedition_partitions(year=year, month=month, columns=["Client", "Purchased", "Served", "Date"])
+    return _filter_totals(build_client_month_cube(df), year, month)
@@ -0,0 +1,137 @@
+import os
+import glob
+import hashlib
+import pandas as pd
+from typing import Callable, Optional
+from .logger import setup_logger
+
+logger = setup_logger('common.utils.columnar_cache')
+
+# Bump when the normalization applied before caching changes, so that
+# cache files written by older code are never read back.
+CACHE_FORMAT_VERSION = 1
+
+try:
+    import pyarrow.feather as feather
+except ImportError:  # pragma: no cover - pyarrow is listed in requirements
+    feather = None
+
+
+def source_key(source_path: str, tag: str = "") -> str:
+    """
+    Build the cache key of a source file from its path, mtime and size.
+
+    Args:
+        source_path (str): Path to the source workbook
+        tag (str): Extra discriminator (e.g. the normalizer name)
+
+    Returns:
+        str: Short hex digest identifying this exact version of the file
+    """
+    stat = os.stat(source_path)
+    raw = f"{os.path.abspath(source_path)}|{stat.st_mtime_ns}|{stat.st_size}|{tag}|v{CACHE_FORMAT_VERSION}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def cache_path_for(source_path: str, cache_dir: str, tag: str = "") -> str:
+    """
+    Return the Arrow IPC file that caches the given source file.
+
+    Args:
+        source_path (str): Path to the source workbook
+        cache_dir (str): Directory where cache files are stored
+        tag (str): Extra discriminator (e.g. the normalizer name)
+
+    Returns:
+        str: Path of the cache file (it may not exist yet)
+    """
+    stem = os.path.splitext(os.path.basename(source_path))[0]
+    return os.path.join(cache_dir, f"{stem}-{source_key(source_path, tag)}.arrow")
+
+
+def write_arrow(df: pd.DataFrame, path: str) -> None:
+    """
+    Atomically write a DataFrame as an uncompressed Arrow IPC (feather v2) file.
+
+    Uncompressed files can be memory-mapped and read without copying the
+    numeric buffers.
+
+    Args:
+        df (pd.DataFrame): Frame to persist
+        path (str): Destination file
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    feather.write_feather(df.reset_index(drop=True), tmp_path, compression="uncompressed")
+    os.replace(tmp_path, path)
+
+
+def read_arrow(path: str) -> pd.DataFrame:
+    """
+    Read an Arrow IPC file through a memory map.
+
+    Args:
+        path (str): Cache file to read
+
+    Returns:
+        pd.DataFrame: Cached frame
+    """
+    table = feather.read_table(path, memory_map=True)
+    return table.to_pandas()
+
+
+def _remove_stale(cache_dir: str, source_path: str, keep: str) -> None:
+    """Delete cache files of older versions of the same source."""
+    stem = os.path.splitext(os.path.basename(source_path))[0]
+    for old in glob.glob(os.path.join(cache_dir, f"{stem}-*.arrow")):
+        if os.path.abspath(old) != os.path.abspath(keep):
+            try:
+                os.remove(old)
+                logger.info(f"Removed stale cache file {old}")
+            except OSError as e:
+                logger.warning(f"Could not remove stale cache file {old}: {e}")
+
+
+def read_excel_cached(
+    source_path: str,
+    normalize: Callable[[pd.DataFrame], pd.DataFrame],
+    cache_dir: Optional[str] = None,
+) -> pd.DataFrame:
+    """
+    Read an Excel workbook through a columnar on-disk cache.
+
+    The first read parses the workbook, applies ``normalize`` and stores the
+    typed result as an Arrow IPC file keyed by path, mtime and size. Later
+    reads memory-map that file instead of parsing the workbook again. When
+    the workbook changes its key changes too, so the cache is rebuilt and
+    the stale file removed.
+
+    Args:
+        source_path (str): Path to the Excel workbook
+        normalize (Callable): Function applying the dtype normalization
+        cache_dir (str): Cache directory, if None the cache is disabled
+
+    Returns:
+        pd.DataFrame: Normalized data
+    """
+    if cache_dir is None or feather is None:
+        return normalize(pd.read_excel(source_path))
+
+    tag = getattr(normalize, "__name__", "")
+    cache_path = cache_path_for(source_path, cache_dir, tag)
+    if os.path.exists(cache_path):
+        try:
+            df = read_arrow(cache_path)
+            logger.info(f"Loaded {source_path} from columnar cache {cache_path}")
+            return df
+        except Exception as e:
+            logger.warning(f"Unreadable cache file {cache_path}, rebuilding: {e}")
+
+    df = normalize(pd.read_excel(source_path))
+    try:
+        write_arrow(df, cache_path)
+        _remove_stale(cache_dir, source_path, keep=cache_path)
+        logger.info(f"Wrote columnar cache {cache_path} ({len(df)} rows)")
+    except Exception as e:
+        logger.warning(f"Could not write columnar cache for {source_path}: {e}")
+    return df
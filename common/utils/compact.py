@@ -0,0 +1,143 @@
+import numpy as np
+import pandas as pd
+from .logger import setup_logger
+from pandas.api.types import union_categoricals
+from typing import Dict, Iterable, List
+
+logger = setup_logger('common.utils.compact')
+
+# Columns written by the database that no analysis reads
+UNUSED_COLUMNS = ["id", "date_inserted"]
+
+EXPEDITIONS_KEYS = ["Client", "idMaterial", "Material"]
+STOCK_KEYS = ["Location", "Material", "HU"]
+
+EXPEDITIONS_QUANTITIES = ["Purchased", "Served"]
+STOCK_QUANTITIES = ["Stock"]
+
+_INTEGER_TYPES = [np.int8, np.int16, np.int32, np.int64]
+
+
+def downcast_quantity(series: pd.Series) -> pd.Series:
+    """
+    Downcast a quantity column without changing any aggregate over it.
+
+    Integral columns get the smallest integer type able to hold the
+    column's absolute total, so no group sum can overflow. Columns with
+    fractional values stay float64 because float32 would round them.
+
+    Args:
+        series (pd.Series): Numeric column
+
+    Returns:
+        pd.Series: Downcast column (or the original one)
+    """
+    values = series.to_numpy()
+    if len(values) == 0 or not np.issubdtype(values.dtype, np.number):
+        return series
+    if values.dtype.kind == "f":
+        if not np.isfinite(values).all() or not np.array_equal(values, np.floor(values)):
+            return series
+    total = float(np.abs(values).sum())
+    for int_type in _INTEGER_TYPES:
+        if total <= np.iinfo(int_type).max:
+            return series.astype(int_type)
+    return series
+
+
+def compact_frame(
+    df: pd.DataFrame,
+    categorical: Iterable[str],
+    quantities: Iterable[str],
+    drop: Iterable[str] = UNUSED_COLUMNS,
+) -> pd.DataFrame:
+    """
+    Return a memory-lean copy of a frame.
+
+    String keys become dictionary-encoded categoricals (groupbys then run on
+    the integer codes), quantities are downcast with ``downcast_quantity``,
+    identifiers are downcast to the smallest integer type and unused columns
+    are dropped.
+
+    Args:
+        df (pd.DataFrame): Frame to compact
+        categorical (Iterable[str]): String key columns
+        quantities (Iterable[str]): Summed numeric columns
+        drop (Iterable[str]): Columns to remove
+
+    Returns:
+        pd.DataFrame: Compact frame
+    """
+    df = df.drop(columns=[c for c in drop if c in df.columns])
+    categorical = [c for c in categorical if c in df.columns]
+    quantities = [c for c in quantities if c in df.columns]
+    for column in categorical:
+        df[column] = df[column].astype(str).astype("category")
+    for column in quantities:
+        df[column] = downcast_quantity(df[column])
+    for column in df.columns:
+        if column not in quantities and pd.api.types.is_integer_dtype(df[column]):
+            df[column] = pd.to_numeric(df[column], downcast="integer")
+    return df
+
+
+def compact_expeditions(df: pd.DataFrame) -> pd.DataFrame:
+    """Compact an expeditions frame (see ``compact_frame``)."""
+    return compact_frame(df, EXPEDITIONS_KEYS, EXPEDITIONS_QUANTITIES)
+
+
+def compact_stock(df: pd.DataFrame) -> pd.DataFrame:
+    """Compact a stock frame (see ``compact_frame``)."""
+    return compact_frame(df, STOCK_KEYS, STOCK_QUANTITIES)
+
+
+def concat_frames(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Concatenate frames, keeping categorical columns categorical.
+
+    ``pd.concat`` falls back to object dtype when the categories differ, so
+    the categories of such columns are unioned first. Downcast integer
+    columns are widened again if the combined total no longer fits.
+
+    Args:
+        frames (List[pd.DataFrame]): Frames with the same columns
+
+    Returns:
+        pd.DataFrame: Concatenated frame with a fresh RangeIndex
+    """
+    frames = [f for f in frames if not f.empty]
+    if not frames:
+        return pd.DataFrame()
+    if len(frames) == 1:
+        return frames[0]
+    columns = {}
+    for column in frames[0].columns:
+        if isinstance(frames[0][column].dtype, pd.CategoricalDtype):
+            columns[column] = union_categoricals([f[column] for f in frames])
+    result = pd.concat(frames, ignore_index=True)
+    for column, values in columns.items():
+        result[column] = values
+    for column in result.columns:
+        if pd.api.types.is_integer_dtype(result[column]) and result[column].dtype != np.int64:
+            total = float(np.abs(result[column].to_numpy(dtype=np.float64)).sum())
+            if total > np.iinfo(result[column].dtype).max:
+                result[column] = result[column].astype(np.int64)
+    return result
+
+
+def memory_footprint(df: pd.DataFrame) -> Dict[str, object]:
+    """
+    Report the deep memory usage of a frame.
+
+    Args:
+        df (pd.DataFrame): Frame to measure
+
+    Returns:
+        Dict[str, object]: Rows, total bytes and bytes per column
+    """
+    usage = df.memory_usage(deep=True, index=True)
+    return {
+        "rows": int(len(df)),
+        "total_bytes": int(usage.sum()),
+        "columns": {str(k): int(v) for k, v in usage.items()},
+    }
@@ -2,8 +2,18 @@ import pandas as pd
 import os
 import sys
 import sqlite3
+import openpyxl
+from contextlib import closing
 from .logger import setup_logger
+from .columnar_cache import read_excel_cached
+from .compact import compact_expeditions, compact_stock, memory_footprint
+from .snapshot import SnapshotManager, TableSpec, DatasetSnapshot
+from .shared_snapshot import SharedSnapshotManager, publish_snapshot
+from . import partitions
+from .date_index import DateIndex, DateLike, slice_ranges
 from functools import lru_cache
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from . import settings
 
 logger = setup_logger('common.utils.data_loader')
 
@@ -16,11 +26,93 @@ if project_root not in sys.path:
 
 COMMON_DATA_PATH = os.path.join(project_root, "common", "data")
 
+# Columnar copies of the Excel sources, see columnar_cache.read_excel_cached
+CACHE_DATA_PATH = os.path.join(COMMON_DATA_PATH, "cache")
 
-def load_expeditions_data():
+DB_PATH = os.path.join(COMMON_DATA_PATH, "logistics_data.db")
+
+# Memory-mapped snapshot shared by every process, see shared_snapshot
+SHARED_SNAPSHOT_PATH = settings.SHARED_SNAPSHOT_DIR or os.path.join(COMMON_DATA_PATH, "shared")
+
+# Month-partitioned copy of the expeditions history, see partitions
+PARTITIONS_PATH = settings.PARTITIONS_DIR or os.path.join(COMMON_DATA_PATH, "partitions", "expeditions")
+
+# Columns of the database tables, see common.utils.schema
+EXPEDITIONS_TABLE_COLUMNS = ["id", "idLine", "idMaterial", "Material", "Purchased", "Served", "Client", "Date", "date_inserted"]
+STOCK_TABLE_COLUMNS = ["id", "Location", "Material", "HU", "Stock", "Date", "date_inserted"]
+
+
+def parse_dates(values: pd.Series) -> pd.Series:
+    """
+    Parse a ``Date`` column read from a workbook or from the database.
+
+    The database stores dates as integer seconds since the epoch (older
+    databases as text), the workbooks as datetimes.
+
+    Args:
+        values (pd.Series): Raw date values
+
+    Returns:
+        pd.Series: datetime64 column
+    """
+    if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+        return pd.to_datetime(values, unit="s")
+    return pd.to_datetime(values)
+
+
+def normalize_expeditions(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Apply the expeditions dtypes shared by every loader.
+
+    Only the columns present are converted, so projected reads (see
+    ``read_expeditions``) pay for the columns they asked for.
+
+    Args:
+        df (pd.DataFrame): Raw expeditions rows
+
+    Returns:
+        pd.DataFrame: Same frame with normalized columns
+    """
+    if "Date" in df.columns:
+        df["Date"] = parse_dates(df["Date"])
+    for column in ("Client", "idMaterial"):
+        if column in df.columns:
+            df[column] = df[column].astype(str)
+    for column in ("Purchased", "Served"):
+        if column in df.columns:
+            df[column] = pd.to_numeric(df[column], errors="coerce").fillna(0)
+    return df
+
+
+def normalize_stock(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Apply the stock dtypes shared by every loader.
+
+    Only the columns present are converted (see ``read_stock``).
+
+    Args:
+        df (pd.DataFrame): Raw stock rows
+
+    Returns:
+        pd.DataFrame: Same frame with normalized columns
+    """
+    if "Date" in df.columns:
+        df["Date"] = parse_dates(df["Date"])
+    if "Stock" in df.columns:
+        df["Stock"] = pd.to_numeric(df["Stock"], errors="coerce").fillna(0)
+    return df
+
+
+def load_expeditions_data(use_cache: bool = True):
     """
     Load and return expeditions data from Excel file.
 
+    The workbook is parsed once and then served from a columnar cache
+    under ``common/data/cache`` until the file changes.
+
+    Args:
+        use_cache (bool): Read through the columnar cache
+
     Returns:
         pandas.DataFrame: Expeditions data with columns:
             - idLine: int
@@ -32,12 +124,11 @@ def load_expeditions_data():
             - Date: datetime
     """
     try:
-        df = pd.read_excel(f"{COMMON_DATA_PATH}/expediciones_test.xlsx")
-        df["Date"] = pd.to_datetime(df["Date"])
-        df["Client"] = df["Client"].astype(str)
-        df["idMaterial"] = df["idMaterial"].astype(str)
-        df["Purchased"] = pd.to_numeric(df["Purchased"], errors="coerce").fillna(0)
-        df["Served"] = pd.to_numeric(df["Served"], errors="coerce").fillna(0)
+        df = read_excel_cached(
+            f"{COMMON_DATA_PATH}/expediciones_test.xlsx",
+            normalize_expeditions,
+            CACHE_DATA_PATH if use_cache else None,
+        )
         logger.info("Expeditions data loaded successfully.")
         return df
     except Exception as e:
@@ -45,10 +136,13 @@ def load_expeditions_data():
         return pd.DataFrame()
 
 
-def load_stock_data():
+def load_stock_data(use_cache: bool = True):
     """
     Load and return stock locations data from Excel file.
 
+    Args:
+        use_cache (bool): Read through the columnar cache
+
     Returns:
         pandas.DataFrame: Stock data with columns:
             - Location: str
@@ -58,52 +152,413 @@ def load_stock_data():
             - Date: datetime
     """
     try:
-        df = pd.read_excel(f"{COMMON_DATA_PATH}/ubicaciones_test.xlsx")
-        df["Date"] = pd.to_datetime(df["Date"])
-        df["Stock"] = pd.to_numeric(df["Stock"], errors="coerce").fillna(0)
+        df = read_excel_cached(
+            f"{COMMON_DATA_PATH}/ubicaciones_test.xlsx",
+            normalize_stock,
+            CACHE_DATA_PATH if use_cache else None,
+        )
         logger.info("Stock data loaded successfully.")
         return df
     except Exception as e:
         logger.error(f"Error loading stock data: {e}")
         return pd.DataFrame()
 
-@lru_cache(maxsize=1)
+
+def iter_source_batches(
+    source_path: str,
+    normalize: Callable[[pd.DataFrame], pd.DataFrame],
+    batch_size: int = 50_000,
+) -> Iterator[pd.DataFrame]:
+    """
+    Read a workbook (or CSV export) in batches of rows.
+
+    Excel files are streamed with openpyxl in read-only mode, so only one
+    batch of rows is held in memory at a time whatever the file size. Each
+    batch goes through the same normalization as the full loaders.
+
+    Args:
+        source_path (str): Path to the .xlsx or .csv file
+        normalize (Callable): normalize_expeditions or normalize_stock
+        batch_size (int): Rows per batch
+
+    Yields:
+        pd.DataFrame: Normalized batch of rows
+    """
+    if source_path.lower().endswith(".csv"):
+        for chunk in pd.read_csv(source_path, chunksize=batch_size):
+            yield normalize(chunk)
+        return
+
+    workbook = openpyxl.load_workbook(source_path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        batch = []
+        for row in rows:
+            if all(value is None for value in row):
+                continue
+            batch.append(row)
+            if len(batch) >= batch_size:
+                yield normalize(pd.DataFrame.from_records(batch, columns=header))
+                batch = []
+        if batch:
+            yield normalize(pd.DataFrame.from_records(batch, columns=header))
+    finally:
+        workbook.close()
+
+def prepare_expeditions(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Turn rows read from the Expediciones table into an analysis frame.
+
+    When ``settings.COMPACT_FRAMES`` is enabled the frame is returned in its
+    compact form (see ``common.utils.compact``).
+    """
+    df = normalize_expeditions(df)
+    if settings.COMPACT_FRAMES:
+        df = compact_expeditions(df)
+    return df
+
+
+def prepare_stock(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Turn rows read from the Ubicaciones table into an analysis frame.
+
+    When ``settings.COMPACT_FRAMES`` is enabled the frame is returned in its
+    compact form (see ``common.utils.compact``).
+    """
+    df = normalize_stock(df)
+    if settings.COMPACT_FRAMES:
+        df = compact_stock(df)
+    return df
+
+
+TABLE_SPECS = {
+    "expeditions": TableSpec("Expediciones", prepare_expeditions, sort_by="Date"),
+    "stock": TableSpec("Ubicaciones", prepare_stock),
+}
+
+if settings.SHARED_SNAPSHOT:
+    snapshot_manager = SharedSnapshotManager(
+        SHARED_SNAPSHOT_PATH, DB_PATH, TABLE_SPECS, check_interval=settings.SNAPSHOT_CHECK_INTERVAL
+    )
+else:
+    snapshot_manager = SnapshotManager(DB_PATH, TABLE_SPECS, check_interval=settings.SNAPSHOT_CHECK_INTERVAL)
+
+
+def publish_shared_snapshot(directory: str = SHARED_SNAPSHOT_PATH, db_path: str = DB_PATH) -> dict:
+    """
+    Publish the database content as the snapshot shared by every process.
+
+    Called by the ingest step; readers enabled with ``WAREHOUSE_SHARED_SNAPSHOT``
+    memory-map it instead of loading the tables themselves.
+
+    Args:
+        directory (str): Shared snapshot directory
+        db_path (str): SQLite database file
+
+    Returns:
+        dict: Manifest of the published version
+    """
+    return publish_snapshot(db_path, directory, TABLE_SPECS, extra={"compact": settings.COMPACT_FRAMES})
+
+
+def sync_expedition_partitions(root: str = PARTITIONS_PATH, db_path: str = DB_PATH, rebuild: bool = False) -> dict:
+    """
+    Append the expedition lines ingested since the last sync to the month partitions.
+
+    Called by the ingest step when ``WAREHOUSE_PARTITIONED_STORAGE`` is enabled.
+
+    Args:
+        root (str): Partitioned dataset directory
+        db_path (str): SQLite database file
+        rebuild (bool): Rewrite every partition from the database
+
+    Returns:
+        dict: Partition manifest
+    """
+    return partitions.sync_partitions(db_path, root, normalize_expeditions, rebuild=rebuild)
+
+
+def partitions_version(root: str = PARTITIONS_PATH) -> int:
+    """
+    Return the version of the partitioned expeditions, 0 if none were written.
+
+    Returns:
+        int: Incremented by every sync or compaction
+    """
+    manifest = partitions.read_manifest(root)
+    return manifest["version"] if manifest else 0
+
+
+@lru_cache(maxsize=32)
+def _read_partitions(root: str, version: int, year: Optional[int], month: Optional[int], columns: Optional[Tuple[str, ...]]) -> pd.DataFrame:
+    df = partitions.read_partitions(root, year=year, month=month, columns=None if columns is None else list(columns))
+    return prepare_expeditions(df)
+
+
+def read_expedition_partitions(
+    year: Optional[int] = None,
+    month: Optional[int] = None,
+    columns: Optional[Iterable[str]] = None,
+    root: str = PARTITIONS_PATH,
+) -> pd.DataFrame:
+    """
+    Read the expeditions of a year and/or month from the month partitions.
+
+    Only the partitions the filter needs are opened, so the cost of a
+    per-month query does not grow with the length of the history. Results
+    are cached per partition version.
+
+    Args:
+        year (int): Year to filter
+        month (int): Month to filter
+        columns (Iterable[str]): Columns to read, all by default
+        root (str): Partitioned dataset directory
+
+    Returns:
+        pandas.DataFrame: Matching expeditions sorted by Date (read-only)
+    """
+    columns = None if columns is None else tuple(columns)
+    return _read_partitions(root, partitions_version(root), year or None, month or None, columns)
+
+
+def _build_date_index(snapshot: DatasetSnapshot) -> DateIndex:
+    df = snapshot.expeditions
+    return DateIndex(df["Date"] if "Date" in df.columns else pd.Series([], dtype="datetime64[ns]"))
+
+
+snapshot_manager.register_view("expeditions_date_index", _build_date_index)
+
+
+def current_snapshot() -> DatasetSnapshot:
+    """
+    Return the current database snapshot, picking up newly ingested rows.
+
+    Returns:
+        DatasetSnapshot: Immutable snapshot with a version number
+    """
+    return snapshot_manager.current()
+
+
+def data_version() -> int:
+    """
+    Return the version of the current database snapshot.
+
+    The number changes whenever new data is swapped in, so caches of derived
+    results can use it as part of their key.
+
+    Returns:
+        int: Snapshot version
+    """
+    return snapshot_manager.version()
+
+
 def expeditions_data_sql()->pd.DataFrame:
     """
-    Load and return expeditions data from SQL database.
+    Return expeditions data from the current SQL database snapshot.
+
+    Rows ingested after the first load are appended automatically
+    (see ``common.utils.snapshot.SnapshotManager``) and the frame is kept
+    sorted by ``Date``.
+
+    Returns:
+        pandas.DataFrame: Expeditions data (read-only)
+    """
+    return current_snapshot().expeditions
+
+
+def expeditions_date_index() -> DateIndex:
+    """
+    Return the date index of the current expeditions snapshot.
+
+    Returns:
+        DateIndex: Month boundaries and sorted dates, built once per version
+    """
+    return snapshot_manager.view("expeditions_date_index")
+
+
+def expeditions_for_period(year: Optional[int] = None, month: Optional[int] = None) -> pd.DataFrame:
+    """
+    Return the expeditions of a year and/or month.
+
+    A falsy year or month means no filter on that field. The rows are found
+    by binary search on the date-sorted snapshot and returned as a slice of
+    it, without scanning or copying the whole frame. With the "partitions"
+    analytics backend only the matching month partitions are read instead.
+
+    Args:
+        year (int): Year to filter
+        month (int): Month to filter
 
     Returns:
-        pandas.DataFrame: Expeditions data
+        pandas.DataFrame: Matching expeditions (read-only)
+    """
+    if settings.ANALYTICS_BACKEND == "partitions":
+        return read_expedition_partitions(year=year, month=month)
+    snapshot = current_snapshot()
+    index = snapshot.derived("expeditions_date_index", _build_date_index)
+    return slice_ranges(snapshot.expeditions, index.period_ranges(year, month))
+
+
+def has_expeditions() -> bool:
     """
+    Whether any expedition is loaded, whatever its date.
+
+    Returns:
+        bool: True if the snapshot (or, with the "partitions" analytics
+        backend, the month partitions) holds at least one expedition
+    """
+    if settings.ANALYTICS_BACKEND == "partitions":
+        manifest = partitions.read_manifest(PARTITIONS_PATH)
+        return bool(manifest and manifest["partitions"])
+    return not current_snapshot().expeditions.empty
+
+
+def expeditions_between(start: Optional[DateLike] = None, end: Optional[DateLike] = None) -> pd.DataFrame:
+    """
+    Return the expeditions with ``start <= Date < end``.
+
+    Args:
+        start: Inclusive lower bound, None for no bound
+        end: Exclusive upper bound, None for no bound
+
+    Returns:
+        pandas.DataFrame: Matching expeditions (read-only slice)
+    """
+    snapshot = current_snapshot()
+    index = snapshot.derived("expeditions_date_index", _build_date_index)
+    return slice_ranges(snapshot.expeditions, [index.range_bounds(start, end)])
+
+def _read_table(
+    table: str,
+    table_columns: List[str],
+    prepare: Callable[[pd.DataFrame], pd.DataFrame],
+    columns: Optional[Iterable[str]],
+    start: Optional[DateLike],
+    end: Optional[DateLike],
+    filters: Dict[str, Optional[Iterable]],
+) -> pd.DataFrame:
+    """
+    Read the projected columns of the rows matching the filters.
+
+    Column names are checked against the table, values are bound as
+    parameters. The date bounds compare against the integer epoch dates of
+    schema version 2 and up.
+    """
+    columns = list(columns) if columns else list(table_columns)
+    unknown = [c for c in columns + list(filters) if c not in table_columns]
+    if unknown:
+        raise ValueError(f"Unknown {table} columns: {unknown}")
+
+    conditions, params = [], []
+    if start is not None:
+        conditions.append("Date >= ?")
+        params.append(int(pd.Timestamp(start).value // 1_000_000_000))
+    if end is not None:
+        conditions.append("Date < ?")
+        params.append(int(pd.Timestamp(end).value // 1_000_000_000))
+    for column, values in filters.items():
+        if values is None:
+            continue
+        values = [str(value) for value in values]
+        if not values:
+            return prepare(pd.DataFrame({column: pd.Series(dtype=object) for column in columns}))
+        conditions.append(f"{column} IN ({', '.join('?' for _ in values)})")
+        params.extend(values)
+
+    query = f"SELECT {', '.join(columns)} FROM {table}"
+    if conditions:
+        query += f" WHERE {' AND '.join(conditions)}"
     try:
-        with sqlite3.connect(f"{COMMON_DATA_PATH}/logistics_data.db") as conn:
-            df = pd.read_sql_query("SELECT * FROM Expediciones", conn)
-            df["Date"] = pd.to_datetime(df["Date"])
-            df["Client"] = df["Client"].astype(str)
-            df["idMaterial"] = df["idMaterial"].astype(str)
-            df["Purchased"] = pd.to_numeric(df["Purchased"], errors="coerce").fillna(0)
-            df["Served"] = pd.to_numeric(df["Served"], errors="coerce").fillna(0)
-            logger.info("Expeditions data loaded from SQL database successfully.")
-            return df
+        with closing(sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True)) as conn:
+            df = pd.read_sql_query(query, conn, params=params)
     except Exception as e:
-        logger.error(f"Error loading expeditions data from SQL database: {e}")
-        return pd.DataFrame()
+        logger.error(f"Error reading {table}: {e}")
+        df = pd.DataFrame({column: pd.Series(dtype=object) for column in columns})
+    return prepare(df)
+
+
+def read_expeditions(
+    columns: Optional[Iterable[str]] = None,
+    start: Optional[DateLike] = None,
+    end: Optional[DateLike] = None,
+    clients: Optional[Iterable[str]] = None,
+    materials: Optional[Iterable[str]] = None,
+) -> pd.DataFrame:
+    """
+    Read expeditions straight from the database, projected and filtered in SQL.
+
+    Only the requested columns are selected and converted, and the filters
+    go into the ``WHERE`` clause (using the Date/Client and idMaterial/Date
+    indexes), so callers needing a few columns or a slice of the history
+    do not load the whole table.
+
+    Args:
+        columns (Iterable[str]): Columns to read, all by default
+        start: Inclusive lower bound on Date, None for no bound
+        end: Exclusive upper bound on Date, None for no bound
+        clients (Iterable[str]): Only these clients
+        materials (Iterable[str]): Only these idMaterial references
+
+    Returns:
+        pandas.DataFrame: Matching expeditions, normalized like the snapshot
+    """
+    return _read_table(
+        "Expediciones", EXPEDITIONS_TABLE_COLUMNS, prepare_expeditions, columns, start, end,
+        {"Client": clients, "idMaterial": materials},
+    )
+
+
+def read_stock(
+    columns: Optional[Iterable[str]] = None,
+    start: Optional[DateLike] = None,
+    end: Optional[DateLike] = None,
+    materials: Optional[Iterable[str]] = None,
+    locations: Optional[Iterable[str]] = None,
+) -> pd.DataFrame:
+    """
+    Read stock positions straight from the database, projected and filtered in SQL.
+
+    Args:
+        columns (Iterable[str]): Columns to read, all by default
+        start: Inclusive lower bound on the entry Date, None for no bound
+        end: Exclusive upper bound on the entry Date, None for no bound
+        materials (Iterable[str]): Only these Material names
+        locations (Iterable[str]): Only these locations
+
+    Returns:
+        pandas.DataFrame: Matching stock rows, normalized like the snapshot
+    """
+    return _read_table(
+        "Ubicaciones", STOCK_TABLE_COLUMNS, prepare_stock, columns, start, end,
+        {"Material": materials, "Location": locations},
+    )
 
-@lru_cache(maxsize=1)
 def stock_data_sql()->pd.DataFrame:
     """
-    Load and return stock data from SQL database.
+    Return stock data from the current SQL database snapshot.
+
+    Rows ingested after the first load are appended automatically
+    (see ``common.utils.snapshot.SnapshotManager``).
 
     Returns:
-        pandas.DataFrame: Stock data
+        pandas.DataFrame: Stock data (read-only)
     """
-    try:
-        with sqlite3.connect(f"{COMMON_DATA_PATH}/logistics_data.db") as conn:
-            df = pd.read_sql_query("SELECT * FROM Ubicaciones", conn)
-            df["Date"] = pd.to_datetime(df["Date"])
-            df["Stock"] = pd.to_numeric(df["Stock"], errors="coerce").fillna(0)
-            logger.info("Stock data loaded from SQL database successfully.")
-            return df
-    except Exception as e:
-        logger.error(f"Error loading stock data from SQL database: {e}")
-        return pd.DataFrame()
\ No newline at end of file
+    return current_snapshot().stock
+
+def frame_memory_report() -> dict:
+    """
+    Report the memory footprint of the frames served to the analyses.
+
+    Returns:
+        dict: ``memory_footprint`` of the expeditions and stock frames
+    """
+    snapshot = current_snapshot()
+    return {
+        "compact": settings.COMPACT_FRAMES,
+        "version": snapshot.version,
+        "expeditions": memory_footprint(snapshot.expeditions),
+        "stock": memory_footprint(snapshot.stock),
+    }
\ No newline at end of file
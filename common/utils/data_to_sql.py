@@ -2,6 +2,10 @@ import pandas as pd
 import os
 import sys
 import sqlite3
+import time
+import argparse
+from contextlib import closing
+from typing import Dict, Iterable, List, Optional
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 
@@ -12,89 +16,299 @@ if project_root not in sys.path:
 
 COMMON_DATA_PATH = os.path.join(project_root, "common", "data")
 
+DB_PATH = os.path.join(COMMON_DATA_PATH, "logistics_data.db")
+
+EXPEDITIONS_SOURCE = os.path.join(COMMON_DATA_PATH, "expediciones_test.xlsx")
+STOCK_SOURCE = os.path.join(COMMON_DATA_PATH, "ubicaciones_test.xlsx")
+
 from common.utils.logger import setup_logger
-from common.utils.data_loader import load_expeditions_data, load_stock_data
+from common.utils.data_loader import (
+    CACHE_DATA_PATH,
+    PARTITIONS_PATH,
+    SHARED_SNAPSHOT_PATH,
+    iter_source_batches,
+    normalize_expeditions,
+    normalize_stock,
+    publish_shared_snapshot,
+    sync_expedition_partitions,
+)
+from common.utils.shared_snapshot import read_manifest
+from common.utils.partitions import read_manifest as read_partitions_manifest
+from common.utils import settings
+from common.utils.columnar_cache import read_excel_cached, source_key
+from common.utils.schema import migrate
 
 logger = setup_logger('common.utils.data_to_sql')
 
-df_expeditions = load_expeditions_data()
-df_stock = load_stock_data()
+EXPEDITIONS_COLUMNS = ["idLine", "idMaterial", "Material", "Purchased", "Served", "Client", "Date"]
+STOCK_COLUMNS = ["Location", "Material", "HU", "Stock", "Date"]
+
+# Table and inserted columns of each ingested source
+TABLES = {
+    "expeditions": ("Expediciones", EXPEDITIONS_COLUMNS),
+    "stock": ("Ubicaciones", STOCK_COLUMNS),
+}
+
+DEFAULT_BATCH_SIZE = 50_000
+
+def _ingest_state(conn: sqlite3.Connection, source: str) -> Optional[tuple]:
+    return conn.execute(
+        "SELECT fingerprint, high_watermark FROM IngestState WHERE source = ?", (source,)
+    ).fetchone()
+
+
+def _save_ingest_state(conn: sqlite3.Connection, source: str, fingerprint: Optional[str], high_watermark: Optional[str], rows: int) -> None:
+    conn.execute(
+        "INSERT OR REPLACE INTO IngestState (source, fingerprint, high_watermark, rows, date_ingested) "
+        "VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)",
+        (source, fingerprint, high_watermark, rows),
+    )
+
+
+def _line_ids(series: pd.Series) -> pd.Series:
+    """idLine as text, without a spurious ".0" when a batch parsed it as float."""
+    numbers = pd.to_numeric(series, errors="coerce")
+    if numbers.notna().all() and (numbers % 1 == 0).all():
+        return numbers.astype("int64").astype(str)
+    return series.astype(str)
+
+
+def _epoch_seconds(series: pd.Series) -> List[Optional[int]]:
+    dates = pd.to_datetime(series)
+    seconds = dates.to_numpy(dtype="datetime64[s]").astype("int64").tolist()
+    missing = dates.isna().to_numpy()
+    if missing.any():
+        seconds = [None if gap else value for value, gap in zip(seconds, missing)]
+    return seconds
+
+
+def _records(df: pd.DataFrame, columns: List[str]) -> List[tuple]:
+    """
+    Turn a frame into parameter tuples of plain Python values.
+
+    Dates are written as integer seconds since the epoch (see
+    ``schema._integer_dates``) and missing values become NULL.
+    """
+    values = []
+    for column in columns:
+        series = df[column] if column in df.columns else pd.Series(None, index=df.index, dtype=object)
+        if column == "Date":
+            values.append(_epoch_seconds(series))
+            continue
+        if column == "idLine":
+            series = _line_ids(series)
+        values.append(series.astype(object).where(series.notna(), None).tolist())
+    return list(zip(*values))
+
+
+def _insert_or_ignore(conn: sqlite3.Connection, table: str, columns: List[str], df: pd.DataFrame) -> int:
+    placeholders = ", ".join("?" for _ in columns)
+    before = conn.total_changes
+    conn.executemany(
+        f"INSERT OR IGNORE INTO {table} ({', '.join(columns)}) VALUES ({placeholders})",
+        _records(df, columns),
+    )
+    return conn.total_changes - before
+
+
+def _line_numbers(df: pd.DataFrame) -> Optional[pd.Series]:
+    """Numeric idLine values, or None when some line id is not a number."""
+    numbers = pd.to_numeric(df["idLine"], errors="coerce")
+    return None if numbers.isna().any() else numbers
+
 
-def dataframes_to_sql(df_expeditions:pd.DataFrame=df_expeditions, df_stock:pd.DataFrame=df_stock)->None:
+def ingest_batches(
+    conn: sqlite3.Connection,
+    name: str,
+    batches: Iterable[pd.DataFrame],
+    fingerprint: Optional[str] = None,
+) -> int:
+    """
+    Insert the rows of a source that are not in the database yet.
+
+    Each batch is written with one ``INSERT OR IGNORE`` executemany in its
+    own transaction, so memory stays bounded by the batch size; the unique
+    indexes on the natural keys skip rows already stored, so late or
+    out-of-order lines are still inserted. The source fingerprint (used to
+    skip unchanged sources) and the highest expedition line id seen are
+    recorded once every batch is written.
+
+    Args:
+        conn (sqlite3.Connection): Open database connection
+        name (str): "expeditions" or "stock"
+        batches (Iterable[pd.DataFrame]): Normalized batches of rows
+        fingerprint (str): Source file fingerprint
+
+    Returns:
+        int: Number of inserted rows
+    """
+    table, columns = TABLES[name]
+    state = _ingest_state(conn, name)
+    high_watermark = state[1] if state and name == "expeditions" else None
+    numeric_ids = True
+    rows = inserted = 0
+    started = time.perf_counter()
+
+    for batch in batches:
+        rows += len(batch)
+        if name == "expeditions":
+            numbers = _line_numbers(batch)
+            numeric_ids = numeric_ids and numbers is not None
+            if numbers is not None and not numbers.empty:
+                top = numbers.max()
+                if high_watermark is None or top > float(high_watermark):
+                    high_watermark = str(int(top)) if float(top).is_integer() else str(top)
+        with conn:
+            inserted += _insert_or_ignore(conn, table, columns, batch)
+        elapsed = time.perf_counter() - started
+        logger.info(f"{table}: {rows} rows read, {inserted} inserted ({rows / max(elapsed, 1e-9):.0f} rows/s)")
+
+    with conn:
+        if name == "stock":
+            high_watermark = conn.execute("SELECT datetime(MAX(Date), 'unixepoch') FROM Ubicaciones").fetchone()[0]
+        elif not numeric_ids:
+            high_watermark = None
+        _save_ingest_state(conn, name, fingerprint, high_watermark, inserted)
+    elapsed = time.perf_counter() - started
+    logger.info(
+        f"Inserted {inserted} new {name} records out of {rows} rows in {elapsed:.2f}s "
+        f"({rows / max(elapsed, 1e-9):.0f} rows/s, high-watermark {high_watermark})."
+    )
+    return inserted
+
+
+def _source_batches(
+    conn: sqlite3.Connection,
+    name: str,
+    df: Optional[pd.DataFrame],
+    source_path: str,
+    stream: bool,
+    batch_size: int,
+    force: bool,
+):
+    """Batches to ingest for a source plus its fingerprint, None when there is nothing to read."""
+    if df is not None:
+        return [df] if not df.empty else None, None
+    if not os.path.exists(source_path):
+        logger.error(f"Source file not found for {name}: {source_path}")
+        return None, None
+    fingerprint = source_key(source_path)
+    state = _ingest_state(conn, name)
+    if not force and state and state[0] == fingerprint:
+        logger.info(f"Source {os.path.basename(source_path)} unchanged since last ingest, skipping {name}.")
+        return None, None
+    normalize = normalize_expeditions if name == "expeditions" else normalize_stock
+    if stream or source_path.lower().endswith(".csv"):
+        return iter_source_batches(source_path, normalize, batch_size), fingerprint
+    df = read_excel_cached(source_path, normalize, CACHE_DATA_PATH)
+    return [df] if not df.empty else None, fingerprint
+
+
+def dataframes_to_sql(
+    df_expeditions: Optional[pd.DataFrame] = None,
+    df_stock: Optional[pd.DataFrame] = None,
+    db_path: str = DB_PATH,
+    force: bool = False,
+    stream: bool = False,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    expeditions_source: Optional[str] = None,
+    stock_source: Optional[str] = None,
+    publish: Optional[bool] = None,
+    shared_dir: str = SHARED_SNAPSHOT_PATH,
+    partition: Optional[bool] = None,
+    partitions_dir: str = PARTITIONS_PATH,
+) -> Dict[str, int]:
     """
     Save expeditions and stock dataframes to SQL database.
 
+    Frames that are not given are loaded from the source workbooks, unless
+    the source file is unchanged since the last ingest (same fingerprint
+    stored in ``IngestState``), in which case it is not even read. With
+    ``stream`` the workbooks are read and written ``batch_size`` rows at a
+    time instead of being loaded whole, which keeps memory bounded on
+    very large exports.
+
+    When publishing is enabled, the shared memory-mapped snapshot read by
+    the services (see ``common.utils.shared_snapshot``) is republished
+    after rows were inserted, on forced runs, or if none was published yet.
+    Likewise, with partitioned storage enabled the new expedition lines are
+    appended to the month partitions (see ``common.utils.partitions``).
+
+    Args:
+        df_expeditions (pd.DataFrame): Expeditions to ingest, defaults to the source workbook
+        df_stock (pd.DataFrame): Stock to ingest, defaults to the source workbook
+        db_path (str): SQLite database file
+        force (bool): Read the source workbooks even when unchanged
+        stream (bool): Read the source workbooks in batches of rows
+        batch_size (int): Rows per batch when streaming
+        expeditions_source (str): Expeditions workbook or CSV, defaults to EXPEDITIONS_SOURCE
+        stock_source (str): Stock workbook or CSV, defaults to STOCK_SOURCE
+        publish (bool): Publish the shared snapshot, defaults to ``settings.SHARED_SNAPSHOT``
+        shared_dir (str): Shared snapshot directory
+        partition (bool): Update the month partitions, defaults to ``settings.PARTITIONED_STORAGE``
+        partitions_dir (str): Partitioned dataset directory
+
+    Returns:
+        Dict[str, int]: Inserted rows per source ("expeditions", "stock")
     """
-    with sqlite3.connect(f"{COMMON_DATA_PATH}/logistics_data.db") as conn:
-        try:
-            cursor = conn.cursor()
+    inserted = {"expeditions": 0, "stock": 0}
+    sources = {
+        "expeditions": (df_expeditions, expeditions_source or EXPEDITIONS_SOURCE),
+        "stock": (df_stock, stock_source or STOCK_SOURCE),
+    }
+    try:
+        with closing(sqlite3.connect(db_path)) as conn:
             logger.info("Connected to the database successfully.")
-            create_table_query = '''
-            CREATE TABLE IF NOT EXISTS Expediciones (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                idLine TEXT NOT NULL,
-                idMaterial TEXT NOT NULL,
-                Material TEXT,
-                Purchased REAL,
-                Served REAL,
-                Client TEXT,
-                Date TEXT,    
-                date_inserted TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-            '''
-            cursor.execute(create_table_query)
-            conn.commit()
-            logger.info("Ensured Expediciones table exists.")
-        except sqlite3.Error as e:
-            logger.error(f"Database Expediciones error: {e}")
-
-        try:
-            
-            create_table_query = '''
-            CREATE TABLE IF NOT EXISTS Ubicaciones (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                Location TEXT NOT NULL,
-                Material TEXT,
-                HU TEXT,
-                Stock REAL,
-                Date TEXT,    
-                date_inserted TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-            '''
-            cursor.execute(create_table_query)
-            conn.commit()
-            logger.info("Ensured Ubicaciones table exists.")
-        except sqlite3.Error as e:
-            logger.error(f"Database Ubicaciones error: {e}")
-
-        try:
-            df_exp_db = pd.read_sql_query("SELECT idLine, idMaterial, Date FROM Expediciones", conn)
-            df_ubi_db = pd.read_sql_query("SELECT Location, Material, HU, Date FROM Ubicaciones", conn)
-            
-            logger.info("Fetched existing records from database.")
-            set_lineas = set(df_exp_db['idLine'].astype(int))
-            
-            set_ubicaciones = set(zip(df_ubi_db['Location'], df_ubi_db['Material'], df_ubi_db['HU']))
-
-            new_expeditions = df_expeditions[~df_expeditions['idLine'].isin(set_lineas)]
-            
-            new_stock = df_stock[~df_stock.apply(lambda row: (row['Location'], row['Material'], row['HU']), axis=1).isin(set_ubicaciones)]
-
-            if not new_expeditions.empty:
-                new_expeditions.to_sql('Expediciones', conn, if_exists='append', index=False)
-                logger.info(f"Inserted {len(new_expeditions)} new expeditions records.")
-            else:
-                logger.info("No new expeditions records to insert.")
-
-            if not new_stock.empty:
-                new_stock.to_sql('Ubicaciones', conn, if_exists='append', index=False)
-                logger.info(f"Inserted {len(new_stock)} new stock records.")
-            else:
-                logger.info("No new stock records to insert.")
-        except Exception as e:
-            logger.error(f"Error inserting data into database: {e}")
+            migrate(conn)
+            for name, (df, source_path) in sources.items():
+                batches, fingerprint = _source_batches(conn, name, df, source_path, stream, batch_size, force)
+                if batches is None:
+                    logger.info(f"No {name} records to insert.")
+                    continue
+                inserted[name] = ingest_batches(conn, name, batches, fingerprint)
+    except Exception as e:
+        logger.error(f"Error inserting data into database: {e}")
     logger.info("Database connection closed.")
 
+    if settings.SHARED_SNAPSHOT if publish is None else publish:
+        if force or any(inserted.values()) or read_manifest(shared_dir) is None:
+            try:
+                publish_shared_snapshot(shared_dir, db_path)
+            except Exception as e:
+                logger.error(f"Error publishing shared snapshot: {e}")
+
+    if settings.PARTITIONED_STORAGE if partition is None else partition:
+        if force or inserted["expeditions"] or read_partitions_manifest(partitions_dir) is None:
+            try:
+                sync_expedition_partitions(partitions_dir, db_path)
+            except Exception as e:
+                logger.error(f"Error writing expedition partitions: {e}")
+    return inserted
+
+
+def main(argv: Optional[List[str]] = None) -> Dict[str, int]:
+    parser = argparse.ArgumentParser(description="Ingest the expeditions and stock workbooks into the SQLite database.")
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database file")
+    parser.add_argument("--expeditions", help="Expeditions workbook or CSV (default common/data/expediciones_test.xlsx)")
+    parser.add_argument("--stock", help="Stock workbook or CSV (default common/data/ubicaciones_test.xlsx)")
+    parser.add_argument("--stream", action="store_true", help="Read the sources in batches of rows instead of loading them whole")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help=f"Rows per batch when streaming (default {DEFAULT_BATCH_SIZE})")
+    parser.add_argument("--force", action="store_true", help="Ingest the sources even if unchanged since the last run")
+    parser.add_argument("--publish", action="store_true", default=None, help="Publish the shared memory-mapped snapshot (default: WAREHOUSE_SHARED_SNAPSHOT)")
+    parser.add_argument("--partition", action="store_true", default=None, help="Append new expeditions to the month partitions (default: WAREHOUSE_PARTITIONED_STORAGE)")
+    args = parser.parse_args(argv)
+
+    return dataframes_to_sql(
+        db_path=args.db,
+        force=args.force,
+        stream=args.stream,
+        batch_size=args.batch_size,
+        expeditions_source=args.expeditions,
+        stock_source=args.stock,
+        publish=args.publish,
+        partition=args.partition,
+    )
+
+
 if __name__ == "__main__":
-    dataframes_to_sql(df_expeditions, df_stock)
-          
+    main()
@@ -0,0 +1,105 @@
+import numpy as np
+import pandas as pd
+from datetime import date
+from typing import Dict, List, Optional, Tuple, Union
+
+DateLike = Union[str, date, pd.Timestamp]
+
+
+class DateIndex:
+    """
+    Binary-search index over a frame sorted by its ``Date`` column.
+
+    Month boundaries are computed once, so a (year, month) filter or an
+    arbitrary date range resolves to a row range ``[start, stop)`` that is
+    turned into a zero-copy ``iloc`` slice of the frame. Missing dates
+    (sorted last) never match a date filter.
+    """
+
+    def __init__(self, dates: pd.Series):
+        values = dates.to_numpy(dtype="datetime64[ns]")
+        self.size = len(values)
+        values = values[:self.size - int(np.isnat(values).sum())]
+        if len(values) and not (values[1:] >= values[:-1]).all():
+            raise ValueError("DateIndex requires dates sorted in ascending order")
+        self.dates = values
+        months = values.astype("datetime64[M]")
+        unique_months, starts = np.unique(months, return_index=True)
+        stops = np.append(starts[1:], len(values))
+        self.month_bounds: Dict[Tuple[int, int], Tuple[int, int]] = {}
+        for month, start, stop in zip(unique_months, starts, stops):
+            month = pd.Timestamp(month)
+            self.month_bounds[(month.year, month.month)] = (int(start), int(stop))
+
+    def __len__(self) -> int:
+        return self.size
+
+    def years(self) -> List[int]:
+        """Years present in the index, ascending."""
+        return sorted({year for year, _ in self.month_bounds})
+
+    def months(self) -> List[int]:
+        """Months (1-12) present in any year, ascending."""
+        return sorted({month for _, month in self.month_bounds})
+
+    def range_bounds(self, start: Optional[DateLike] = None, end: Optional[DateLike] = None) -> Tuple[int, int]:
+        """
+        Row range of the dates in ``[start, end)``.
+
+        Args:
+            start: Inclusive lower bound, None for no bound
+            end: Exclusive upper bound, None for no bound
+
+        Returns:
+            Tuple[int, int]: ``(start, stop)`` row positions
+        """
+        lo = 0 if start is None else int(np.searchsorted(self.dates, np.datetime64(pd.Timestamp(start)), side="left"))
+        hi = len(self.dates) if end is None else int(np.searchsorted(self.dates, np.datetime64(pd.Timestamp(end)), side="left"))
+        return lo, max(lo, hi)
+
+    def period_ranges(self, year: Optional[int] = None, month: Optional[int] = None) -> List[Tuple[int, int]]:
+        """
+        Row ranges matching a year and/or month filter.
+
+        A falsy ``year`` or ``month`` means "no filter" on that field, like
+        the analysis functions. A month without a year matches that month in
+        every year, hence the list of ranges.
+
+        Args:
+            year (int): Year to filter
+            month (int): Month to filter
+
+        Returns:
+            List[Tuple[int, int]]: Ascending, non-overlapping row ranges
+        """
+        if year and month:
+            bounds = self.month_bounds.get((year, month))
+            return [bounds] if bounds else []
+        if year:
+            lo, hi = self.range_bounds(pd.Timestamp(year=year, month=1, day=1), pd.Timestamp(year=year + 1, month=1, day=1))
+            return [(lo, hi)] if hi > lo else []
+        if month:
+            return [bounds for (_, m), bounds in sorted(self.month_bounds.items()) if m == month]
+        return [(0, self.size)] if self.size else []
+
+
+def slice_ranges(df: pd.DataFrame, ranges: List[Tuple[int, int]]) -> pd.DataFrame:
+    """
+    Select row ranges of a frame.
+
+    A single range is returned as an ``iloc`` slice (no copy of the data);
+    several ranges are concatenated.
+
+    Args:
+        df (pd.DataFrame): Frame the ranges refer to
+        ranges (List[Tuple[int, int]]): Row ranges
+
+    Returns:
+        pd.DataFrame: Selected rows
+    """
+    if not ranges:
+        return df.iloc[0:0]
+    if len(ranges) == 1:
+        start, stop = ranges[0]
+        return df.iloc[start:stop]
+    return pd.concat([df.iloc[start:stop] for start, stop in ranges])
@@ -1,12 +1,17 @@
-from .data_loader import expeditions_data_sql, stock_data_sql
+from .client_cube import client_totals as cube_client_totals, partition_client_totals
+from . import sql_backend
+from . import warehouses
+from . import topk
+from . import settings
 from .logger import setup_logger
 from typing import List, Dict, Optional
+import pandas as pd
 
 logger = setup_logger('common.utils.expedition_analysis')
 
 
 def get_top_clients(
-    month: Optional[int] = None, limit: int = 5, year: Optional[int] = None
+    month: Optional[int] = None, limit: int = 5, year: Optional[int] = None, warehouse: Optional[str] = None
 ) -> List[str]:
     """
     Return top clients by total ordered quantity.
@@ -16,24 +21,27 @@ def get_top_clients(
         month (int): Month to filter, if 0, no filter
         limit (int): Number of top clients to return (1-8)
         year (int): Year to filter
+        warehouse (str): Warehouse to analyse, all warehouses if not provided
 
 
     Returns:
         List[str]: List of top client names
     """
-    df = expeditions_data_sql()
-    if df.empty:
+    logger.info(f"Getting top {limit} clients for year={year}, month={month}")
+    if _uses_snapshot(warehouse):
+        # Ranked incrementally per period as rows are ingested, no aggregation here
+        client_totals = topk.top_clients(year=year, month=month, limit=limit)
+        logger.info(f"Top clients: {client_totals}")
+        return client_totals
+
+    # Per-client totals come from a GROUP BY query with the SQL backend,
+    # the month partitions or the warehouse shards, not the raw lines
+    totals = _client_totals(year, month, warehouse)
+    if totals.empty:
         return []
 
-    # Apply date filters
-    if year:
-        df = df[df["Date"].dt.year == year]  # type: ignore
-    if month:
-        df = df[df["Date"].dt.month == month]  # type: ignore
-
-    # Group by client and get top by ordered quantity
-    logger.info(f"Getting top {limit} clients for year={year}, month={month}")
-    client_totals = df.groupby("Client")["Purchased"].sum().nlargest(limit)
+    # Get top by ordered quantity
+    client_totals = totals["Purchased"].nlargest(limit)
     client_totals = client_totals.index.tolist()
     client_totals = [str(client) for client in client_totals]
     logger.info(f"Top clients: {client_totals}")
@@ -41,7 +49,7 @@ def get_top_clients(
 
 
 def get_client_service_level(
-    month: Optional[int] = None, client_list: List[str] = [], year: Optional[int] = None
+    month: Optional[int] = None, client_list: List[str] = [], year: Optional[int] = None, warehouse: Optional[str] = None
 ) -> Dict[str, float]:
     """
     Calculate service level (shipped/ordered) for given clients.
@@ -50,34 +58,13 @@ def get_client_service_level(
         month (int): Month to filter, if 0, no filter
         client_list (List[str]): List of client references
         year (int): Year to filter
+        warehouse (str): Warehouse to analyse, all warehouses if not provided
 
     Returns:
         Dict[str, float]: Service levels for each client
     """
-    df = expeditions_data_sql()
-    if df.empty:
-        return {}
-
-    # Apply filters
-    if year:
-        df = df[df["Date"].dt.year == year]  # type: ignore
-    if month:
-        df = df[df["Date"].dt.month == month]  # type: ignore
-
-    df = df[df["Client"].isin(client_list)]
-    if df.empty:
-        return {}
-
-    service_levels = {}
-    for client in client_list:
-        client_data = df[df["Client"] == client]
-        total_ordered = client_data["Purchased"].sum()
-        total_shipped = client_data["Served"].sum()
-
-        service_level = total_shipped / total_ordered if total_ordered > 0 else 0
-        service_levels[client] = round(service_level, 3)
-
-    service_levels = {str(k): float(v) for k, v in service_levels.items()}
+    totals = _client_totals(year, month, warehouse)
+    service_levels = _service_levels_from_totals(totals, client_list)
     logger.info(f"Calculated service levels for clients: {service_levels}")
     return service_levels
 
@@ -86,6 +73,7 @@ def get_expedition_metrics(
     month: Optional[int] = None,
     client_list: List[str] = [],
     year: Optional[int] = None,
+    warehouse: Optional[str] = None,
 ) -> Dict[str, dict]:
     """
     Return count of expeditions, total ordered, total shipped for given clients.
@@ -94,32 +82,93 @@ def get_expedition_metrics(
         month (int): Month to filter, if 0, no filter
         client_list (List[str]): List of client names
         year (int): Year to filter
+        warehouse (str): Warehouse to analyse, all warehouses if not provided
 
 
     Returns:
         Dict[str, dict]: Metrics for each client
     """
-    df = expeditions_data_sql()
-    if df.empty:
+    totals = _client_totals(year, month, warehouse)
+    metrics = _metrics_from_totals(totals, client_list)
+    logger.info(f"Calculated expedition metrics for clients: {metrics}")
+    return metrics
+
+
+def get_client_analytics(
+    month: Optional[int] = None, limit: int = 5, year: Optional[int] = None, warehouse: Optional[str] = None
+) -> dict:
+    """
+    Return top clients, their service levels and expedition metrics in one call.
+
+    Equivalent to calling get_top_clients, get_client_service_level and
+    get_expedition_metrics with the same filters, but the per-client
+    totals are computed once and shared by the three results.
+
+    Args:
+        month (int): Month to filter, if 0, no filter
+        limit (int): Number of top clients to return (1-8)
+        year (int): Year to filter
+        warehouse (str): Warehouse to analyse, all warehouses if not provided
+
+    Returns:
+        dict: Keys "top_clients" (List[str]), "service_levels"
+        (Dict[str, float]) and "metrics" (Dict[str, dict])
+    """
+    totals = _client_totals(year, month, warehouse)
+    top_clients = [str(client) for client in totals["Purchased"].nlargest(limit).index.tolist()]
+    analytics = {
+        "top_clients": top_clients,
+        "service_levels": _service_levels_from_totals(totals, top_clients),
+        "metrics": _metrics_from_totals(totals, top_clients),
+    }
+    logger.info(f"Calculated client analytics for year={year}, month={month}: {analytics}")
+    return analytics
+
+
+def _uses_snapshot(warehouse: Optional[str] = None) -> bool:
+    """Whether analyses are answered from the in-memory snapshot (the default pandas backend)."""
+    return not warehouses.sharded(warehouse) and settings.ANALYTICS_BACKEND not in ("sql", "partitions")
+
+
+def _client_totals(year: Optional[int], month: Optional[int], warehouse: Optional[str] = None) -> pd.DataFrame:
+    """Per-client totals from the warehouse shards or the configured analytics backend."""
+    if warehouses.sharded(warehouse):
+        return warehouses.client_totals(year=year, month=month, warehouse=warehouse)
+    if settings.ANALYTICS_BACKEND == "sql":
+        return sql_backend.client_totals(year=year, month=month)
+    if settings.ANALYTICS_BACKEND == "partitions":
+        return partition_client_totals(year=year, month=month)
+    return cube_client_totals(year=year, month=month)
+
+
+def _service_levels_from_totals(totals: pd.DataFrame, client_list: List[str]) -> Dict[str, float]:
+    """Service level (shipped/ordered) per client from per-client totals."""
+    totals = totals[totals.index.isin(client_list)]
+    if totals.empty:
         return {}
 
-    # Apply filters
-    if year:
-        df = df[df["Date"].dt.year == year]  # type: ignore
-    if month:
-        df = df[df["Date"].dt.month == month]  # type: ignore
+    service_levels = {}
+    for client in client_list:
+        total_ordered = totals["Purchased"].get(client, 0.0)
+        total_shipped = totals["Served"].get(client, 0.0)
 
-    df = df[df["Client"].isin(client_list)]
-    if df.empty:
+        service_level = total_shipped / total_ordered if total_ordered > 0 else 0
+        service_levels[client] = round(service_level, 3)
+
+    return {str(k): float(v) for k, v in service_levels.items()}
+
+
+def _metrics_from_totals(totals: pd.DataFrame, client_list: List[str]) -> Dict[str, dict]:
+    """Expedition count, total ordered and total shipped per client from per-client totals."""
+    totals = totals[totals.index.isin(client_list)]
+    if totals.empty:
         return {}
 
     metrics = {}
     for client in client_list:
-        client_data = df[df["Client"] == client]
         metrics[client] = {
-            "expedition_count": int(len(client_data)),
-            "total_ordered": float(client_data["Purchased"].sum()),
-            "total_shipped": float(client_data["Served"].sum()),
+            "expedition_count": int(totals["lines"].get(client, 0)),
+            "total_ordered": float(totals["Purchased"].get(client, 0.0)),
+            "total_shipped": float(totals["Served"].get(client, 0.0)),
         }
-    logger.info(f"Calculated expedition metrics for clients: {metrics}")
     return metrics
@@ -0,0 +1,177 @@
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+from typing import Dict, List, Optional
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+
+project_root = os.path.abspath(os.path.join(current_dir, "../.."))
+
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from common.utils.logger import setup_logger
+from common.utils.forecast_models import FORECAST_MODELS, fit_model
+
+logger = setup_logger('common.utils.forecast_backtest')
+
+
+def synthetic_demand_matrix(n_skus: int = 1000, n_months: int = 36, seed: int = 0) -> np.ndarray:
+    """
+    Generate a (SKUs x months) served matrix with realistic demand shapes.
+
+    A third of the SKUs are stable, a third trending and a third
+    intermittent; products are introduced at random months (NaN before
+    their first month) and some months have no expedition lines (NaN).
+
+    Args:
+        n_skus (int): Number of references
+        n_months (int): Number of months of history
+        seed (int): Random seed
+
+    Returns:
+        np.ndarray: Served matrix with NaN gaps, like forecasting.DemandMatrix.served
+    """
+    rng = np.random.default_rng(seed)
+    months = np.arange(n_months)
+    base = rng.gamma(2.0, 50.0, size=(n_skus, 1))
+    kind = rng.integers(0, 3, size=(n_skus, 1))
+    slope = rng.normal(0.0, 0.03, size=(n_skus, 1)) * base
+    seasonal = 1 + 0.2 * np.sin(2 * np.pi * (months + rng.integers(0, 12, size=(n_skus, 1))) / 12)
+
+    mean = np.where(kind == 1, np.clip(base + slope * months, 0, None), base) * seasonal
+    demand = rng.poisson(mean).astype(float)
+    intermittent = (kind == 2) & (rng.random((n_skus, n_months)) < 0.7)
+    demand[intermittent] = np.nan
+
+    start = rng.integers(0, max(1, n_months // 2), size=n_skus)
+    demand[months[None, :] < start[:, None]] = np.nan
+    return demand
+
+
+def rolling_origin_backtest(
+    served: np.ndarray,
+    models: Optional[List[str]] = None,
+    horizon: int = 1,
+    min_train: int = 3,
+    max_origins: Optional[int] = None,
+    workers: Optional[int] = None,
+) -> Dict[str, Dict[str, float]]:
+    """
+    Rolling-origin evaluation of forecasting models.
+
+    For every origin month ``t`` each model is fitted on months ``[0, t)``
+    and its forecast compared with the demand of month ``t + horizon - 1``
+    (0 when the reference had no lines that month). References without any
+    history before the origin are skipped.
+
+    Args:
+        served (np.ndarray): (SKUs x months) served matrix with NaN gaps
+        models (List[str]): Registered model names, all by default
+        horizon (int): Months ahead evaluated
+        min_train (int): Months of history before the first origin
+        max_origins (int): Only use the most recent origins
+        workers (int): Process pool size for parallel models
+
+    Returns:
+        Dict[str, Dict[str, float]]: Per model MAPE (%, over non-zero
+        actuals), WAPE (%), bias (%), number of forecasts, fit seconds
+        and SKUs per second
+    """
+    models = models or list(FORECAST_MODELS)
+    origins = list(range(min_train, served.shape[1] - horizon + 1))
+    if max_origins:
+        origins = origins[-max_origins:]
+    observed = ~np.isnan(served)
+
+    results = {}
+    for name in models:
+        abs_error = error = actual_total = ape_sum = 0.0
+        ape_count = forecasts_made = 0
+        elapsed = 0.0
+        for origin in origins:
+            active = observed[:, :origin].any(axis=1)
+            if not active.any():
+                continue
+            train = served[active, :origin]
+            actual = np.nan_to_num(served[active, origin + horizon - 1], nan=0.0)
+
+            started = time.perf_counter()
+            forecast = fit_model(name, train, workers=workers)
+            elapsed += time.perf_counter() - started
+
+            diff = forecast - actual
+            abs_error += float(np.abs(diff).sum())
+            error += float(diff.sum())
+            actual_total += float(actual.sum())
+            positive = actual > 0
+            ape_sum += float((np.abs(diff[positive]) / actual[positive]).sum())
+            ape_count += int(positive.sum())
+            forecasts_made += len(actual)
+
+        results[name] = {
+            "mape": round(100 * ape_sum / ape_count, 2) if ape_count else float("nan"),
+            "wape": round(100 * abs_error / actual_total, 2) if actual_total else float("nan"),
+            "bias": round(100 * error / actual_total, 2) if actual_total else float("nan"),
+            "forecasts": forecasts_made,
+            "fit_seconds": round(elapsed, 4),
+            "skus_per_second": round(forecasts_made / elapsed, 1) if elapsed > 0 else float("inf"),
+        }
+        logger.info(f"Backtest {name}: {results[name]}")
+    return results
+
+
+def format_results(results: Dict[str, Dict[str, float]]) -> str:
+    """Render backtest results as a fixed-width table."""
+    header = f"{'model':<24}{'MAPE %':>10}{'WAPE %':>10}{'bias %':>10}{'forecasts':>12}{'fit s':>10}{'SKUs/s':>14}"
+    lines = [header, "-" * len(header)]
+    for name, r in sorted(results.items(), key=lambda item: item[1]["wape"]):
+        lines.append(
+            f"{name:<24}{r['mape']:>10.2f}{r['wape']:>10.2f}{r['bias']:>10.2f}"
+            f"{r['forecasts']:>12}{r['fit_seconds']:>10.3f}{r['skus_per_second']:>14.1f}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> Dict[str, Dict[str, float]]:
+    parser = argparse.ArgumentParser(description="Rolling-origin backtest of the demand forecasting models.")
+    parser.add_argument("--synthetic", type=int, metavar="SKUS", help="Use a synthetic catalog of SKUS references instead of the database")
+    parser.add_argument("--months", type=int, default=36, help="Months of synthetic history (default 36)")
+    parser.add_argument("--seed", type=int, default=0, help="Synthetic data seed")
+    parser.add_argument("--models", nargs="+", choices=sorted(FORECAST_MODELS), help="Models to evaluate (default all)")
+    parser.add_argument("--horizon", type=int, default=1, help="Months ahead evaluated (default 1)")
+    parser.add_argument("--min-train", type=int, default=3, help="Months of history before the first origin (default 3)")
+    parser.add_argument("--max-origins", type=int, help="Only evaluate the most recent N origins")
+    parser.add_argument("--workers", type=int, help="Process pool size for parallel models")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args(argv)
+
+    if args.synthetic:
+        served = synthetic_demand_matrix(args.synthetic, args.months, args.seed)
+        source = f"synthetic catalog ({args.synthetic} SKUs x {args.months} months)"
+    else:
+        from common.utils.forecasting import demand_matrix
+        served = demand_matrix().served
+        source = f"expeditions history ({served.shape[0]} SKUs x {served.shape[1]} months)"
+
+    results = rolling_origin_backtest(
+        served,
+        models=args.models,
+        horizon=args.horizon,
+        min_train=args.min_train,
+        max_origins=args.max_origins,
+        workers=args.workers,
+    )
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"Backtest on {source}")
+        print(format_results(results))
+    return results
+
+
+if __name__ == "__main__":
+    main()
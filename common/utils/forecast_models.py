@@ -0,0 +1,216 @@
+import atexit
+import os
+import threading
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+from .logger import setup_logger
+
+logger = setup_logger('common.utils.forecast_models')
+
+# Every model receives the (materials x months) served matrix of
+# forecasting.DemandMatrix, with NaN for months without expedition lines,
+# and returns one next-month forecast per row.
+ModelFunction = Callable[[np.ndarray], np.ndarray]
+
+
+@dataclass(frozen=True)
+class ForecastModel:
+    """A registered forecasting model."""
+    name: str
+    fit_predict: ModelFunction
+    description: str = ""
+    # Heavier models are fanned out over a process pool by chunks of rows
+    parallel: bool = False
+
+
+FORECAST_MODELS: Dict[str, ForecastModel] = {}
+
+DEFAULT_MODEL = "moving_average"
+
+
+def register_model(name: str, description: str = "", parallel: bool = False):
+    """
+    Decorator registering a forecasting model under ``name``.
+
+    Args:
+        name (str): Name used to select the model
+        description (str): Short human readable description
+        parallel (bool): Fit it over a process pool on large catalogs
+
+    Returns:
+        Callable: The decorator
+    """
+    def decorator(function: ModelFunction) -> ModelFunction:
+        FORECAST_MODELS[name] = ForecastModel(name, function, description, parallel)
+        return function
+    return decorator
+
+
+def available_models() -> Dict[str, str]:
+    """Return the registered model names and descriptions."""
+    return {name: model.description for name, model in FORECAST_MODELS.items()}
+
+
+def _history(served: np.ndarray):
+    """
+    Zero-filled demand plus the first observed month of each row.
+
+    Months before a material's first expedition line are not part of its
+    history; months without lines afterwards count as zero demand.
+    """
+    observed = ~np.isnan(served)
+    has_history = observed.any(axis=1)
+    start = np.where(has_history, observed.argmax(axis=1), served.shape[1])
+    return np.nan_to_num(served, nan=0.0), start, has_history
+
+
+@register_model("moving_average", "Mean of the last 3 months with expedition lines")
+def moving_average(served: np.ndarray, window: int = 3) -> np.ndarray:
+    """
+    Mean of each row's last ``window`` observed months (non-NaN cells), or
+    of all of them when it has fewer, and 0 when it has none.
+    """
+    if served.size == 0:
+        return np.zeros(served.shape[0])
+    observed = ~np.isnan(served)
+    # Rank of each observed month counted from the most recent one (1 = last)
+    rank_from_end = np.cumsum(observed[:, ::-1], axis=1)[:, ::-1]
+    selected = observed & (rank_from_end <= window)
+    counts = selected.sum(axis=1)
+    totals = np.where(selected, served, 0.0).sum(axis=1)
+    return np.divide(totals, counts, out=np.zeros(len(served)), where=counts > 0)
+
+
+@register_model("exponential_smoothing", "Simple exponential smoothing (alpha=0.3)")
+def exponential_smoothing(served: np.ndarray, alpha: float = 0.3) -> np.ndarray:
+    """Simple exponential smoothing, initialized at each row's first month."""
+    demand, start, has_history = _history(served)
+    level = np.zeros(len(demand))
+    for t in range(demand.shape[1]):
+        x = demand[:, t]
+        level = np.where(start == t, x, np.where(start < t, alpha * x + (1 - alpha) * level, level))
+    return np.where(has_history, level, 0.0)
+
+
+@register_model("holt", "Holt linear trend (alpha=0.3, beta=0.1)", parallel=True)
+def holt(served: np.ndarray, alpha: float = 0.3, beta: float = 0.1) -> np.ndarray:
+    """Holt's linear trend method; negative forecasts are clipped to 0."""
+    demand, start, has_history = _history(served)
+    level = np.zeros(len(demand))
+    trend = np.zeros(len(demand))
+    for t in range(demand.shape[1]):
+        x = demand[:, t]
+        active = start < t
+        new_level = alpha * x + (1 - alpha) * (level + trend)
+        new_trend = beta * (new_level - level) + (1 - beta) * trend
+        level = np.where(start == t, x, np.where(active, new_level, level))
+        trend = np.where(active, new_trend, trend)
+    return np.where(has_history, np.clip(level + trend, 0.0, None), 0.0)
+
+
+@register_model("croston", "Croston's method for intermittent demand (alpha=0.1)", parallel=True)
+def croston(served: np.ndarray, alpha: float = 0.1) -> np.ndarray:
+    """
+    Croston's method: smooth the non-zero demand sizes and the intervals
+    between them separately and forecast size / interval.
+    """
+    demand, start, _ = _history(served)
+    size = np.zeros(len(demand))
+    interval = np.ones(len(demand))
+    since_last = np.ones(len(demand))
+    seen = np.zeros(len(demand), dtype=bool)
+    for t in range(demand.shape[1]):
+        x = demand[:, t]
+        occurs = (start <= t) & (x > 0)
+        first = occurs & ~seen
+        update = occurs & seen
+        size = np.where(first, x, np.where(update, size + alpha * (x - size), size))
+        interval = np.where(update, interval + alpha * (since_last - interval), interval)
+        seen |= occurs
+        since_last = np.where(occurs, 1.0, np.where(start <= t, since_last + 1, since_last))
+    return np.where(seen, size / interval, 0.0)
+
+
+def _fit_chunk(name: str, chunk: np.ndarray) -> np.ndarray:
+    """Process pool entry point: fit one model on a chunk of rows."""
+    return FORECAST_MODELS[name].fit_predict(chunk)
+
+
+# A single long-lived pool of spawned workers: the API and the dashboard
+# are multithreaded, where forking is unsafe, and starting processes on
+# every fit would cost more than the fit saves.
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+
+def _process_pool(workers: int) -> ProcessPoolExecutor:
+    """Return the shared fitting pool, (re)created with ``workers`` processes."""
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"))
+            _pool_workers = workers
+        return _pool
+
+
+def shutdown_pool() -> None:
+    """Stop the fitting worker processes, if any were started."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
+
+
+atexit.register(shutdown_pool)
+
+
+def fit_model(
+    name: str,
+    served: np.ndarray,
+    workers: Optional[int] = None,
+    chunk_size: int = 2000,
+    parallel_min_rows: int = 5000,
+) -> np.ndarray:
+    """
+    Fit a registered model on every row of a demand matrix.
+
+    Models flagged ``parallel`` are split into chunks of ``chunk_size`` rows
+    and fitted in a process pool when the matrix has at least
+    ``parallel_min_rows`` rows and more than one worker is available; the
+    others run vectorized in-process. The pool is started once and reused
+    by later calls.
+
+    Args:
+        name (str): Registered model name
+        served (np.ndarray): (materials x months) matrix with NaN gaps
+        workers (int): Pool size, defaults to the number of CPUs
+        chunk_size (int): Rows per pool task
+        parallel_min_rows (int): Smallest matrix worth a pool
+
+    Returns:
+        np.ndarray: One forecast per row
+    """
+    if name not in FORECAST_MODELS:
+        raise ValueError(f"Unknown forecasting model '{name}'. Available: {list(FORECAST_MODELS)}")
+    model = FORECAST_MODELS[name]
+    workers = workers or os.cpu_count() or 1
+    if not model.parallel or workers < 2 or len(served) < parallel_min_rows:
+        return model.fit_predict(served)
+
+    chunks: List[np.ndarray] = [served[i:i + chunk_size] for i in range(0, len(served), chunk_size)]
+    logger.info(f"Fitting {name} on {len(served)} references in {len(chunks)} chunks over {workers} processes")
+    try:
+        results = list(_process_pool(workers).map(_fit_chunk, [name] * len(chunks), chunks))
+    except BrokenProcessPool as e:
+        logger.error(f"Forecast process pool failed, fitting {name} in-process: {e}")
+        shutdown_pool()
+        return model.fit_predict(served)
+    return np.concatenate(results) if results else np.zeros(0)
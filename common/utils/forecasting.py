@@ -0,0 +1,206 @@
+import numpy as np
+import pandas as pd
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List
+from .data_loader import snapshot_manager, read_expeditions, read_expedition_partitions, partitions_version
+from .snapshot import DatasetSnapshot
+from .forecast_models import DEFAULT_MODEL, FORECAST_MODELS, fit_model, moving_average
+from .logger import setup_logger
+from . import sql_backend
+from . import settings
+
+logger = setup_logger('common.utils.forecasting')
+
+DEMAND_MATRIX_VIEW = "demand_matrix"
+FORECAST_VIEW = "demand_forecast"
+
+# Results of the SQL and partitions backends, keyed by name with the data
+# signature they were computed for (see _backend_signature)
+_backend_cache: Dict[str, tuple] = {}
+
+
+@dataclass(frozen=True)
+class DemandMatrix:
+    """
+    Served quantities pivoted into a (material x month) matrix.
+
+    ``served[i, j]`` is the quantity of ``materials[i]`` served in
+    ``months[j]``. Months are a contiguous calendar range; a material with
+    no expedition line in a month has NaN there (as opposed to 0 for lines
+    served with quantity 0), which the legacy moving average relies on.
+    """
+    materials: np.ndarray
+    months: pd.PeriodIndex
+    served: np.ndarray
+    row_of: Dict[str, int] = field(default_factory=dict, repr=False)
+
+    @property
+    def shape(self):
+        return self.served.shape
+
+
+def build_demand_matrix(df: pd.DataFrame) -> DemandMatrix:
+    """
+    Pivot expedition lines into a ``DemandMatrix`` in one pass.
+
+    Args:
+        df (pd.DataFrame): Expeditions with idMaterial, Date and Served
+
+    Returns:
+        DemandMatrix: Materials x months matrix of served quantities
+    """
+    df = df.dropna(subset=["Date"]) if "Date" in df.columns else df.iloc[0:0]
+    if df.empty:
+        return DemandMatrix(np.array([], dtype=object), pd.PeriodIndex([], freq="M"), np.empty((0, 0)))
+
+    material_codes, materials = pd.factorize(df["idMaterial"].astype(str), sort=True)
+    dates = df["Date"].to_numpy(dtype="datetime64[M]").astype(np.int64)
+    first_month = dates.min()
+    month_codes = dates - first_month
+    n_materials, n_months = len(materials), int(month_codes.max()) + 1
+
+    flat = material_codes * n_months + month_codes
+    size = n_materials * n_months
+    totals = np.bincount(flat, weights=df["Served"].to_numpy(dtype=np.float64), minlength=size)
+    counts = np.bincount(flat, minlength=size)
+    served = np.where(counts > 0, totals, np.nan).reshape(n_materials, n_months)
+
+    months = pd.period_range(pd.Timestamp(np.datetime64(int(first_month), "M")), periods=n_months, freq="M")
+    materials = np.asarray(materials, dtype=object)
+    return DemandMatrix(materials, months, served, {m: i for i, m in enumerate(materials)})
+
+
+def moving_average_forecast(served: np.ndarray, window: int = 3) -> np.ndarray:
+    """
+    Vectorized moving-average forecast for every row of a demand matrix.
+
+    Each row's forecast is the mean of its last ``window`` observed months
+    (non-NaN cells), or of all of them when it has fewer, and 0 when it has
+    none. This is the rule of the original per-reference implementation.
+
+    Args:
+        served (np.ndarray): (materials x months) matrix with NaN gaps
+        window (int): Number of observed months averaged
+
+    Returns:
+        np.ndarray: One forecast per row
+    """
+    return moving_average(served, window)
+
+
+def _build_matrix_view(snapshot: DatasetSnapshot) -> DemandMatrix:
+    matrix = build_demand_matrix(snapshot.expeditions)
+    logger.info(f"Built demand matrix of shape {matrix.shape}")
+    return matrix
+
+
+def compute_forecasts(matrix: DemandMatrix, model: str = DEFAULT_MODEL) -> Dict[str, float]:
+    """
+    Fit a forecasting model on every reference of a demand matrix.
+
+    Args:
+        matrix (DemandMatrix): Demand history
+        model (str): Registered model name (see ``forecast_models``)
+
+    Returns:
+        Dict[str, float]: Next month forecast per idMaterial, rounded to 2 decimals
+    """
+    forecasts = np.round(
+        fit_model(
+            model,
+            matrix.served,
+            workers=settings.FORECAST_WORKERS,
+            chunk_size=settings.FORECAST_CHUNK_SIZE,
+            parallel_min_rows=settings.FORECAST_PARALLEL_MIN_ROWS,
+        ),
+        2,
+    )
+    logger.info(f"Forecasted next month demand for {len(forecasts)} references with {model}")
+    return {str(m): float(v) for m, v in zip(matrix.materials, forecasts)}
+
+
+snapshot_manager.register_view(DEMAND_MATRIX_VIEW, _build_matrix_view)
+
+
+def _backend_signature() -> tuple:
+    """Change marker of the expeditions read by the configured backend."""
+    if settings.ANALYTICS_BACKEND == "partitions":
+        return ("partitions", partitions_version())
+    return ("sql",) + sql_backend.table_signature("Expediciones")
+
+
+def _backend_cached(key: str, build: Callable[[], object]):
+    """Compute ``build()`` once per state of the backend's expeditions."""
+    signature = _backend_signature()
+    cached = _backend_cache.get(key)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    value = build()
+    _backend_cache[key] = (signature, value)
+    return value
+
+
+def _read_demand_matrix() -> DemandMatrix:
+    # Only the three columns the matrix needs are read and converted
+    columns = ["idMaterial", "Date", "Served"]
+    if settings.ANALYTICS_BACKEND == "partitions":
+        matrix = build_demand_matrix(read_expedition_partitions(columns=columns))
+        logger.info(f"Built demand matrix of shape {matrix.shape} from the month partitions")
+        return matrix
+    matrix = build_demand_matrix(read_expeditions(columns=columns))
+    logger.info(f"Built demand matrix of shape {matrix.shape} from the database")
+    return matrix
+
+
+def demand_matrix() -> DemandMatrix:
+    """
+    Return the demand matrix of the current expeditions data.
+
+    With the SQL or partitions backend it is built from a projected read
+    of the database or of the month partitions instead of the in-memory
+    snapshot.
+
+    Returns:
+        DemandMatrix: Built once per data version
+    """
+    if settings.ANALYTICS_BACKEND in ("sql", "partitions"):
+        return _backend_cached(DEMAND_MATRIX_VIEW, _read_demand_matrix)
+    return snapshot_manager.view(DEMAND_MATRIX_VIEW)
+
+
+def forecast_all_references(model: str = DEFAULT_MODEL) -> Dict[str, float]:
+    """
+    Return next month's forecast for every reference.
+
+    Args:
+        model (str): Registered model name (see ``forecast_models``)
+
+    Returns:
+        Dict[str, float]: Forecast per idMaterial, computed once per data version and model
+    """
+    if model not in FORECAST_MODELS:
+        raise ValueError(f"Unknown forecasting model '{model}'. Available: {list(FORECAST_MODELS)}")
+    if settings.ANALYTICS_BACKEND in ("sql", "partitions"):
+        return _backend_cached(f"{FORECAST_VIEW}:{model}", lambda: compute_forecasts(demand_matrix(), model))
+    snapshot = snapshot_manager.current()
+    return snapshot.derived(
+        f"{FORECAST_VIEW}:{model}",
+        lambda s: compute_forecasts(s.derived(DEMAND_MATRIX_VIEW, _build_matrix_view), model),
+    )
+
+
+def lookup_forecasts(reference_list: List[str], model: str = DEFAULT_MODEL) -> Dict[str, float]:
+    """
+    Look up precomputed forecasts, 0.0 for references without history.
+
+    Args:
+        reference_list (List[str]): List of reference IDs
+        model (str): Registered model name (see ``forecast_models``)
+
+    Returns:
+        Dict[str, float]: Forecast per reference, empty if there is no data
+    """
+    forecasts = forecast_all_references(model)
+    if not forecasts:
+        return {}
+    return {str(ref): forecasts.get(str(ref), 0.0) for ref in reference_list}
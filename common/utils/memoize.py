@@ -0,0 +1,102 @@
+import functools
+import inspect
+from typing import Any, Callable, Dict, Hashable, List, Optional
+from .result_cache import ResultCache
+from .warehouses import data_version
+from . import settings
+from .logger import setup_logger
+
+logger = setup_logger('common.utils.memoize')
+
+# Memoized tool wrappers by wrapped function, so a tool shared by several
+# agents keeps a single cache and a single set of statistics.
+_wrappers: Dict[Callable, Callable] = {}
+
+
+def _hashable(value: Any) -> Hashable:
+    """Hashable form of a tool argument: lists become tuples, dicts sorted item tuples."""
+    if isinstance(value, (list, tuple)):
+        return tuple(_hashable(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((str(key), _hashable(item)) for key, item in value.items()))
+    if isinstance(value, (set, frozenset)):
+        return frozenset(_hashable(item) for item in value)
+    return value
+
+
+def memoize_tool(func: Callable, max_entries: Optional[int] = None, ttl: Optional[float] = None) -> Callable:
+    """
+    Cache the results of an analysis tool while the data is unchanged.
+
+    Results are keyed by the call's arguments, bound to the signature with
+    defaults applied (so positional and keyword calls share entries), and by
+    the data version of the call's ``warehouse`` argument. The wrapper keeps
+    the name, docstring and signature agent frameworks read to describe the
+    tool. Cached results are shared between calls and must not be modified.
+
+    Args:
+        func (Callable): Tool function
+        max_entries (int): Results kept, settings.TOOL_CACHE_SIZE by default (0 disables caching)
+        ttl (float): Seconds a result is kept, settings.TOOL_CACHE_TTL by default
+
+    Returns:
+        Callable: Memoized tool, the same wrapper for repeated calls on one function
+    """
+    if func in _wrappers:
+        return _wrappers[func]
+    signature = inspect.signature(func)
+    cache = ResultCache(
+        settings.TOOL_CACHE_SIZE if max_entries is None else max_entries,
+        settings.TOOL_CACHE_TTL if ttl is None else ttl,
+    )
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = (_hashable(tuple(bound.arguments.items())), data_version(bound.arguments.get("warehouse")))
+            hash(key)
+        except Exception as e:
+            # Unbindable or unhashable arguments: let the tool handle the call
+            logger.warning(f"Not caching {func.__name__} call: {e}")
+            return func(*args, **kwargs)
+        found, result = cache.get(key)
+        if found:
+            return result
+        result = func(*args, **kwargs)
+        cache.put(key, result)
+        return result
+
+    wrapper.cache = cache
+    _wrappers[func] = wrapper
+    return wrapper
+
+
+def memoize_tools(tools: List[Callable]) -> List[Callable]:
+    """
+    Memoize every function of an agent's tool list.
+
+    Args:
+        tools (List[Callable]): Tool functions
+
+    Returns:
+        List[Callable]: Memoized tools, in the same order
+    """
+    return [memoize_tool(tool) for tool in tools]
+
+
+def tool_cache_stats() -> Dict[str, dict]:
+    """
+    Hit/miss statistics of every memoized tool.
+
+    Returns:
+        Dict[str, dict]: ResultCache statistics by tool name
+    """
+    return {wrapper.__name__: wrapper.cache.stats() for wrapper in _wrappers.values()}
+
+
+def clear_tool_caches() -> None:
+    """Drop the cached results of every memoized tool."""
+    for wrapper in _wrappers.values():
+        wrapper.cache.clear()
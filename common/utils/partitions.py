@@ -0,0 +1,276 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import pandas as pd
+from contextlib import closing
+from typing import Callable, Dict, List, Optional
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+
+project_root = os.path.abspath(os.path.join(current_dir, "../.."))
+
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from common.utils.logger import setup_logger
+
+logger = setup_logger('common.utils.partitions')
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - pyarrow is listed in requirements
+    pa = pq = None
+
+# Expedition history mirrored from the database into one directory per
+# month (``2025-01/part-000003-0.parquet``). The manifest lists the files
+# of every partition and the highest database id exported; it is replaced
+# atomically after files are written and before files are deleted, so
+# readers always see a complete, duplicate-free set of files.
+
+MANIFEST = "manifest.json"
+UNDATED = "undated"
+COLUMNS = ["id", "idLine", "idMaterial", "Material", "Purchased", "Served", "Client", "Date"]
+
+
+def read_manifest(root: str) -> Optional[dict]:
+    """
+    Return the partition manifest, None if nothing was written yet.
+
+    Args:
+        root (str): Partitioned dataset directory
+
+    Returns:
+        dict: Version, exported id and row count, and files per partition
+    """
+    try:
+        with open(os.path.join(root, MANIFEST), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _write_manifest(root: str, manifest: dict) -> None:
+    tmp_path = os.path.join(root, f"{MANIFEST}.{os.getpid()}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, os.path.join(root, MANIFEST))
+
+
+def _remove_unlisted(root: str, manifest: dict) -> None:
+    """Delete part files no longer referenced by the manifest."""
+    listed = {path for files in manifest["partitions"].values() for path in files}
+    for directory, _, files in os.walk(root):
+        for name in files:
+            path = os.path.relpath(os.path.join(directory, name), root)
+            if name.endswith(".parquet") and path not in listed:
+                try:
+                    os.remove(os.path.join(root, path))
+                except OSError as e:
+                    logger.warning(f"Could not remove partition file {path}: {e}")
+
+
+def partition_key(dates: pd.Series) -> pd.Series:
+    """``YYYY-MM`` partition of each date, ``undated`` for missing dates."""
+    return dates.dt.strftime("%Y-%m").fillna(UNDATED)
+
+
+def _write_part(root: str, key: str, df: pd.DataFrame, version: int, sequence: int) -> str:
+    path = os.path.join(key, f"part-{version:06d}-{sequence}.parquet")
+    os.makedirs(os.path.join(root, key), exist_ok=True)
+    tmp_path = os.path.join(root, f"{path}.tmp")
+    # Sorted by date, ids ascending on ties, like the snapshot frame
+    df = df.sort_values(["Date", "id"], kind="mergesort", na_position="last")
+    pq.write_table(pa.Table.from_pandas(df, preserve_index=False), tmp_path)
+    os.replace(tmp_path, os.path.join(root, path))
+    return path
+
+
+def sync_partitions(
+    db_path: str,
+    root: str,
+    normalize: Callable[[pd.DataFrame], pd.DataFrame],
+    chunk_size: int = 100_000,
+    rebuild: bool = False,
+) -> dict:
+    """
+    Export the expedition lines added since the last sync.
+
+    Rows with an id above the exported watermark are read in chunks and
+    appended as new part files to their month partitions. When rows below
+    the watermark were deleted, the partitions are rebuilt from scratch.
+
+    Args:
+        db_path (str): SQLite database file
+        root (str): Partitioned dataset directory
+        normalize (Callable): Dtype normalization (data_loader.normalize_expeditions)
+        chunk_size (int): Rows read from the database at a time
+        rebuild (bool): Rewrite every partition
+
+    Returns:
+        dict: The new manifest
+    """
+    if pq is None:
+        raise RuntimeError("pyarrow is required for partitioned storage")
+    os.makedirs(root, exist_ok=True)
+    manifest = read_manifest(root)
+    empty = {"version": 0, "exported_id": 0, "rows": 0, "partitions": {}}
+    with closing(sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)) as conn:
+        if manifest and not rebuild:
+            kept = conn.execute(
+                "SELECT COUNT(*) FROM Expediciones WHERE id <= ?", (manifest["exported_id"],)
+            ).fetchone()[0]
+            if kept != manifest["rows"]:
+                logger.warning("Expediciones rows were deleted since the last export, rebuilding partitions.")
+                rebuild = True
+        base = empty if rebuild or manifest is None else manifest
+        version = (manifest or empty)["version"] + 1
+        partitions = {key: list(files) for key, files in base["partitions"].items()}
+        exported_id, rows, sequence = base["exported_id"], base["rows"], 0
+
+        chunks = pd.read_sql_query(
+            f"SELECT {', '.join(COLUMNS)} FROM Expediciones WHERE id > ? ORDER BY id",
+            conn,
+            params=(exported_id,),
+            chunksize=chunk_size,
+        )
+        for chunk in chunks:
+            if chunk.empty:
+                continue
+            chunk = normalize(chunk)
+            for key, part in chunk.groupby(partition_key(chunk["Date"]), sort=True):
+                partitions.setdefault(key, []).append(_write_part(root, key, part, version, sequence))
+                sequence += 1
+            exported_id, rows = int(chunk["id"].max()), rows + len(chunk)
+
+    if sequence == 0 and not rebuild and manifest is not None:
+        logger.info("Partitions are up to date.")
+        return manifest
+    new_manifest = {
+        "version": version,
+        "exported_id": exported_id,
+        "rows": rows,
+        "partitions": dict(sorted(partitions.items())),
+        "updated_at": time.time(),
+    }
+    _write_manifest(root, new_manifest)
+    _remove_unlisted(root, new_manifest)
+    logger.info(f"Exported expeditions up to id {exported_id} into {len(partitions)} partitions ({sequence} new files).")
+    return new_manifest
+
+
+def compact_partitions(root: str, max_files: int = 1) -> dict:
+    """
+    Merge the part files of partitions holding more than ``max_files``.
+
+    Every sync adds one small file per touched month; compaction rewrites
+    each such partition as a single sorted file.
+
+    Args:
+        root (str): Partitioned dataset directory
+        max_files (int): Partitions with more files than this are merged
+
+    Returns:
+        dict: The new manifest (unchanged if nothing needed compaction)
+    """
+    manifest = read_manifest(root)
+    if manifest is None:
+        return {}
+    version = manifest["version"] + 1
+    partitions = dict(manifest["partitions"])
+    merged = 0
+    for key, files in manifest["partitions"].items():
+        if len(files) <= max_files:
+            continue
+        df = pd.concat([pq.read_table(os.path.join(root, path)).to_pandas() for path in files], ignore_index=True)
+        partitions[key] = [_write_part(root, key, df, version, 0)]
+        merged += 1
+    if not merged:
+        logger.info("No partition needs compaction.")
+        return manifest
+    new_manifest = {**manifest, "version": version, "partitions": partitions, "updated_at": time.time()}
+    _write_manifest(root, new_manifest)
+    _remove_unlisted(root, new_manifest)
+    logger.info(f"Compacted {merged} partitions.")
+    return new_manifest
+
+
+def partitions_for(manifest: dict, year: Optional[int] = None, month: Optional[int] = None) -> List[str]:
+    """
+    Partitions matching a year and/or month filter, in chronological order.
+
+    A falsy year or month means no filter on that field; without any
+    filter the undated partition is included last.
+
+    Args:
+        manifest (dict): Partition manifest
+        year (int): Year to filter
+        month (int): Month to filter
+
+    Returns:
+        List[str]: Partition keys
+    """
+    keys = []
+    for key in sorted(k for k in manifest["partitions"] if k != UNDATED):
+        key_year, key_month = (int(part) for part in key.split("-"))
+        if (not year or key_year == year) and (not month or key_month == month):
+            keys.append(key)
+    if not year and not month and UNDATED in manifest["partitions"]:
+        keys.append(UNDATED)
+    return keys
+
+
+def read_partitions(
+    root: str,
+    year: Optional[int] = None,
+    month: Optional[int] = None,
+    columns: Optional[List[str]] = None,
+) -> pd.DataFrame:
+    """
+    Read the expeditions of a year and/or month from their partitions only.
+
+    Args:
+        root (str): Partitioned dataset directory
+        year (int): Year to filter
+        month (int): Month to filter
+        columns (List[str]): Columns to read, all by default
+
+    Returns:
+        pd.DataFrame: Matching rows sorted by Date (missing dates last)
+    """
+    manifest = read_manifest(root)
+    if manifest is None:
+        logger.error(f"No partitioned expeditions in {root}, run python -m common.utils.partitions sync")
+        return pd.DataFrame(columns=columns or COLUMNS)
+    files: Dict[str, List[str]] = {key: manifest["partitions"][key] for key in partitions_for(manifest, year, month)}
+    paths = [os.path.join(root, path) for key in files for path in files[key]]
+    if not paths:
+        return pd.DataFrame(columns=columns or COLUMNS)
+    read_columns = None if columns is None else list(dict.fromkeys(columns + ["Date"]))
+    df = pa.concat_tables([pq.read_table(path, columns=read_columns) for path in paths]).to_pandas()
+    if any(len(parts) > 1 for parts in files.values()):
+        # Parts are written in id order, a stable sort restores (Date, id)
+        df = df.sort_values("Date", kind="mergesort", na_position="last", ignore_index=True)
+    return df[columns] if columns is not None else df
+
+
+def main(argv: Optional[List[str]] = None) -> dict:
+    from common.utils.data_loader import DB_PATH, PARTITIONS_PATH, normalize_expeditions
+
+    parser = argparse.ArgumentParser(description="Maintain the month-partitioned copy of the expeditions history.")
+    parser.add_argument("command", choices=["sync", "compact", "rebuild"], help="Export new lines, merge small files or rewrite everything")
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database file")
+    parser.add_argument("--root", default=PARTITIONS_PATH, help="Partitioned dataset directory")
+    parser.add_argument("--max-files", type=int, default=1, help="Compact partitions with more files than this (default 1)")
+    args = parser.parse_args(argv)
+
+    if args.command == "compact":
+        return compact_partitions(args.root, args.max_files)
+    return sync_partitions(args.db, args.root, normalize_expeditions, rebuild=args.command == "rebuild")
+
+
+if __name__ == "__main__":
+    main()
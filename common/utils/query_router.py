@@ -0,0 +1,325 @@
+import re
+import calendar
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+from .expedition_analysis import get_client_analytics
+from .reference_analysis import get_top_references_expeditions, forecast_next_month_demand
+from .stock_analysis import get_top_references_stock, get_stock_aging, get_stock_metrics
+from .memoize import memoize_tool
+from .logger import setup_logger
+
+logger = setup_logger('common.utils.query_router')
+
+# Deterministic answers for the canonical questions ("show the top 5
+# clients for month 1", "forecast demand for our top references"): a
+# keyword grammar picks the intent and extracts limit/year/month, the
+# analysis functions answer and a markdown template formats the result.
+# Anything else (why/compare/recommend questions, thresholds, metrics or
+# rankings the templates do not apply, out-of-range limits or months,
+# period ranges or several periods, several domains at once, periods
+# without data) is left to the agents.
+
+DEFAULT_LIMIT = 5
+MAX_LIMIT = 8
+
+NUMBER_WORDS = {"one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7, "eight": 8}
+MONTHS = {name.lower(): number for number, name in enumerate(calendar.month_name) if name}
+MONTHS.update({name.lower(): number for number, name in enumerate(calendar.month_abbr) if name})
+MONTHS.update({
+    "enero": 1, "febrero": 2, "marzo": 3, "abril": 4, "mayo": 5, "junio": 6, "julio": 7,
+    "agosto": 8, "septiembre": 9, "setiembre": 9, "octubre": 10, "noviembre": 11, "diciembre": 12,
+})
+# Month names that are also common words only count after a preposition ("in may")
+AMBIGUOUS_MONTHS = {"may", "mar", "jun"}
+
+# Questions asking for reasoning rather than figures go to the agents
+DEFER = re.compile(
+    r"\b(why|how come|compare|comparison|versus|vs|recommend\w*|suggest\w*|explain\w*|improve\w*|"
+    r"should|insight\w*|optimi[sz]\w*|report|not|without|except)\b"
+)
+# Qualifiers the templates cannot honour: thresholds, metrics other than the
+# ranking one and superlatives ranking by something else than quantity
+THRESHOLD = re.compile(r"\b(below|above|under|over|less|fewer|greater|more than|at least|at most)\b|%|<|>")
+OTHER_METRIC = re.compile(r"\b(service|rates?|ratio|percent\w*|trends?|growth|value|revenue|cost)\b")
+OTHER_SUPERLATIVE = re.compile(
+    r"\b(oldest|newest|youngest|latest|earliest|most recent|smallest|lowest|least|fewest|worst|"
+    r"slowest|fastest|longest|shortest|bottom)\b"
+)
+
+CLIENTS = re.compile(r"\b(clients?|customers?)\b")
+REFERENCES = re.compile(r"\b(references?|materials?|products?|items?|skus?)\b")
+STOCK = re.compile(r"\b(stock|inventory|warehoused|in the warehouse)\b")
+TOP = re.compile(r"\b(top|best|biggest|largest|main|most)\b")
+FORECAST = re.compile(r"\b(forecast\w*|predict\w*|next month)\b")
+AGING = re.compile(r"\b(aging|ageing|age|time in (the )?warehouse|days in (the )?warehouse)\b")
+SHIPPED = re.compile(r"\b(shipped|ordered|demand\w*|expeditions?|sold|orders?)\b")
+# Periods the templates cannot honour: one year and one month at most, so
+# ranges, windows ("last 3 months"), quarters and per-period breakdowns
+PERIOD_RANGE = re.compile(
+    r"\b(between|from|to|through|thru|until|till|since|each|every|per|quarters?|q[1-4]|months|years|weeks|"
+    r"monthly|quarterly|weekly|yearly|annual\w*|ytd|recent\w*|past)\b|\d\s*[-–]\s*\d"
+)
+
+
+@dataclass(frozen=True)
+class Intent:
+    """A canonical question and its filters."""
+    name: str
+    limit: int = DEFAULT_LIMIT
+    year: Optional[int] = None
+    month: Optional[int] = None
+
+
+def _number(token: str) -> Optional[int]:
+    return int(token) if token.isdigit() else NUMBER_WORDS.get(token)
+
+
+def extract_limit(text: str) -> int:
+    """``top 5``, ``5 clients`` or ``five references``; DEFAULT_LIMIT otherwise (not clamped)."""
+    words = r"\d{1,3}|" + "|".join(NUMBER_WORDS)
+    match = re.search(rf"\b(?:top|best|first|biggest|largest|main)\s+({words})\b", text) or re.search(
+        rf"\b({words})\s+(?:\w+\s+)?(?:clients?|customers?|references?|materials?|products?|items?|skus?)\b", text
+    )
+    return _number(match.group(1)) if match else DEFAULT_LIMIT
+
+
+def year_mentions(text: str, today: date) -> List[int]:
+    """Every four-digit year, then ``this year`` and ``last year``, in that order."""
+    years = [int(year) for year in re.findall(r"\b(?:19|20)\d{2}\b", text)]
+    if re.search(r"\b(this|current) year\b", text):
+        years.append(today.year)
+    if re.search(r"\b(last|previous) year\b", text):
+        years.append(today.year - 1)
+    return years
+
+
+def month_mentions(text: str) -> List[int]:
+    """Every ``month N`` in range, then every month name (English or Spanish), in that order."""
+    months = [int(number) for number in re.findall(r"\bmonth\s+(\d{1,2})\b", text) if 1 <= int(number) <= 12]
+    for word in re.findall(r"[a-z]+", text):
+        if word not in MONTHS:
+            continue
+        if word in AMBIGUOUS_MONTHS and not re.search(rf"\b(in|of|for|during) {word}\b", text):
+            continue
+        months.append(MONTHS[word])
+    return months
+
+
+def extract_year(text: str, today: date) -> Optional[int]:
+    """A four-digit year, ``this year`` or ``last year``."""
+    years = year_mentions(text, today)
+    return years[0] if years else None
+
+
+def extract_month(text: str) -> Optional[int]:
+    """``month 3`` or a month name (English or Spanish); out-of-range ``month N`` is not parsed."""
+    months = month_mentions(text)
+    return months[0] if months else None
+
+
+def extract_period(text: str, today: date) -> Tuple[Optional[int], Optional[int]]:
+    """
+    Year and month filters of a question.
+
+    ``this month`` and ``last month`` give both the year and the month
+    (January's last month is December of the previous year); otherwise the
+    year and month are extracted separately.
+
+    Args:
+        text (str): Normalized question
+        today (date): Date relative periods refer to
+
+    Returns:
+        Tuple[Optional[int], Optional[int]]: Year and month, None when not given
+    """
+    if re.search(r"\b(this|current) month\b", text):
+        return today.year, today.month
+    if re.search(r"\b(last|previous) month\b", text):
+        previous = today.replace(day=1) - timedelta(days=1)
+        return previous.year, previous.month
+    return extract_year(text, today), extract_month(text)
+
+
+def parse_query(text: str, today: Optional[date] = None) -> Optional[Intent]:
+    """
+    Match a question against the canonical intents.
+
+    Args:
+        text (str): User question
+        today (date): Date "this year"/"this month" refer to, today by default
+
+    Returns:
+        Intent: Matched intent with its filters, None when the agents should answer
+    """
+    text = re.sub(r"\s+", " ", text.casefold()).strip()
+    today = today or date.today()
+    if not text or DEFER.search(text) or THRESHOLD.search(text) or OTHER_METRIC.search(text) or OTHER_SUPERLATIVE.search(text):
+        return None
+    month = re.search(r"\bmonth\s+(\d+)\b", text)
+    limit = extract_limit(text)
+    if (month and not 1 <= int(month.group(1)) <= 12) or not 1 <= limit <= MAX_LIMIT:
+        # A filter the answer could not apply
+        return None
+    if PERIOD_RANGE.search(text) or len(set(year_mentions(text, today))) > 1 or len(set(month_mentions(text))) > 1:
+        # Several periods: the answer covers one year and one month at most
+        return None
+
+    clients, references, stock = CLIENTS.search(text), REFERENCES.search(text), STOCK.search(text)
+    forecast, aging = FORECAST.search(text), AGING.search(text)
+    if clients and (references or stock or forecast or aging):
+        # Several domains: the orchestrator combines specialists
+        return None
+    if clients and TOP.search(text):
+        name = "top_clients"
+    elif forecast and (references or SHIPPED.search(text)) and not (stock or aging):
+        name = "forecast"
+    elif aging and (stock or references) and not forecast:
+        name = "stock_aging"
+    elif stock and TOP.search(text) and not forecast:
+        name = "top_stock"
+    elif references and TOP.search(text) and not (stock or aging or forecast):
+        name = "top_references"
+    else:
+        return None
+    year, month = extract_period(text, today)
+    return Intent(name, limit, year, month)
+
+
+def period_label(year: Optional[int], month: Optional[int]) -> str:
+    """Human readable year/month filter."""
+    if year and month:
+        return f"{calendar.month_name[month]} {year}"
+    if month:
+        return f"{calendar.month_name[month]} (all years)"
+    if year:
+        return str(year)
+    return "all periods"
+
+
+def _scope(intent: Intent, warehouse: Optional[str], periodic: bool = True) -> str:
+    parts = [period_label(intent.year, intent.month)] if periodic else []
+    parts.append(f"warehouse {warehouse}" if warehouse else "all warehouses")
+    return ", ".join(parts)
+
+
+def _table(headers: List[str], rows: List[list]) -> str:
+    lines = ["| " + " | ".join(headers) + " |", "|" + "---|" * len(headers)]
+    lines += ["| " + " | ".join(str(cell) for cell in row) + " |" for row in rows]
+    return "\n".join(lines)
+
+
+def _days(value: float) -> str:
+    return "-" if value != value else f"{value:,.1f}"
+
+
+def _top_clients(intent: Intent, warehouse: Optional[str]) -> Optional[str]:
+    analytics = memoize_tool(get_client_analytics)(month=intent.month, limit=intent.limit, year=intent.year, warehouse=warehouse)
+    clients = analytics["top_clients"]
+    if not clients:
+        return None
+    rows = []
+    for rank, client in enumerate(clients, 1):
+        metrics = analytics["metrics"].get(client, {})
+        rows.append([
+            rank, client, f"{metrics.get('total_ordered', 0):,.0f}", f"{metrics.get('total_shipped', 0):,.0f}",
+            f"{analytics['service_levels'].get(client, 0.0):.1%}", metrics.get("expedition_count", 0),
+        ])
+    return f"**Top {len(clients)} clients by ordered quantity** ({_scope(intent, warehouse)})\n\n" + _table(
+        ["#", "Client", "Ordered", "Shipped", "Service level", "Expedition lines"], rows
+    )
+
+
+def _top_references(intent: Intent, warehouse: Optional[str]) -> List[str]:
+    return memoize_tool(get_top_references_expeditions)(month=intent.month or 0, limit=intent.limit, year=intent.year, warehouse=warehouse)
+
+
+def _references(intent: Intent, warehouse: Optional[str]) -> Optional[str]:
+    references = _top_references(intent, warehouse)
+    if not references:
+        return None
+    return f"**Top {len(references)} references by ordered quantity** ({_scope(intent, warehouse)})\n\n" + _table(
+        ["#", "Reference"], [[rank, ref] for rank, ref in enumerate(references, 1)]
+    )
+
+
+def _forecast(intent: Intent, warehouse: Optional[str]) -> Optional[str]:
+    references = _top_references(intent, warehouse)
+    if not references:
+        return None
+    forecasts = memoize_tool(forecast_next_month_demand)(references, warehouse=warehouse)
+    rows = [[rank, ref, f"{forecasts.get(ref, 0.0):,.1f}"] for rank, ref in enumerate(references, 1)]
+    return (
+        f"**Next month demand forecast** for the top {len(references)} references by ordered quantity "
+        f"({_scope(intent, warehouse)}), 3-month moving average\n\n" + _table(["#", "Reference", "Forecast"], rows)
+    )
+
+
+def _stock_aging(intent: Intent, warehouse: Optional[str]) -> Optional[str]:
+    references = memoize_tool(get_top_references_stock)(intent.limit, warehouse=warehouse)
+    if not references:
+        return None
+    aging = memoize_tool(get_stock_aging)(references, warehouse=warehouse)
+    rows = []
+    for rank, ref in enumerate(references, 1):
+        entry = aging.get(ref)
+        if entry is None:
+            rows.append([rank, ref, 0, "-", "-", "-"])
+            continue
+        rows.append([rank, ref, entry["hu_count"], _days(entry["avg_days"]), _days(entry.get("p50_days", float("nan"))), _days(entry.get("p90_days", float("nan")))])
+    return f"**Inventory aging of the top {len(references)} stock references** ({_scope(intent, warehouse, periodic=False)})\n\n" + _table(
+        ["#", "Reference", "Dated HUs", "Avg days", "Median days", "P90 days"], rows
+    )
+
+
+def _top_stock(intent: Intent, warehouse: Optional[str]) -> Optional[str]:
+    references = memoize_tool(get_top_references_stock)(intent.limit, warehouse=warehouse)
+    if not references:
+        return None
+    metrics = memoize_tool(get_stock_metrics)(references, warehouse=warehouse)
+    rows = []
+    for rank, ref in enumerate(references, 1):
+        entry = metrics.get(ref, {})
+        rows.append([rank, ref, f"{entry.get('total_pieces', 0):,.0f}", entry.get("location_count", 0), entry.get("hu_count", 0), entry.get("oldest_entry") or "-"])
+    return f"**Top {len(references)} references by pieces in stock** ({_scope(intent, warehouse, periodic=False)})\n\n" + _table(
+        ["#", "Reference", "Pieces", "Locations", "HUs", "Oldest entry"], rows
+    )
+
+
+ANSWERS: Dict[str, Callable[[Intent, Optional[str]], Optional[str]]] = {
+    "top_clients": _top_clients,
+    "top_references": _references,
+    "forecast": _forecast,
+    "stock_aging": _stock_aging,
+    "top_stock": _top_stock,
+}
+
+FOOTER = "\n\n_Answered directly from the warehouse data._"
+
+
+def route_query(text: str, warehouse: Optional[str] = None, today: Optional[date] = None) -> Optional[str]:
+    """
+    Answer a canonical question without the agents.
+
+    Args:
+        text (str): User question
+        warehouse (str): Warehouse to analyse, all warehouses if None
+        today (date): Date "this year"/"this month" refer to, today by default
+
+    Returns:
+        str: Markdown answer, None when the question needs the agents (no
+        intent matched, or the matched period has no data)
+    """
+    intent = parse_query(text, today)
+    if intent is None:
+        return None
+    try:
+        answer = ANSWERS[intent.name](intent, warehouse)
+    except Exception as e:
+        logger.error(f"Fast path failed for {intent}: {e}")
+        return None
+    if answer is None:
+        logger.info(f"Fast path found no data for {intent}, leaving the question to the agents.")
+        return None
+    logger.info(f"Fast path answered {intent}")
+    return answer + FOOTER
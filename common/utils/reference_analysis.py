@@ -1,12 +1,18 @@
 import pandas as pd
 import numpy as np
-from .data_loader import expeditions_data_sql
+from .data_loader import expeditions_for_period, has_expeditions
+from .forecasting import lookup_forecasts
+from .forecast_models import FORECAST_MODELS
+from . import sql_backend
+from . import warehouses
+from . import topk
+from . import settings
 from .logger import setup_logger
-from typing import List, Dict
+from typing import List, Dict, Optional
 
 logger = setup_logger('common.utils.reference_analysis')
 
-def get_top_references_expeditions(month: int = 0, limit: int = 5, year: int = 2025) -> List[str]:
+def get_top_references_expeditions(month: int = 0, limit: int = 5, year: int = 2025, warehouse: Optional[str] = None) -> List[str]:
     """
     Return top references by total ordered quantity in expeditions.
     
@@ -14,36 +20,44 @@ def get_top_references_expeditions(month: int = 0, limit: int = 5, year: int = 2
         month (int): Month to filter, if 0, no filter
         limit (int): Number of top references to return (1-8)
         year (int): Year to filter        
+        warehouse (str): Warehouse to analyse, all warehouses if not provided
     
     Returns:
         List[str]: List of top reference names
     """
-    df = expeditions_data_sql()
+    if warehouses.sharded(warehouse):
+        reference_totals = warehouses.top_references(year=year, month=month, limit=limit, warehouse=warehouse)
+        logger.info(f"Top references: {reference_totals}")
+        return reference_totals
+
+    if settings.ANALYTICS_BACKEND == "sql":
+        reference_totals = sql_backend.top_references(year=year, month=month, limit=limit)
+        logger.info(f"Top references: {reference_totals}")
+        return reference_totals
+
+    if settings.ANALYTICS_BACKEND != "partitions":
+        # Ranked incrementally per period as rows are ingested, no group-by here
+        reference_totals = topk.top_references(year=year, month=month, limit=limit)
+        logger.info(f"Top references: {reference_totals}")
+        return reference_totals
+
+    # Month partitions, month 0 means no month filter
+    df = expeditions_for_period(year=year, month=month)
     if df.empty:
         return []
     
-    sub_month = month
-    if sub_month == 0:
-        sub_month = None
-    
-    # Apply date filters
-    if year:
-        df = df[df['Date'].dt.year == year]
-    if sub_month:
-        df = df[df['Date'].dt.month == month]
-    
     # Group by material reference and get top by ordered quantity
     # Note: In expeditions data, 'referencia' might be client name, 
     # but we need material reference. Assuming 'idReferencia' or similar exists.
     # If not, we might need to adjust based on actual data structure
-    reference_totals = df.groupby('idMaterial')['Purchased'].sum().nlargest(limit)
+    reference_totals = df.groupby('idMaterial', observed=True)['Purchased'].sum().nlargest(limit)
     logger.info(f"Top {limit} references by expeditions: {reference_totals.index.tolist()}")
     reference_totals = reference_totals.index.tolist()
     reference_totals = [str(ref) for ref in reference_totals]
     logger.info(f"Top references: {reference_totals}")
     return reference_totals
 
-def get_reference_time_series(month: int, reference_list: List[str], year: int = 2025) -> Dict[str, dict]:
+def get_reference_time_series(month: int, reference_list: List[str], year: int = 2025, warehouse: Optional[str] = None) -> Dict[str, dict]:
     """
     Get time series of shipped quantity for given references.
     
@@ -51,23 +65,25 @@ def get_reference_time_series(month: int, reference_list: List[str], year: int =
         month (int): Month to filter, if 0, no filter
         reference_list (list): List of reference IDs
         year (int): Year to filter        
+        warehouse (str): Warehouse to analyse, all warehouses if not provided
     
     Returns:
         Dict[str, dict]: Time series data for each reference
     """
-    df = expeditions_data_sql()
-    if df.empty:
-        return {}
-    
-    sub_month = month
-    if sub_month == 0:
-        sub_month = None
+    if warehouses.sharded(warehouse):
+        time_series = warehouses.reference_time_series(year, month, reference_list, warehouse)
+        logger.info(f"Generated time series for references: {time_series}")
+        return time_series
+
+    if settings.ANALYTICS_BACKEND == "sql":
+        time_series = sql_backend.reference_time_series(year, month, reference_list)
+        logger.info(f"Generated time series for references: {time_series}")
+        return time_series
 
-    # Apply filters
-    if year:
-        df = df[df['Date'].dt.year == year]
-    if sub_month:
-        df = df[df['Date'].dt.month == month]
+    # Date-sorted snapshot slice, month 0 means no month filter
+    df = expeditions_for_period(year=year, month=month)
+    if df.empty and not has_expeditions():
+        return {}
     
     df = df[df['idMaterial'].isin(reference_list)]
     
@@ -82,38 +98,29 @@ def get_reference_time_series(month: int, reference_list: List[str], year: int =
     logger.info(f"Generated time series for references: {time_series}")
     return time_series
 
-def forecast_next_month_demand(reference_list: List[str]) -> Dict[str, float]:
+def forecast_next_month_demand(reference_list: List[str], model: str = "moving_average", warehouse: Optional[str] = None) -> Dict[str, float]:
     """
-    Simple forecast for next month's demand using moving average.
+    Forecast next month's demand, by default with a 3-month moving average.
+
+    Forecasts are precomputed for the whole catalog in one vectorized pass
+    per data version and model (see ``common.utils.forecasting``); this is
+    a lookup.
     
     Args:
         reference_list (List[str]): List of reference IDs
+        model (str): moving_average, exponential_smoothing, holt or croston
+        warehouse (str): Warehouse to analyse, all warehouses if not provided
     
     Returns:
         Dict[str, float]: Forecasted demand for each reference
     """
-    df = expeditions_data_sql()
-    if df.empty:
+    if model not in FORECAST_MODELS:
+        logger.error(f"Unknown forecasting model: {model}")
         return {}
-    
-    df = df[df['idMaterial'].isin(reference_list)]
-    
-    forecasts = {}
-    for ref in reference_list:
-        ref_data = df[df['idMaterial'] == ref]
-        monthly_data = ref_data.groupby(ref_data['Date'].dt.to_period('M'))['Served'].sum()
-        
-        if len(monthly_data) >= 3:
-            # Use 3-month moving average
-            forecast = monthly_data.tail(3).mean()
-        elif len(monthly_data) > 0:
-            # Use available data average
-            forecast = monthly_data.mean()
-        else:
-            forecast = 0
-            
-        forecasts[ref] = round(forecast, 2)
-    forecasts = {str(k): float(v) for k, v in forecasts.items()}
+    if warehouses.sharded(warehouse):
+        forecasts = warehouses.lookup_forecasts(reference_list, model, warehouse)
+    else:
+        forecasts = lookup_forecasts(reference_list, model)
     
     logger.info(f"Forecasted next month demand for references: {forecasts}")
     return forecasts
\ No newline at end of file
@@ -0,0 +1,188 @@
+import sqlite3
+from typing import Callable, List, Tuple
+from .logger import setup_logger
+
+logger = setup_logger('common.utils.schema')
+
+# Versioned migrations of the logistics database. The version applied last
+# is stored in ``PRAGMA user_version``; every migration runs once, in its own
+# transaction, and must also work on databases created by older code that
+# never recorded a version.
+
+TABLES = [
+    '''
+    CREATE TABLE IF NOT EXISTS Expediciones (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        idLine TEXT NOT NULL,
+        idMaterial TEXT NOT NULL,
+        Material TEXT,
+        Purchased REAL,
+        Served REAL,
+        Client TEXT,
+        Date TEXT,
+        date_inserted TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS Ubicaciones (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        Location TEXT NOT NULL,
+        Material TEXT,
+        HU TEXT,
+        Stock REAL,
+        Date TEXT,
+        date_inserted TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS IngestState (
+        source TEXT PRIMARY KEY,
+        fingerprint TEXT,
+        high_watermark TEXT,
+        rows INTEGER,
+        date_ingested TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    ''',
+]
+
+# Natural keys: name of the unique index, table and key columns. A handling
+# unit can hold the same material in one location with several entry dates,
+# so the entry date is part of the stock key.
+NATURAL_KEYS = [
+    ("ux_expediciones_idline", "Expediciones", ["idLine"]),
+    ("ux_ubicaciones_location_material_hu_date", "Ubicaciones", ["Location", "Material", "HU", "Date"]),
+]
+
+# Secondary indexes for the filtered reads and aggregates of the analysis
+# functions (by month and client, by material over time, stock by material).
+SECONDARY_INDEXES = [
+    ("ix_expediciones_date_client", "Expediciones", ["Date", "Client"]),
+    ("ix_expediciones_material_date", "Expediciones", ["idMaterial", "Date"]),
+    ("ix_ubicaciones_material", "Ubicaciones", ["Material"]),
+]
+
+# Column definitions used when a table is rebuilt with integer dates
+TYPED_COLUMNS = {
+    "Expediciones": [
+        ("id", "INTEGER PRIMARY KEY AUTOINCREMENT"),
+        ("idLine", "TEXT NOT NULL"),
+        ("idMaterial", "TEXT NOT NULL"),
+        ("Material", "TEXT"),
+        ("Purchased", "REAL"),
+        ("Served", "REAL"),
+        ("Client", "TEXT"),
+        ("Date", "INTEGER"),
+        ("date_inserted", "TIMESTAMP DEFAULT CURRENT_TIMESTAMP"),
+    ],
+    "Ubicaciones": [
+        ("id", "INTEGER PRIMARY KEY AUTOINCREMENT"),
+        ("Location", "TEXT NOT NULL"),
+        ("Material", "TEXT"),
+        ("HU", "TEXT"),
+        ("Stock", "REAL"),
+        ("Date", "INTEGER"),
+        ("date_inserted", "TIMESTAMP DEFAULT CURRENT_TIMESTAMP"),
+    ],
+}
+
+
+def _index_exists(conn: sqlite3.Connection, index: str) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (index,)).fetchone() is not None
+
+
+def _create_unique_index(conn: sqlite3.Connection, index: str, table: str, keys: List[str]) -> None:
+    """Create a unique index, first removing duplicated rows (keeping the first one)."""
+    columns = ", ".join(keys)
+    removed = conn.execute(
+        f"DELETE FROM {table} WHERE id NOT IN (SELECT MIN(id) FROM {table} GROUP BY {columns})"
+    ).rowcount
+    if removed:
+        logger.info(f"Removed {removed} duplicated {table} rows before adding unique index {index}.")
+    conn.execute(f"CREATE UNIQUE INDEX {index} ON {table} ({columns})")
+
+
+def _create_tables(conn: sqlite3.Connection) -> None:
+    """Version 1: base tables and unique indexes on the natural keys."""
+    for statement in TABLES:
+        conn.execute(statement)
+    for index, table, keys in NATURAL_KEYS:
+        if not _index_exists(conn, index):
+            _create_unique_index(conn, index, table, keys)
+
+
+def _integer_dates(conn: sqlite3.Connection) -> None:
+    """
+    Version 2: store ``Date`` as INTEGER seconds since the epoch.
+
+    SQLite cannot change a column type in place, so each table is rebuilt
+    and its rows copied with their ids (the snapshot watermarks rely on
+    them) and the AUTOINCREMENT counter.
+    """
+    for table, columns in TYPED_COLUMNS.items():
+        sequence = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,)).fetchone()
+        definition = ",\n    ".join(f"{name} {kind}" for name, kind in columns)
+        conn.execute(f"CREATE TABLE {table}_typed (\n    {definition}\n)")
+        names = [name for name, _ in columns]
+        select = [
+            "CASE WHEN typeof(Date) IN ('integer', 'real') THEN CAST(Date AS INTEGER) "
+            "ELSE CAST(strftime('%s', Date) AS INTEGER) END" if name == "Date" else name
+            for name in names
+        ]
+        conn.execute(f"INSERT INTO {table}_typed ({', '.join(names)}) SELECT {', '.join(select)} FROM {table}")
+        conn.execute(f"DROP TABLE {table}")
+        conn.execute(f"ALTER TABLE {table}_typed RENAME TO {table}")
+        if sequence:
+            conn.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?", (sequence[0], table))
+    for index, table, keys in NATURAL_KEYS:
+        conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {index} ON {table} ({', '.join(keys)})")
+
+
+def _secondary_indexes(conn: sqlite3.Connection) -> None:
+    """Version 3: indexes for date, client and material filters."""
+    for index, table, keys in SECONDARY_INDEXES:
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {index} ON {table} ({', '.join(keys)})")
+
+
+MIGRATIONS: List[Tuple[int, str, Callable[[sqlite3.Connection], None]]] = [
+    (1, "base tables and natural keys", _create_tables),
+    (2, "integer epoch dates", _integer_dates),
+    (3, "secondary indexes", _secondary_indexes),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    """Return the schema version recorded in the database."""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection, wal: bool = True) -> int:
+    """
+    Bring a database up to ``SCHEMA_VERSION``.
+
+    Args:
+        conn (sqlite3.Connection): Open database connection
+        wal (bool): Switch the database to write-ahead logging, so the
+            services keep reading while an ingest writes
+
+    Returns:
+        int: Schema version after the migration
+    """
+    if wal:
+        conn.execute("PRAGMA journal_mode=WAL")
+    current = schema_version(conn)
+    for version, description, step in MIGRATIONS:
+        if version <= current:
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            step(conn)
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        logger.info(f"Migrated database schema to version {version} ({description}).")
+        current = version
+    return current
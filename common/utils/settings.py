@@ -0,0 +1,90 @@
+import os
+
+# Runtime switches shared by the Dash app, the API and the ingest scripts.
+# Every value can be overridden through an environment variable.
+
+
+def _env_flag(name: str, default: bool = False) -> bool:
+    """Read a boolean flag ("1", "true", "yes", "on") from the environment."""
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+# Keep the in-memory frames in their compact form (categorical keys,
+# downcast numbers, unused columns dropped). See common.utils.compact.
+COMPACT_FRAMES = _env_flag("WAREHOUSE_COMPACT_FRAMES")
+
+# Minimum seconds between two checks of the database for new rows.
+# See common.utils.snapshot.SnapshotManager.
+SNAPSHOT_CHECK_INTERVAL = float(os.getenv("WAREHOUSE_SNAPSHOT_CHECK_INTERVAL", "0.5"))
+
+# Attach the snapshot published by the ingest step as memory-mapped Arrow
+# files instead of loading the database in every process.
+# See common.utils.shared_snapshot.
+SHARED_SNAPSHOT = _env_flag("WAREHOUSE_SHARED_SNAPSHOT")
+SHARED_SNAPSHOT_DIR = os.getenv("WAREHOUSE_SHARED_SNAPSHOT_DIR", "")
+
+# Process pool used by the heavier forecasting models on large catalogs.
+# See common.utils.forecast_models.fit_model.
+FORECAST_WORKERS = int(os.getenv("WAREHOUSE_FORECAST_WORKERS", "0")) or None
+FORECAST_CHUNK_SIZE = int(os.getenv("WAREHOUSE_FORECAST_CHUNK_SIZE", "2000"))
+FORECAST_PARALLEL_MIN_ROWS = int(os.getenv("WAREHOUSE_FORECAST_PARALLEL_MIN_ROWS", "5000"))
+
+# Where the analysis functions aggregate: "pandas" (in-memory snapshot
+# frames), "sql" (GROUP BY queries pushed down to the indexed SQLite
+# database, see common.utils.sql_backend) or "partitions" (per-month
+# expedition queries read from the month partitions only).
+ANALYTICS_BACKEND = os.getenv("WAREHOUSE_ANALYTICS_BACKEND", "pandas").strip().lower()
+
+# Keep a month-partitioned Parquet copy of the expeditions history, written
+# by the ingest step. See common.utils.partitions.
+PARTITIONED_STORAGE = _env_flag("WAREHOUSE_PARTITIONED_STORAGE")
+PARTITIONS_DIR = os.getenv("WAREHOUSE_PARTITIONS_DIR", "")
+
+# Warehouses served by one dashboard/API, as comma-separated "name=path"
+# pairs pointing at each warehouse database. With several warehouses the
+# analysis functions fan out over their databases in a thread pool and
+# merge the partial aggregates. See common.utils.warehouses.
+WAREHOUSE_SHARDS = os.getenv("WAREHOUSE_SHARDS", "")
+SHARD_WORKERS = int(os.getenv("WAREHOUSE_SHARD_WORKERS", "0")) or None
+
+# Top clients and references per year/month maintained incrementally on
+# every snapshot update: "exact" totals (the best TOPK_SIZE keys are kept
+# ranked) or "sketch", a Space-Saving summary of TOPK_SKETCH_CAPACITY
+# counters per period with bounded memory and approximate ranking.
+# See common.utils.topk.
+TOPK_MODE = os.getenv("WAREHOUSE_TOPK_MODE", "exact").strip().lower()
+TOPK_SIZE = int(os.getenv("WAREHOUSE_TOPK_SIZE", "10"))
+TOPK_SKETCH_CAPACITY = int(os.getenv("WAREHOUSE_TOPK_SKETCH_CAPACITY", "2000"))
+
+# Stock aging statistics (see common.utils.aging): increasing limits in
+# days of the age histogram buckets and the age percentiles reported per
+# material.
+STOCK_AGE_BUCKETS = tuple(int(v) for v in os.getenv("WAREHOUSE_STOCK_AGE_BUCKETS", "30,90,180,365").split(",") if v.strip())
+STOCK_AGE_PERCENTILES = tuple(float(v) for v in os.getenv("WAREHOUSE_STOCK_AGE_PERCENTILES", "50,90").split(",") if v.strip())
+
+# Cache of agent responses in front of the orchestrator, keyed by the
+# normalized question, the warehouse filter and the data version: at most
+# RESPONSE_CACHE_SIZE answers (0 disables the cache), each kept for
+# RESPONSE_CACHE_TTL seconds (0 keeps them until the data changes).
+RESPONSE_CACHE_SIZE = int(os.getenv("WAREHOUSE_RESPONSE_CACHE_SIZE", "256"))
+RESPONSE_CACHE_TTL = float(os.getenv("WAREHOUSE_RESPONSE_CACHE_TTL", "3600"))
+
+# Results of the agent tools cached per tool while the data is unchanged
+# (see common.utils.memoize): TOOL_CACHE_SIZE results per tool (0 disables
+# the cache), each kept for TOOL_CACHE_TTL seconds since tools measuring
+# ages default to the current time.
+TOOL_CACHE_SIZE = int(os.getenv("WAREHOUSE_TOOL_CACHE_SIZE", "128"))
+TOOL_CACHE_TTL = float(os.getenv("WAREHOUSE_TOOL_CACHE_TTL", "300"))
+
+# Answer canonical questions (top clients, top references, forecasts,
+# stock aging) straight from the analysis functions with a templated
+# response instead of the agents. See common.utils.query_router.
+FAST_PATH = _env_flag("WAREHOUSE_FAST_PATH", default=True)
+
+# Let the orchestrator agent consult several specialists concurrently for
+# multi-domain questions (the consult_specialists tool in
+# api_app/agents/agent.py) instead of one after another.
+PARALLEL_SPECIALISTS = _env_flag("WAREHOUSE_PARALLEL_SPECIALISTS", default=True)
@@ -0,0 +1,206 @@
+import os
+import json
+import glob
+import time
+import sqlite3
+import pandas as pd
+from contextlib import closing
+from typing import Dict, Optional, Tuple
+from .columnar_cache import write_arrow, feather
+from .snapshot import DatasetSnapshot, SnapshotManager, TableSpec
+from .logger import setup_logger
+
+logger = setup_logger('common.utils.shared_snapshot')
+
+# A snapshot of the database published once per ingest as one Arrow IPC
+# file per frame plus a manifest. Every process (Dash, each API worker)
+# memory-maps the files read-only instead of loading the tables itself:
+# numeric, datetime and category-code columns are zero-copy views of the
+# page cache, so their memory is paid once per host.
+
+MANIFEST = "manifest.json"
+
+
+def read_manifest(directory: str) -> Optional[dict]:
+    """
+    Return the manifest of the snapshot published in ``directory``.
+
+    Args:
+        directory (str): Shared snapshot directory
+
+    Returns:
+        dict: Manifest, or None when nothing was published yet
+    """
+    try:
+        with open(os.path.join(directory, MANIFEST), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def publish_snapshot(db_path: str, directory: str, tables: Dict[str, TableSpec], extra: Optional[dict] = None) -> dict:
+    """
+    Write the current content of the database as a shared snapshot.
+
+    Each frame is prepared and sorted like ``SnapshotManager`` does, then
+    written atomically as an uncompressed Arrow IPC file. The manifest is
+    replaced last, so readers only ever see complete versions; files of
+    older versions are removed afterwards (processes that still map them
+    keep their pages until they move to the new version).
+
+    Args:
+        db_path (str): SQLite database file
+        directory (str): Shared snapshot directory
+        tables (Dict[str, TableSpec]): Frames to publish
+        extra (dict): Additional manifest entries (e.g. the frame format)
+
+    Returns:
+        dict: The new manifest
+    """
+    if feather is None:
+        raise RuntimeError("pyarrow is required to publish a shared snapshot")
+    os.makedirs(directory, exist_ok=True)
+    previous = read_manifest(directory)
+    version = (previous or {}).get("version", 0) + 1
+    frames, watermarks, row_counts = {}, {}, {}
+    with closing(sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)) as conn:
+        for name, spec in tables.items():
+            max_id, count = conn.execute(f"SELECT COALESCE(MAX(id), 0), COUNT(*) FROM {spec.table}").fetchone()
+            df = SnapshotManager._sorted(spec.prepare(pd.read_sql_query(f"SELECT * FROM {spec.table}", conn)), spec)
+            file_name = f"{name}-{version}.arrow"
+            write_arrow(df, os.path.join(directory, file_name))
+            frames[name], watermarks[name], row_counts[name] = file_name, int(max_id), int(count)
+
+    manifest = {
+        "version": version,
+        "frames": frames,
+        "watermarks": watermarks,
+        "row_counts": row_counts,
+        "published_at": time.time(),
+        **(extra or {}),
+    }
+    tmp_path = os.path.join(directory, f"{MANIFEST}.{os.getpid()}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(directory, MANIFEST))
+
+    for old in glob.glob(os.path.join(directory, "*.arrow")):
+        if os.path.basename(old) not in frames.values():
+            try:
+                os.remove(old)
+            except OSError as e:
+                logger.warning(f"Could not remove old shared snapshot file {old}: {e}")
+    logger.info(f"Published shared snapshot version {version} to {directory}: {row_counts}")
+    return manifest
+
+
+def attach_frame(path: str) -> pd.DataFrame:
+    """
+    Memory-map a published frame read-only.
+
+    ``split_blocks`` keeps pandas from consolidating the columns into new
+    blocks, so columns without nulls stay views of the mapped file.
+
+    Args:
+        path (str): Arrow IPC file
+
+    Returns:
+        pd.DataFrame: Read-only frame
+    """
+    return feather.read_table(path, memory_map=True).to_pandas(split_blocks=True)
+
+
+class SharedSnapshotManager(SnapshotManager):
+    """
+    ``SnapshotManager`` attaching the snapshots published in a directory.
+
+    Changes are detected from the manifest file; a new version is attached
+    in full (views are rebuilt rather than updated). The snapshot version
+    is the published one, so it is the same in every process. Until a
+    snapshot is published, or when the database was written to after the
+    last publication, the database is read directly like the base class
+    does, until the next publication.
+    """
+
+    def __init__(self, directory: str, db_path: str, tables: Dict[str, TableSpec], check_interval: float = 0.5):
+        super().__init__(db_path, tables, check_interval=check_interval)
+        self.directory = directory
+        self._manifest_state: Optional[Tuple[int, int, int]] = None
+        self._attached: Optional[int] = None
+        self._written_since_publish = False
+
+    def _manifest_signature(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            stat = os.stat(os.path.join(self.directory, MANIFEST))
+        except OSError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def _changed(self) -> bool:
+        state = self._manifest_signature()
+        # Also watch the database, for writes that are not published
+        database_changed = super()._changed()
+        if state is None:
+            return database_changed
+        published = state != self._manifest_state
+        if published:
+            self._written_since_publish = False
+        elif self._data_moved:
+            self._written_since_publish = True
+        self._manifest_state = state
+        return published or database_changed
+
+    def _matches_database(self, manifest: dict) -> bool:
+        """True when the tables still have the ids and row counts recorded in ``manifest``."""
+        conn = self._connection()
+        for name, spec in self.tables.items():
+            max_id, count = conn.execute(f"SELECT COALESCE(MAX(id), 0), COUNT(*) FROM {spec.table}").fetchone()
+            if (max_id, count) != (manifest.get("watermarks", {}).get(name), manifest.get("row_counts", {}).get(name)):
+                return False
+        return True
+
+    def _load(self, previous: Optional[DatasetSnapshot], full: bool = False) -> DatasetSnapshot:
+        try:
+            return self._attach(previous, full)
+        except Exception:
+            # Attach again on the next check instead of waiting for another publication
+            self._manifest_state = None
+            raise
+
+    def _attach(self, previous: Optional[DatasetSnapshot], full: bool) -> DatasetSnapshot:
+        manifest = read_manifest(self.directory)
+        if manifest is None:
+            logger.warning(f"No shared snapshot published in {self.directory}, reading {self.db_path}")
+            self._attached = None
+            # Manifest watermarks are database ids, so appends still apply incrementally
+            return super()._load(previous, full)
+        if self._written_since_publish or (manifest["version"] != self._attached and not self._matches_database(manifest)):
+            if self._attached is not None or not self._written_since_publish:
+                logger.warning(
+                    f"{self.db_path} was written to after shared snapshot version {manifest['version']} "
+                    f"was published, reading it directly until the next publication"
+                )
+            self._written_since_publish = True
+            self._attached = None
+            return super()._load(previous, full)
+        if previous is not None and not full and manifest["version"] == self._attached:
+            return previous
+
+        frames = {
+            name: attach_frame(os.path.join(self.directory, file_name))
+            for name, file_name in manifest["frames"].items()
+        }
+        for name in self.tables:
+            frames.setdefault(name, pd.DataFrame())
+        # Equal to the published version unless the database was read directly before
+        version = manifest["version"] if previous is None else max(manifest["version"], previous.version + 1)
+        self._attached = manifest["version"]
+        self._data_moved = False
+        logger.info(f"Attached shared snapshot version {manifest['version']} from {self.directory}")
+        return DatasetSnapshot(
+            version=version,
+            frames=frames,
+            watermarks=manifest.get("watermarks", {}),
+            row_counts=manifest.get("row_counts", {}),
+            loaded_at=time.time(),
+        )
@@ -0,0 +1,288 @@
+import os
+import time
+import sqlite3
+import threading
+import pandas as pd
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Optional, Tuple
+from .logger import setup_logger
+from .compact import concat_frames
+
+logger = setup_logger('common.utils.snapshot')
+
+
+@dataclass(frozen=True)
+class TableSpec:
+    """How one SQLite table becomes a snapshot frame."""
+    table: str
+    prepare: Callable[[pd.DataFrame], pd.DataFrame]
+    # Keep the frame sorted by this column (stable sort, fresh RangeIndex)
+    sort_by: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class DatasetSnapshot:
+    """
+    Immutable view of the database at one point in time.
+
+    ``version`` increases every time a new snapshot is swapped in, so any
+    cache keyed on it is invalidated when the data changes. Frames must be
+    treated as read-only by callers.
+    """
+    version: int
+    frames: Dict[str, pd.DataFrame]
+    watermarks: Dict[str, int] = field(default_factory=dict)
+    row_counts: Dict[str, int] = field(default_factory=dict)
+    loaded_at: float = 0.0
+    derived_cache: Dict[str, Any] = field(default_factory=dict, repr=False, compare=False)
+
+    def derived(self, key: str, build: Callable[["DatasetSnapshot"], Any]) -> Any:
+        """
+        Return a structure derived from this snapshot, building it on first use.
+
+        Args:
+            key (str): Name of the derived structure
+            build (Callable): Function computing it from the snapshot
+
+        Returns:
+            Any: The cached structure
+        """
+        if key not in self.derived_cache:
+            self.derived_cache[key] = build(self)
+        return self.derived_cache[key]
+
+    @property
+    def expeditions(self) -> pd.DataFrame:
+        return self.frames.get("expeditions", pd.DataFrame())
+
+    @property
+    def stock(self) -> pd.DataFrame:
+        return self.frames.get("stock", pd.DataFrame())
+
+
+@dataclass(frozen=True)
+class ViewSpec:
+    """
+    A structure derived from every snapshot (index, aggregate, ...).
+
+    ``build`` computes it from a whole snapshot. The optional ``update``
+    receives the previous value and the newly appended rows per frame, and
+    returns the value for the new snapshot without a full rebuild.
+    """
+    build: Callable[[DatasetSnapshot], Any]
+    update: Optional[Callable[[Any, Dict[str, pd.DataFrame]], Any]] = None
+
+
+class SnapshotManager:
+    """
+    Keep an up-to-date ``DatasetSnapshot`` of a SQLite database.
+
+    Changes are detected cheaply with ``PRAGMA data_version`` on a
+    long-lived connection plus the file's inode/mtime/size. When something
+    changed, only rows with ``id`` above the previous high-watermark are
+    read and appended; if rows were deleted the table is reloaded in full.
+    Rows updated in place change neither the highest id nor the row count:
+    when the database changed but no table did, every table is reloaded.
+    The new snapshot is swapped in atomically.
+
+    Derived structures registered with ``register_view`` are built lazily
+    per snapshot and, when they define an ``update``, carried over to the
+    next snapshot by applying only the appended rows.
+    """
+
+    def __init__(self, db_path: str, tables: Dict[str, TableSpec], check_interval: float = 0.5):
+        self.db_path = db_path
+        self.tables = tables
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._snapshot: Optional[DatasetSnapshot] = None
+        self._conn: Optional[sqlite3.Connection] = None
+        self._file_state: Optional[Tuple[int, int, int]] = None
+        self._data_version: Optional[int] = None
+        # Whether the last check saw a committed write (not only a file change)
+        self._data_moved = False
+        self._last_check = 0.0
+        self._views: Dict[str, ViewSpec] = {}
+
+    def register_view(
+        self,
+        key: str,
+        build: Callable[[DatasetSnapshot], Any],
+        update: Optional[Callable[[Any, Dict[str, pd.DataFrame]], Any]] = None,
+    ) -> None:
+        """
+        Register a structure derived from every snapshot.
+
+        Args:
+            key (str): Name of the view
+            build (Callable): Computes the view from a snapshot
+            update (Callable): Optional incremental update from appended rows
+        """
+        self._views[key] = ViewSpec(build, update)
+
+    def view(self, key: str) -> Any:
+        """
+        Return a registered view of the current snapshot.
+
+        Args:
+            key (str): Name given to ``register_view``
+
+        Returns:
+            Any: The view, built on first use for this snapshot version
+        """
+        return self.current().derived(key, self._views[key].build)
+
+    def current(self) -> DatasetSnapshot:
+        """Return the latest snapshot, refreshing it if the database changed."""
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() - self._last_check < self.check_interval:
+            return snapshot
+        return self.refresh()
+
+    def version(self) -> int:
+        """Version of the latest snapshot."""
+        return self.current().version
+
+    def refresh(self, force: bool = False) -> DatasetSnapshot:
+        """
+        Check the database for changes and swap in a new snapshot if needed.
+
+        Args:
+            force (bool): Reload every table from scratch
+
+        Returns:
+            DatasetSnapshot: Current snapshot
+        """
+        with self._lock:
+            self._last_check = time.monotonic()
+            try:
+                changed = self._changed()
+                if self._snapshot is not None and not force and not changed:
+                    return self._snapshot
+                self._snapshot = self._load(self._snapshot, full=force)
+            except Exception as e:
+                logger.error(f"Error refreshing snapshot from {self.db_path}: {e}")
+                # Retry on the next check instead of waiting for another change
+                self._data_version = None
+                if self._snapshot is None:
+                    self._snapshot = DatasetSnapshot(
+                        version=0,
+                        frames={name: pd.DataFrame() for name in self.tables},
+                        loaded_at=time.time(),
+                    )
+            return self._snapshot
+
+    def close(self) -> None:
+        """Close the change-detection connection."""
+        with self._lock:
+            self._close_connection()
+
+    def _close_connection(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _file_signature(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            stat = os.stat(self.db_path)
+        except OSError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        return self._conn
+
+    def _changed(self) -> bool:
+        file_state = self._file_signature()
+        replaced = self._file_state is not None and file_state is not None and file_state[0] != self._file_state[0]
+        if replaced:
+            # The file was replaced: the old connection still sees the old inode
+            self._close_connection()
+        data_version = self._connection().execute("PRAGMA data_version").fetchone()[0]
+        changed = file_state != self._file_state or data_version != self._data_version
+        self._data_moved = replaced or (self._data_version is not None and data_version != self._data_version)
+        self._file_state = file_state
+        self._data_version = data_version
+        return changed
+
+    @staticmethod
+    def _sorted(df: pd.DataFrame, spec: TableSpec) -> pd.DataFrame:
+        if spec.sort_by is None or spec.sort_by not in df.columns or df[spec.sort_by].is_monotonic_increasing:
+            return df
+        return df.sort_values(spec.sort_by, kind="mergesort", ignore_index=True)
+
+    def _append_only(self, table: str, old_max: int, old_count: int, max_id: int, count: int) -> bool:
+        """True when the only change since the last load is rows appended above ``old_max``."""
+        if max_id < old_max or count < old_count:
+            return False
+        new_rows = self._connection().execute(
+            f"SELECT COUNT(*) FROM {table} WHERE id > ?", (old_max,)
+        ).fetchone()[0]
+        return count - old_count == new_rows
+
+    def _load(self, previous: Optional[DatasetSnapshot], full: bool = False) -> DatasetSnapshot:
+        conn = self._connection()
+        frames, watermarks, row_counts = {}, {}, {}
+        deltas: Dict[str, pd.DataFrame] = {}
+        reloaded = previous is None or full
+        changed = reloaded
+        for name, spec in self.tables.items():
+            try:
+                max_id, count = conn.execute(
+                    f"SELECT COALESCE(MAX(id), 0), COUNT(*) FROM {spec.table}"
+                ).fetchone()
+            except sqlite3.Error as e:
+                logger.error(f"Error reading {spec.table} from {self.db_path}: {e}")
+                frames[name], watermarks[name], row_counts[name] = pd.DataFrame(), 0, 0
+                if previous is not None and previous.row_counts.get(name, 0) != 0:
+                    changed = reloaded = True
+                continue
+
+            old_max = previous.watermarks.get(name, 0) if previous else 0
+            old_count = previous.row_counts.get(name, 0) if previous else 0
+            incremental = previous is not None and not full
+            if incremental and max_id == old_max and count == old_count:
+                frames[name] = previous.frames[name]
+            elif incremental and self._append_only(spec.table, old_max, old_count, max_id, count):
+                delta = pd.read_sql_query(f"SELECT * FROM {spec.table} WHERE id > ?", conn, params=(old_max,))
+                deltas[name] = spec.prepare(delta)
+                frames[name] = self._sorted(concat_frames([previous.frames[name], deltas[name]]), spec)
+                logger.info(f"Appended {len(delta)} new rows from {spec.table} to snapshot.")
+                changed = True
+            else:
+                frames[name] = self._sorted(spec.prepare(pd.read_sql_query(f"SELECT * FROM {spec.table}", conn)), spec)
+                logger.info(f"Loaded {len(frames[name])} rows from {spec.table} into snapshot.")
+                changed = reloaded = True
+            watermarks[name], row_counts[name] = int(max_id), int(count)
+
+        if not changed:
+            if self._data_moved:
+                # Written to, but no table gained or lost rows: rows were updated in place
+                self._data_moved = False
+                logger.info(f"{self.db_path} changed without new or deleted rows, reloading every table.")
+                return self._load(previous, full=True)
+            return previous
+        version = previous.version + 1 if previous else 1
+        snapshot = DatasetSnapshot(
+            version=version,
+            frames=frames,
+            watermarks=watermarks,
+            row_counts=row_counts,
+            loaded_at=time.time(),
+        )
+        if not reloaded:
+            self._carry_views(previous, snapshot, deltas)
+        logger.info(f"Swapped in dataset snapshot version {version}: {row_counts}")
+        return snapshot
+
+    def _carry_views(self, previous: DatasetSnapshot, snapshot: DatasetSnapshot, deltas: Dict[str, pd.DataFrame]) -> None:
+        """Update the incremental views already built on the previous snapshot."""
+        for key, spec in self._views.items():
+            if spec.update is None or key not in previous.derived_cache:
+                continue
+            try:
+                snapshot.derived_cache[key] = spec.update(previous.derived_cache[key], deltas)
+            except Exception as e:
+                logger.error(f"Error updating view {key}, it will be rebuilt: {e}")
@@ -0,0 +1,490 @@
+import os
+import sqlite3
+import threading
+import pandas as pd
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+from .data_loader import DB_PATH, parse_dates
+from .schema import schema_version
+from .stock_summary import date_label, empty_metrics
+from .logger import setup_logger
+
+logger = setup_logger('common.utils.sql_backend')
+
+# Aggregations of the analysis functions pushed down to SQLite as
+# parameterized GROUP BY queries (enabled with
+# WAREHOUSE_ANALYTICS_BACKEND=sql). Each function returns exactly what the
+# pandas implementation computes from the snapshot frames, but only the
+# aggregated rows leave the database, and the date filters use the indexes
+# of schema version 3 (see common.utils.schema).
+
+_local = threading.local()
+
+
+def connection(db_path: str = DB_PATH) -> sqlite3.Connection:
+    """
+    Return this thread's read-only connection to the database.
+
+    Args:
+        db_path (str): SQLite database file
+
+    Returns:
+        sqlite3.Connection: Connection reused by later calls on the thread
+
+    Raises:
+        RuntimeError: The database predates schema version 2 (text dates),
+            which the date filters of these queries cannot compare
+    """
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    conn = connections.get(db_path)
+    if conn is None:
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        version = schema_version(conn)
+        if version < 2:
+            conn.close()
+            raise RuntimeError(
+                f"Database {db_path} has schema version {version} (text dates): run "
+                f"python -m common.utils.data_to_sql to migrate it before using the sql backend or warehouse shards."
+            )
+        connections[db_path] = conn
+    return conn
+
+
+def _epoch(timestamp: pd.Timestamp) -> int:
+    return int(timestamp.value // 1_000_000_000)
+
+
+def period_clause(year: Optional[int] = None, month: Optional[int] = None) -> Tuple[List[str], list]:
+    """
+    WHERE conditions for a year and/or month filter on ``Date``.
+
+    A falsy year or month means no filter on that field, like the analysis
+    functions. Filters with a year become a range on the indexed column.
+
+    Args:
+        year (int): Year to filter
+        month (int): Month to filter
+
+    Returns:
+        Tuple[List[str], list]: Conditions and their parameters
+    """
+    if year and month:
+        start = pd.Timestamp(year=year, month=month, day=1)
+        return ["Date >= ?", "Date < ?"], [_epoch(start), _epoch(start + pd.offsets.MonthBegin(1))]
+    if year:
+        return ["Date >= ?", "Date < ?"], [_epoch(pd.Timestamp(year=year, month=1, day=1)), _epoch(pd.Timestamp(year=year + 1, month=1, day=1))]
+    if month:
+        return ["CAST(strftime('%m', Date, 'unixepoch') AS INTEGER) = ?"], [month]
+    return [], []
+
+
+def _in_clause(column: str, values: Sequence) -> Tuple[str, list]:
+    return f"{column} IN ({', '.join('?' for _ in values)})", [str(value) for value in values]
+
+
+def _where(conditions: List[str]) -> str:
+    return f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+
+def query(sql: str, params: Sequence = (), index_col: Optional[str] = None, db_path: str = DB_PATH) -> pd.DataFrame:
+    """
+    Run a read query, returning an empty frame on database errors.
+
+    Args:
+        sql (str): Parameterized query
+        params (Sequence): Query parameters
+        index_col (str): Column to use as index
+        db_path (str): SQLite database file
+
+    Returns:
+        pd.DataFrame: Query result
+
+    Raises:
+        RuntimeError: The database is not migrated (see ``connection``)
+    """
+    try:
+        conn = connection(db_path)
+    except sqlite3.Error as e:
+        logger.error(f"Error opening {db_path} for analytics queries: {e}")
+        return pd.DataFrame()
+    try:
+        return pd.read_sql_query(sql, conn, params=list(params), index_col=index_col)
+    except Exception as e:
+        logger.error(f"Error running analytics query on {db_path}: {e}")
+        return pd.DataFrame()
+
+
+class DatabaseVersion:
+    """
+    Change counter of a SQLite database, read without scanning any table.
+
+    Like ``SnapshotManager``, a long-lived connection reads ``PRAGMA
+    data_version`` (it moves when another connection, in any process,
+    commits) along with the file's inode/mtime/size (the file was
+    replaced). The counter is incremented whenever either moved since the
+    previous check.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.counter = 0
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._state: Optional[tuple] = None
+
+    def current(self) -> int:
+        """Return the counter, incremented if the database changed since the previous call."""
+        with self._lock:
+            try:
+                state = self._read_state()
+            except sqlite3.Error as e:
+                logger.error(f"Error reading the data version of {self.db_path}: {e}")
+                self._close()
+                state = None
+            # An unreadable state never matches, so nothing is cached against it
+            if state is None or state != self._state:
+                self.counter += 1
+                self._state = state
+            return self.counter
+
+    def _read_state(self) -> tuple:
+        try:
+            stat = os.stat(self.db_path)
+        except OSError:
+            self._close()
+            return (None,)
+        file_state = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if self._state and self._state[0] and self._state[0][0] != stat.st_ino:
+            # The file was replaced: the old connection still sees the old inode
+            self._close()
+        if self._conn is None:
+            self._conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False)
+        return (file_state, self._conn.execute("PRAGMA data_version").fetchone()[0])
+
+    def _close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+_versions: Dict[str, DatabaseVersion] = {}
+_versions_lock = threading.Lock()
+
+# (version, signature) per (table, database)
+_signatures: Dict[Tuple[str, str], Tuple[int, tuple]] = {}
+
+
+def database_version(db_path: str = DB_PATH) -> int:
+    """
+    Version of a database's contents, changed by every committed write.
+
+    Args:
+        db_path (str): SQLite database file
+
+    Returns:
+        int: Counter of the changes seen by this process
+    """
+    with _versions_lock:
+        version = _versions.get(db_path)
+        if version is None:
+            version = _versions[db_path] = DatabaseVersion(db_path)
+    return version.current()
+
+
+def table_signature(table: str, db_path: str = DB_PATH) -> tuple:
+    """
+    Change marker of an ingested table: its highest id and row count.
+
+    Ingest only appends or deletes rows, so results cached under an
+    unchanged signature are still valid. The table is only counted again
+    once ``database_version`` reports a write to the database.
+    """
+    version = database_version(db_path)
+    cached = _signatures.get((table, db_path))
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    result = query(f"SELECT COALESCE(MAX(id), 0) AS max_id, COUNT(*) AS row_count FROM {table}", db_path=db_path)
+    signature = tuple(int(value) for value in result.iloc[0]) if not result.empty else (0, 0)
+    _signatures[(table, db_path)] = (version, signature)
+    return signature
+
+
+def _has_rows(table: str, conditions: List[str], params: list, db_path: str = DB_PATH) -> bool:
+    result = query(f"SELECT EXISTS (SELECT 1 FROM {table} {_where(conditions)}) AS found", params, db_path=db_path)
+    return bool(not result.empty and result["found"].iloc[0])
+
+
+def period_has_rows(year: Optional[int] = None, month: Optional[int] = None, db_path: str = DB_PATH) -> bool:
+    """Whether any expedition falls in the year and/or month."""
+    conditions, params = period_clause(year, month)
+    return _has_rows("Expediciones", conditions, params, db_path)
+
+
+def stock_has_rows(db_path: str = DB_PATH) -> bool:
+    """Whether the stock table has any row."""
+    return _has_rows("Ubicaciones", [], [], db_path)
+
+
+def client_totals(year: Optional[int] = None, month: Optional[int] = None, db_path: str = DB_PATH) -> pd.DataFrame:
+    """
+    Per-client totals for a year and/or month, like ``client_cube.client_totals``.
+
+    Args:
+        year (int): Year to filter
+        month (int): Month to filter
+        db_path (str): SQLite database file
+
+    Returns:
+        pd.DataFrame: Purchased, Served and lines per Client, sorted by Client
+    """
+    conditions, params = period_clause(year, month)
+    totals = query(
+        "SELECT Client, TOTAL(Purchased) AS Purchased, TOTAL(Served) AS Served, COUNT(*) AS lines "
+        f"FROM Expediciones {_where(['Date IS NOT NULL'] + conditions)} "
+        "GROUP BY Client ORDER BY Client",
+        params,
+        index_col="Client",
+        db_path=db_path,
+    )
+    if totals.empty:
+        return pd.DataFrame({column: pd.Series(dtype="float64") for column in ["Purchased", "Served", "lines"]})
+    return totals.astype("float64")
+
+
+def top_references(year: Optional[int] = None, month: Optional[int] = None, limit: int = 5) -> List[str]:
+    """
+    Top references by ordered quantity, ties broken by reference.
+
+    Args:
+        year (int): Year to filter
+        month (int): Month to filter
+        limit (int): Number of references
+
+    Returns:
+        List[str]: Reference ids
+    """
+    conditions, params = period_clause(year, month)
+    totals = query(
+        "SELECT idMaterial, TOTAL(Purchased) AS total "
+        f"FROM Expediciones {_where(conditions)} "
+        "GROUP BY idMaterial ORDER BY total DESC, idMaterial LIMIT ?",
+        params + [limit],
+    )
+    return [str(ref) for ref in totals.get("idMaterial", [])]
+
+
+def reference_totals(year: Optional[int] = None, month: Optional[int] = None, db_path: str = DB_PATH) -> pd.Series:
+    """
+    Total ordered quantity of every reference, the partial aggregate of ``top_references``.
+
+    Args:
+        year (int): Year to filter
+        month (int): Month to filter
+        db_path (str): SQLite database file
+
+    Returns:
+        pd.Series: Purchased total indexed by idMaterial
+    """
+    conditions, params = period_clause(year, month)
+    totals = query(
+        f"SELECT idMaterial, TOTAL(Purchased) AS total FROM Expediciones {_where(conditions)} GROUP BY idMaterial",
+        params,
+        index_col="idMaterial",
+        db_path=db_path,
+    )
+    return totals["total"] if not totals.empty else pd.Series(dtype="float64")
+
+
+def monthly_served(
+    year: Optional[int] = None,
+    month: Optional[int] = None,
+    reference_list: Optional[List[str]] = None,
+    db_path: str = DB_PATH,
+) -> pd.DataFrame:
+    """
+    Served quantity per reference and month.
+
+    Args:
+        year (int): Year to filter
+        month (int): Month to filter
+        reference_list (List[str]): Reference ids, all references if None
+        db_path (str): SQLite database file
+
+    Returns:
+        pd.DataFrame: idMaterial, period (YYYY-MM) and Served, sorted by reference and period
+    """
+    conditions, params = period_clause(year, month)
+    conditions = conditions + ["Date IS NOT NULL"]
+    if reference_list is not None:
+        if not reference_list:
+            return pd.DataFrame(columns=["idMaterial", "period", "Served"])
+        in_clause, refs = _in_clause("idMaterial", reference_list)
+        conditions, params = conditions + [in_clause], params + refs
+    return query(
+        "SELECT idMaterial, strftime('%Y-%m', Date, 'unixepoch') AS period, TOTAL(Served) AS Served "
+        f"FROM Expediciones {_where(conditions)} "
+        "GROUP BY idMaterial, period ORDER BY idMaterial, period",
+        params,
+        db_path=db_path,
+    )
+
+
+def reference_time_series(year: Optional[int], month: Optional[int], reference_list: List[str]) -> Dict[str, dict]:
+    """
+    Monthly served quantity of the given references.
+
+    Args:
+        year (int): Year to filter
+        month (int): Month to filter
+        reference_list (List[str]): Reference ids
+
+    Returns:
+        Dict[str, dict]: "dates" (YYYY-MM) and "quantities" per reference
+        (empty lists for a period without expeditions), empty if there are
+        no expeditions at all
+    """
+    if not period_has_rows():
+        return {}
+    return time_series_from_monthly(monthly_served(year, month, reference_list), reference_list)
+
+
+def time_series_from_monthly(series: pd.DataFrame, reference_list: List[str]) -> Dict[str, dict]:
+    """Turn ``monthly_served`` rows into the time series of each reference."""
+    by_reference = {ref: data for ref, data in series.groupby("idMaterial")} if not series.empty else {}
+    time_series = {}
+    for ref in reference_list:
+        data = by_reference.get(str(ref))
+        time_series[ref] = {
+            'dates': [] if data is None else data["period"].tolist(),
+            'quantities': [] if data is None else [float(q) for q in data["Served"]],
+        }
+    return time_series
+
+
+def top_stock_references(limit: int = 5) -> List[str]:
+    """
+    Top references by total pieces in stock, ties broken by reference.
+
+    Args:
+        limit (int): Number of references
+
+    Returns:
+        List[str]: Material names
+    """
+    totals = query(
+        "SELECT Material, TOTAL(Stock) AS total FROM Ubicaciones WHERE Material IS NOT NULL "
+        "GROUP BY Material ORDER BY total DESC, Material LIMIT ?",
+        [limit],
+    )
+    return [str(ref) for ref in totals.get("Material", [])]
+
+
+def stock_totals(db_path: str = DB_PATH) -> pd.Series:
+    """
+    Total pieces of every material, the partial aggregate of ``top_stock_references``.
+
+    Args:
+        db_path (str): SQLite database file
+
+    Returns:
+        pd.Series: Stock total indexed by Material
+    """
+    totals = query(
+        "SELECT Material, TOTAL(Stock) AS total FROM Ubicaciones WHERE Material IS NOT NULL GROUP BY Material",
+        index_col="Material",
+        db_path=db_path,
+    )
+    return totals["total"] if not totals.empty else pd.Series(dtype="float64")
+
+
+def stock_metrics(reference_list: List[str], db_path: str = DB_PATH) -> Dict[str, dict]:
+    """
+    Total pieces, distinct locations and HUs and entry date range of the given references.
+
+    Args:
+        reference_list (List[str]): Material names
+        db_path (str): SQLite database file
+
+    Returns:
+        Dict[str, dict]: Metrics per reference, empty if there is no stock data
+    """
+    if not stock_has_rows(db_path):
+        return {}
+    by_reference = {}
+    if reference_list:
+        in_clause, refs = _in_clause("Material", reference_list)
+        rows = query(
+            "SELECT Material, TOTAL(Stock) AS total_pieces, COUNT(DISTINCT Location) AS location_count, "
+            "COUNT(DISTINCT HU) AS hu_count, MIN(Date) AS oldest, MAX(Date) AS newest "
+            f"FROM Ubicaciones WHERE {in_clause} GROUP BY Material",
+            refs,
+            db_path=db_path,
+        )
+        if not rows.empty:
+            rows["oldest"], rows["newest"] = parse_dates(rows["oldest"]), parse_dates(rows["newest"])
+            by_reference = rows.set_index("Material").to_dict("index")
+    metrics = {}
+    for ref in reference_list:
+        row = by_reference.get(str(ref))
+        if row is None:
+            metrics[ref] = empty_metrics()
+            continue
+        metrics[ref] = {
+            'total_pieces': float(row["total_pieces"]),
+            'location_count': int(row["location_count"]),
+            'hu_count': int(row["hu_count"]),
+            'oldest_entry': date_label(row["oldest"]),
+            'newest_entry': date_label(row["newest"]),
+        }
+    return metrics
+
+
+def stock_age_totals(reference_list: List[str], now: Optional[datetime] = None, db_path: str = DB_PATH) -> pd.DataFrame:
+    """
+    Sum and count of whole days since entry per material, the partial
+    aggregate of ``avg_time_in_warehouse``.
+
+    Args:
+        reference_list (List[str]): Material names
+        now (datetime): Reference time, defaults to the current time
+        db_path (str): SQLite database file
+
+    Returns:
+        pd.DataFrame: days (sum) and hus (rows with a date) indexed by Material
+    """
+    if not reference_list:
+        return pd.DataFrame(columns=["days", "hus"])
+    now_seconds = _epoch(pd.Timestamp(now or datetime.now()).floor("s"))
+    in_clause, refs = _in_clause("Material", reference_list)
+    # SQLite's integer division truncates; entries after ``now`` need the floor like pandas
+    return query(
+        "SELECT Material, SUM((? - Date) / 86400 - ((? - Date) % 86400 < 0)) AS days, COUNT(Date) AS hus "
+        f"FROM Ubicaciones WHERE {in_clause} GROUP BY Material ORDER BY Material",
+        [now_seconds, now_seconds] + refs,
+        index_col="Material",
+        db_path=db_path,
+    )
+
+
+def average_days(totals: pd.DataFrame) -> Dict[str, float]:
+    """Average days per material from ``stock_age_totals`` rows, rounded to one decimal."""
+    if totals.empty:
+        return {}
+    days = (pd.to_numeric(totals["days"], errors="coerce") / totals["hus"].where(totals["hus"] > 0)).round(1)
+    return {str(ref): float(value) for ref, value in days.items()}
+
+
+def avg_time_in_warehouse(reference_list: List[str], now: Optional[datetime] = None) -> Dict[str, float]:
+    """
+    Average whole days since entry of the HUs of the given references.
+
+    Args:
+        reference_list (List[str]): Material names
+        now (datetime): Reference time, defaults to the current time
+
+    Returns:
+        Dict[str, float]: Average days per reference present in stock
+    """
+    return average_days(stock_age_totals(reference_list, now))
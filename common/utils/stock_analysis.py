@@ -1,84 +1,125 @@
 import pandas as pd
-from datetime import datetime
+from .aging import aging_index, aging_summary, as_of_ns
 from .data_loader import stock_data_sql
+from .stock_summary import stock_summary
+from .date_index import DateLike
+from . import sql_backend
+from . import warehouses
+from . import settings
 from .logger import setup_logger
-from typing import List, Dict
+from typing import List, Dict, Optional
 
 logger = setup_logger('common.utils.stock_analysis')
 
-def get_top_references_stock(limit: int = 5) -> List[str]:
+def get_top_references_stock(limit: int = 5, warehouse: Optional[str] = None) -> List[str]:
     """
     Return top references by total pieces in stock.
     
     Args:
         limit (int): Number of top references to return (1-8)
+        warehouse (str): Warehouse to analyse, all warehouses if not provided
     
     Returns:
         List[str]: List of top reference names
     """
+    if warehouses.sharded(warehouse):
+        reference_totals = warehouses.top_stock_references(limit, warehouse)
+        logger.info(f"Top references: {reference_totals}")
+        return reference_totals
+
+    if settings.ANALYTICS_BACKEND == "sql":
+        reference_totals = sql_backend.top_stock_references(limit)
+        logger.info(f"Top references: {reference_totals}")
+        return reference_totals
+
     df = stock_data_sql()
     if df.empty:
         return []
     
-    reference_totals = df.groupby('Material')['Stock'].sum().nlargest(limit)
+    reference_totals = df.groupby('Material', observed=True)['Stock'].sum().nlargest(limit)
     reference_totals = reference_totals.index.tolist()
     reference_totals = [str(ref) for ref in reference_totals]
     logger.info(f"Top references: {reference_totals}")
     return reference_totals
 
-def get_avg_time_in_warehouse(reference_list: List[str]) -> Dict[str, float]:
+def get_avg_time_in_warehouse(
+    reference_list: List[str], warehouse: Optional[str] = None, as_of: Optional[DateLike] = None
+) -> Dict[str, float]:
     """
     Calculate average time in warehouse for HUs of given references.
     
     Args:
         reference_list (List[str]): List of reference names
+        warehouse (str): Warehouse to analyse, all warehouses if not provided
+        as_of (str): Date the ages are measured at (YYYY-MM-DD), now if not provided
     
     Returns:
         Dict[str, float]: Average time in days for each reference
     """
-    df = stock_data_sql()
-    if df.empty:
-        return {}
+    if warehouses.sharded(warehouse):
+        avg_times = warehouses.avg_time_in_warehouse(reference_list, warehouse, as_of)
+        logger.info(f"Calculated average time in warehouse for references: {avg_times}")
+        return avg_times
 
-    df_filtered = df[df['Material'].isin(reference_list)].copy()
+    if settings.ANALYTICS_BACKEND == "sql":
+        avg_times = sql_backend.avg_time_in_warehouse(reference_list, as_of)
+        logger.info(f"Calculated average time in warehouse for references: {avg_times}")
+        return avg_times
 
-    current_date = datetime.now()
-    
-    # Calcular días para todos de golpe (Vectorizado)
-    df_filtered['days'] = (current_date - df_filtered['Date']).dt.days
-    
-    # Agrupar y calcular media
-    result = df_filtered.groupby('Material')['days'].mean().round(1).to_dict()
-    avg_times = {str(k): float(v) for k, v in result.items()}
+    # Sums of entry days per material: O(1) arithmetic for any as-of date
+    avg_times = aging_index().mean_days(reference_list, as_of_ns(as_of))
     logger.info(f"Calculated average time in warehouse for references: {avg_times}")
     return avg_times
+
+
+def get_stock_aging(
+    reference_list: List[str], warehouse: Optional[str] = None, as_of: Optional[DateLike] = None
+) -> Dict[str, dict]:
+    """
+    Get the age distribution of the HUs of given references.
+    
+    Args:
+        reference_list (List[str]): List of reference names
+        warehouse (str): Warehouse to analyse, all warehouses if not provided
+        as_of (str): Date the ages are measured at (YYYY-MM-DD), now if not provided
+    
+    Returns:
+        Dict[str, dict]: HU count, average and percentile days (p50_days,
+        p90_days) and HUs per age bucket for each reference in stock
+    """
+    index = warehouses.aging_index(warehouse) if warehouses.sharded(warehouse) else aging_index()
+    aging = aging_summary(index, reference_list, as_of)
+    logger.info(f"Calculated stock aging for references: {aging}")
+    return aging
     
     
 
-def get_stock_metrics(reference_list: List[str]) -> Dict[str, dict]:
+def get_stock_metrics(reference_list: List[str], warehouse: Optional[str] = None) -> Dict[str, dict]:
     """
     Get stock metrics for given references.
     
     Args:
         reference_list (List[str]): List of reference names
+        warehouse (str): Warehouse to analyse, all warehouses if not provided
     
     Returns:
-        Dict[str, dict]: Stock metrics for each reference
+        Dict[str, dict]: Total pieces, location and HU counts and oldest/newest
+        entry date (YYYY-MM-DD) for each reference
     """
-    df = stock_data_sql()
-    if df.empty:
+    if warehouses.sharded(warehouse):
+        metrics = warehouses.stock_metrics(reference_list, warehouse)
+        logger.info(f"Calculated stock metrics for references: {metrics}")
+        return metrics
+
+    if settings.ANALYTICS_BACKEND == "sql":
+        metrics = sql_backend.stock_metrics(reference_list)
+        logger.info(f"Calculated stock metrics for references: {metrics}")
+        return metrics
+
+    if stock_data_sql().empty:
         return {}
-    
-    df = df[df['Material'].isin(reference_list)]
-    
-    metrics = {}
-    for ref in reference_list:
-        ref_data = df[df['Material'] == ref]
-        metrics[ref] = {
-            'total_pieces': float(ref_data['Stock'].sum()),
-            'location_count': int(ref_data['Location'].nunique()),
-            'hu_count': int(ref_data['HU'].nunique())
-        }
-    
+
+    # Summaries maintained per material on every stock update
+    metrics = stock_summary().metrics(reference_list)
     logger.info(f"Calculated stock metrics for references: {metrics}")
     return metrics
\ No newline at end of file
@@ -0,0 +1,168 @@
+import pandas as pd
+from typing import Dict, Iterable, NamedTuple, Optional
+from .data_loader import snapshot_manager
+from .snapshot import DatasetSnapshot
+from .logger import setup_logger
+
+logger = setup_logger('common.utils.stock_summary')
+
+STOCK_SUMMARY_VIEW = "stock_summary"
+
+
+class MaterialStock(NamedTuple):
+    """Stock of one material."""
+    total_pieces: float
+    locations: frozenset  # distinct locations holding the material
+    hus: frozenset  # distinct handling units
+    oldest: Optional[pd.Timestamp]  # earliest HU entry date, None without dates
+    newest: Optional[pd.Timestamp]
+
+
+def date_label(value: Optional[pd.Timestamp]) -> Optional[str]:
+    """``YYYY-MM-DD`` of an entry date, None when missing."""
+    return None if value is None or pd.isna(value) else pd.Timestamp(value).strftime("%Y-%m-%d")
+
+
+def empty_metrics() -> dict:
+    """Metrics of a reference without stock."""
+    return {'total_pieces': 0.0, 'location_count': 0, 'hu_count': 0, 'oldest_entry': None, 'newest_entry': None}
+
+
+def _distinct(keys: pd.Series, values: pd.Series) -> Dict[str, frozenset]:
+    """Distinct non-null values per key."""
+    pairs = pd.DataFrame({"key": keys, "value": values}).dropna().drop_duplicates()
+    sets: Dict[str, set] = {}
+    for key, value in zip(pairs["key"].tolist(), pairs["value"].tolist()):
+        sets.setdefault(key, set()).add(value)
+    return {key: frozenset(found) for key, found in sets.items()}
+
+
+def _earliest(a: Optional[pd.Timestamp], b: Optional[pd.Timestamp]) -> Optional[pd.Timestamp]:
+    return b if a is None else a if b is None else min(a, b)
+
+
+def _latest(a: Optional[pd.Timestamp], b: Optional[pd.Timestamp]) -> Optional[pd.Timestamp]:
+    return b if a is None else a if b is None else max(a, b)
+
+
+class StockSummary:
+    """
+    Per-material stock totals, distinct locations and HUs and entry date range.
+
+    Distinct counts cannot be added up across stock updates, so the sets of
+    locations and HUs are kept: a new row only counts when its location or
+    HU is not already in the material's set. Updates return a new summary
+    sharing the untouched materials.
+    """
+
+    def __init__(self, materials: Optional[Dict[str, MaterialStock]] = None):
+        self.materials: Dict[str, MaterialStock] = materials or {}
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> "StockSummary":
+        """
+        Summarize stock rows in one grouped pass.
+
+        Args:
+            df (pd.DataFrame): Stock rows with Material, Stock, Location, HU and Date
+
+        Returns:
+            StockSummary: Summary per material, rows without a material are ignored
+        """
+        if df.empty or "Material" not in df.columns:
+            return cls()
+        df = df[df["Material"].notna()]
+        keys = df["Material"].astype(str)
+        grouped = df.groupby(keys, sort=True)
+        totals = grouped["Stock"].sum()
+        oldest, newest = grouped["Date"].min(), grouped["Date"].max()
+        locations, hus = _distinct(keys, df["Location"]), _distinct(keys, df["HU"])
+        return cls({
+            material: MaterialStock(
+                float(total), locations.get(material, frozenset()), hus.get(material, frozenset()),
+                None if pd.isna(first) else first, None if pd.isna(last) else last,
+            )
+            for material, total, first, last in zip(totals.index, totals.tolist(), oldest.tolist(), newest.tolist())
+        })
+
+    def merged(self, other: "StockSummary") -> "StockSummary":
+        """
+        Return a summary of the stock of both summaries.
+
+        Args:
+            other (StockSummary): Summary of other rows
+
+        Returns:
+            StockSummary: New summary (self when other is empty)
+        """
+        if not other.materials:
+            return self
+        materials = dict(self.materials)
+        for material, stock in other.materials.items():
+            current = materials.get(material)
+            if current is not None:
+                stock = MaterialStock(
+                    current.total_pieces + stock.total_pieces,
+                    current.locations | stock.locations,
+                    current.hus | stock.hus,
+                    _earliest(current.oldest, stock.oldest),
+                    _latest(current.newest, stock.newest),
+                )
+            materials[material] = stock
+        return StockSummary(materials)
+
+    def updated(self, df: pd.DataFrame) -> "StockSummary":
+        """Return a summary including the given stock rows."""
+        return self.merged(StockSummary.from_frame(df))
+
+    def metrics(self, reference_list: Iterable[str]) -> Dict[str, dict]:
+        """
+        Stock metrics of the given references.
+
+        Args:
+            reference_list (Iterable[str]): Material names
+
+        Returns:
+            Dict[str, dict]: total_pieces, location_count, hu_count and
+            oldest_entry/newest_entry (YYYY-MM-DD) per reference, zeros for
+            references without stock
+        """
+        metrics = {}
+        for ref in reference_list:
+            stock = self.materials.get(str(ref))
+            if stock is None:
+                metrics[ref] = empty_metrics()
+                continue
+            metrics[ref] = {
+                'total_pieces': stock.total_pieces,
+                'location_count': len(stock.locations),
+                'hu_count': len(stock.hus),
+                'oldest_entry': date_label(stock.oldest),
+                'newest_entry': date_label(stock.newest),
+            }
+        return metrics
+
+
+def _build(snapshot: DatasetSnapshot) -> StockSummary:
+    return StockSummary.from_frame(snapshot.stock)
+
+
+def _update(summary: StockSummary, deltas: Dict[str, pd.DataFrame]) -> StockSummary:
+    new_rows = deltas.get("stock")
+    if new_rows is None or new_rows.empty:
+        return summary
+    logger.info(f"Updating the stock summary with {len(new_rows)} new stock rows.")
+    return summary.updated(new_rows)
+
+
+snapshot_manager.register_view(STOCK_SUMMARY_VIEW, _build, _update)
+
+
+def stock_summary() -> StockSummary:
+    """
+    Per-material summary of the current snapshot's stock.
+
+    Returns:
+        StockSummary: Current summary (read-only)
+    """
+    return snapshot_manager.view(STOCK_SUMMARY_VIEW)
@@ -0,0 +1,261 @@
+import heapq
+import pandas as pd
+from typing import Dict, List, Optional, Tuple, Union
+from .data_loader import snapshot_manager
+from .snapshot import DatasetSnapshot
+from . import settings
+from .logger import setup_logger
+
+logger = setup_logger('common.utils.topk')
+
+TOP_CLIENTS_VIEW = "top_clients"
+TOP_REFERENCES_VIEW = "top_references"
+
+# Rollup of a year/month filter, 0 standing for "no filter on that field"
+Period = Tuple[int, int]
+
+
+def _rank(item: Tuple[str, float]) -> Tuple[float, str]:
+    """Sort key putting the largest totals first, ties broken by key like ``nlargest`` on sorted groups."""
+    return (-item[1], item[0])
+
+
+class ExactTopK:
+    """
+    Exact totals per key plus the ``size`` best keys, maintained on update.
+
+    While amounts are not negative a total only grows, so a key can only
+    enter the best set when it is updated: comparing it with the worst
+    member keeps the set exact in O(size) per update. A negative amount
+    marks the set stale until ``rebuild`` recomputes it from the totals,
+    which ``PeriodTopK.updated`` does before the tracker is published;
+    queries never modify the tracker.
+    """
+
+    __slots__ = ("size", "totals", "best", "stale")
+
+    def __init__(self, size: int):
+        self.size = size
+        self.totals: Dict[str, float] = {}
+        self.best: Dict[str, float] = {}
+        self.stale = False
+
+    def copy(self) -> "ExactTopK":
+        other = ExactTopK(self.size)
+        other.totals, other.best, other.stale = dict(self.totals), dict(self.best), self.stale
+        return other
+
+    def add(self, key: str, amount: float) -> None:
+        total = self.totals.get(key, 0.0) + amount
+        self.totals[key] = total
+        if amount < 0:
+            self.stale = True
+        if self.stale:
+            return
+        if key in self.best or len(self.best) < self.size:
+            self.best[key] = total
+            return
+        worst = max(self.best.items(), key=_rank)
+        if _rank((key, total)) < _rank(worst):
+            del self.best[worst[0]]
+            self.best[key] = total
+
+    def rebuild(self) -> None:
+        if self.stale:
+            self.best = dict(heapq.nsmallest(self.size, self.totals.items(), key=_rank))
+            self.stale = False
+
+    def top(self, limit: int) -> List[str]:
+        if limit > self.size or self.stale:
+            return [key for key, _ in heapq.nsmallest(limit, self.totals.items(), key=_rank)]
+        return [key for key, _ in sorted(self.best.items(), key=_rank)[:limit]]
+
+
+class SpaceSavingTopK:
+    """
+    Space-Saving sketch keeping at most ``capacity`` counters.
+
+    A key without a counter takes over the smallest one, inheriting its
+    count as overestimation, so memory is bounded whatever the number of
+    keys. Every key whose total exceeds the sum of all amounts divided by
+    ``capacity`` is guaranteed to be tracked; the ranking is approximate
+    once the number of keys exceeds the capacity.
+    """
+
+    __slots__ = ("capacity", "counts", "errors", "_heap")
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.counts: Dict[str, float] = {}
+        self.errors: Dict[str, float] = {}
+        # (count, key) entries, outdated ones are skipped when popped
+        self._heap: List[Tuple[float, str]] = []
+
+    def copy(self) -> "SpaceSavingTopK":
+        other = SpaceSavingTopK(self.capacity)
+        other.counts, other.errors, other._heap = dict(self.counts), dict(self.errors), list(self._heap)
+        return other
+
+    def _pop_smallest(self) -> Tuple[str, float]:
+        while True:
+            count, key = heapq.heappop(self._heap)
+            if self.counts.get(key) == count:
+                return key, count
+
+    def add(self, key: str, amount: float) -> None:
+        if key in self.counts:
+            self.counts[key] += amount
+        elif len(self.counts) < self.capacity:
+            self.counts[key], self.errors[key] = amount, 0.0
+        else:
+            victim, floor = self._pop_smallest()
+            del self.counts[victim], self.errors[victim]
+            self.counts[key], self.errors[key] = floor + amount, floor
+        heapq.heappush(self._heap, (self.counts[key], key))
+        if len(self._heap) > 4 * self.capacity:
+            self._heap = [(count, k) for k, count in self.counts.items()]
+            heapq.heapify(self._heap)
+
+    def top(self, limit: int) -> List[str]:
+        return [key for key, _ in heapq.nsmallest(limit, self.counts.items(), key=_rank)]
+
+
+Tracker = Union[ExactTopK, SpaceSavingTopK]
+
+
+class PeriodTopK:
+    """
+    Top keys by summed value for every year/month filter.
+
+    Each row updates four rollups: its (year, month), its year, its month of
+    any year and the overall one, so every filter combination accepted by
+    the analysis functions is answered from one tracker. Updates return a
+    new object sharing the untouched rollups, so a snapshot's view is never
+    modified after it was published.
+    """
+
+    def __init__(self, key_column: str, value_column: str, count_undated: bool,
+                 mode: Optional[str] = None, size: Optional[int] = None, capacity: Optional[int] = None):
+        self.key_column = key_column
+        self.value_column = value_column
+        self.count_undated = count_undated
+        self.mode = mode or settings.TOPK_MODE
+        self.size = size or settings.TOPK_SIZE
+        self.capacity = capacity or settings.TOPK_SKETCH_CAPACITY
+        self.rollups: Dict[Period, Tracker] = {}
+
+    def _tracker(self) -> Tracker:
+        return SpaceSavingTopK(self.capacity) if self.mode == "sketch" else ExactTopK(self.size)
+
+    def updated(self, df: pd.DataFrame) -> "PeriodTopK":
+        """
+        Return a tracker including the given rows.
+
+        Args:
+            df (pd.DataFrame): Expedition rows with Date and the key and value columns
+
+        Returns:
+            PeriodTopK: New tracker (self when there are no rows)
+        """
+        if df.empty or self.key_column not in df.columns:
+            return self
+        new = PeriodTopK(self.key_column, self.value_column, self.count_undated, self.mode, self.size, self.capacity)
+        new.rollups = dict(self.rollups)
+        rows = pd.DataFrame({
+            "year": df["Date"].dt.year.fillna(0).astype("int64"),
+            "month": df["Date"].dt.month.fillna(0).astype("int64"),
+            "key": df[self.key_column].astype(str),
+            "value": pd.to_numeric(df[self.value_column], errors="coerce").fillna(0.0).astype("float64"),
+        })
+        dated = rows[rows["year"] > 0]
+        levels = [
+            (dated, ["year", "month"]),
+            (dated, ["year"]),
+            (dated, ["month"]),
+            (rows if self.count_undated else dated, []),
+        ]
+        copied = set()
+        for frame, columns in levels:
+            sums = frame.groupby(columns + ["key"], sort=True)["value"].sum()
+            for index, amount in sums.items():
+                index = index if isinstance(index, tuple) else (index,)
+                period = self._period(dict(zip(columns, index[:-1])))
+                if period not in copied:
+                    tracker = new.rollups.get(period)
+                    new.rollups[period] = tracker.copy() if tracker is not None else self._tracker()
+                    copied.add(period)
+                new.rollups[period].add(index[-1], float(amount))
+        for period in copied:
+            if isinstance(new.rollups[period], ExactTopK):
+                new.rollups[period].rebuild()
+        return new
+
+    @staticmethod
+    def _period(values: Dict[str, int]) -> Period:
+        return (int(values.get("year", 0)), int(values.get("month", 0)))
+
+    def top(self, year: Optional[int] = None, month: Optional[int] = None, limit: int = 5) -> List[str]:
+        """
+        Top keys for a year and/or month; a falsy value means no filter.
+
+        Args:
+            year (int): Year to filter
+            month (int): Month to filter
+            limit (int): Number of keys
+
+        Returns:
+            List[str]: Keys by decreasing total, empty if the period has no rows
+        """
+        tracker = self.rollups.get((year or 0, month or 0))
+        return tracker.top(limit) if tracker is not None else []
+
+
+def _build_clients(snapshot: DatasetSnapshot) -> PeriodTopK:
+    # Like the client-month cube, lines without a date are not counted
+    return PeriodTopK("Client", "Purchased", count_undated=False).updated(snapshot.expeditions)
+
+
+def _build_references(snapshot: DatasetSnapshot) -> PeriodTopK:
+    return PeriodTopK("idMaterial", "Purchased", count_undated=True).updated(snapshot.expeditions)
+
+
+def _update(tracker: PeriodTopK, deltas: Dict[str, pd.DataFrame]) -> PeriodTopK:
+    new_rows = deltas.get("expeditions")
+    if new_rows is None or new_rows.empty:
+        return tracker
+    logger.info(f"Updating top {tracker.key_column} trackers with {len(new_rows)} new expedition lines.")
+    return tracker.updated(new_rows)
+
+
+snapshot_manager.register_view(TOP_CLIENTS_VIEW, _build_clients, _update)
+snapshot_manager.register_view(TOP_REFERENCES_VIEW, _build_references, _update)
+
+
+def top_clients(year: Optional[int] = None, month: Optional[int] = None, limit: int = 5) -> List[str]:
+    """
+    Top clients by ordered quantity, answered from the maintained trackers.
+
+    Args:
+        year (int): Year to filter
+        month (int): Month to filter
+        limit (int): Number of clients
+
+    Returns:
+        List[str]: Client names
+    """
+    return snapshot_manager.view(TOP_CLIENTS_VIEW).top(year, month, limit)
+
+
+def top_references(year: Optional[int] = None, month: Optional[int] = None, limit: int = 5) -> List[str]:
+    """
+    Top references by ordered quantity, answered from the maintained trackers.
+
+    Args:
+        year (int): Year to filter
+        month (int): Month to filter
+        limit (int): Number of references
+
+    Returns:
+        List[str]: Reference ids
+    """
+    return snapshot_manager.view(TOP_REFERENCES_VIEW).top(year, month, limit)
@@ -0,0 +1,390 @@
+import os
+import threading
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Dict, Hashable, List, Optional, TypeVar
+from .aging import AgingIndex, database_index
+from .data_loader import COMMON_DATA_PATH, DB_PATH, data_version as snapshot_version, partitions_version
+from .forecasting import build_demand_matrix, compute_forecasts
+from .forecast_models import DEFAULT_MODEL
+from . import sql_backend
+from . import settings
+from .logger import setup_logger
+
+logger = setup_logger('common.utils.warehouses')
+
+# One database per warehouse (a shard), configured with WAREHOUSE_SHARDS.
+# Every analysis runs as a partial aggregate on each selected shard (sums,
+# counts, per-key totals from sql_backend), the shards are queried in
+# parallel from a thread pool (sqlite3 releases the GIL while a query
+# runs) and the partials are merged here. Top-k lists are ranked after
+# merging the per-key totals of every shard, so they are exact.
+
+DEFAULT_WAREHOUSE = "main"
+
+CLIENT_TOTAL_COLUMNS = ["Purchased", "Served", "lines"]
+
+T = TypeVar("T")
+
+
+@dataclass(frozen=True)
+class Shard:
+    """A warehouse and the database holding its data."""
+    name: str
+    db_path: str
+
+
+def parse_shards(spec: str) -> Dict[str, Shard]:
+    """
+    Parse a ``name=path,name=path`` shard list.
+
+    Relative paths are resolved against ``common/data``. An empty list
+    means a single warehouse stored in the default database.
+
+    Args:
+        spec (str): Value of WAREHOUSE_SHARDS
+
+    Returns:
+        Dict[str, Shard]: Shards by warehouse name, in configuration order
+    """
+    if not spec.strip():
+        return {DEFAULT_WAREHOUSE: Shard(DEFAULT_WAREHOUSE, DB_PATH)}
+    shards = {}
+    for entry in spec.split(","):
+        if not entry.strip():
+            continue
+        name, separator, path = (part.strip() for part in entry.partition("="))
+        if not separator or not name or not path:
+            raise ValueError(f"Invalid warehouse shard '{entry}', expected name=path")
+        shards[name] = Shard(name, os.path.join(COMMON_DATA_PATH, path))
+    return shards
+
+
+SHARDS = parse_shards(settings.WAREHOUSE_SHARDS)
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+# Merged forecasts per (model, warehouse) with the shard signatures they were computed for
+_forecast_cache: Dict[tuple, tuple] = {}
+
+
+def available_warehouses() -> List[str]:
+    """
+    Return the names of the configured warehouses.
+
+    Returns:
+        List[str]: Warehouse names
+    """
+    return list(SHARDS)
+
+
+def sharded(warehouse: Optional[str] = None) -> bool:
+    """
+    Whether an analysis goes through the shards.
+
+    A single warehouse stored in the default database is read through the
+    snapshot, whether it is selected by name or not. Several warehouses, a
+    single one stored elsewhere, or an unknown name (answered empty by the
+    fan-out) go through the shards.
+
+    Args:
+        warehouse (str): Warehouse name, all warehouses if None
+
+    Returns:
+        bool: True if the analysis must fan out over the shards
+    """
+    if len(SHARDS) > 1 or (warehouse and warehouse not in SHARDS):
+        return True
+    return next(iter(SHARDS.values())).db_path != DB_PATH
+
+
+def select_shards(warehouse: Optional[str] = None) -> List[Shard]:
+    """
+    Shards covered by a warehouse filter.
+
+    Args:
+        warehouse (str): Warehouse name, all warehouses if None
+
+    Returns:
+        List[Shard]: Selected shards, empty for an unknown warehouse
+    """
+    if not warehouse:
+        return list(SHARDS.values())
+    shard = SHARDS.get(warehouse)
+    if shard is None:
+        logger.error(f"Unknown warehouse '{warehouse}'. Available: {available_warehouses()}")
+        return []
+    return [shard]
+
+
+def _pool() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.SHARD_WORKERS or len(SHARDS), thread_name_prefix="warehouse-shard"
+            )
+    return _executor
+
+
+def fan_out(partial: Callable[[Shard], T], warehouse: Optional[str] = None) -> List[T]:
+    """
+    Compute a partial aggregate on every selected shard.
+
+    Args:
+        partial (Callable): Function computing the partial result of one shard
+        warehouse (str): Warehouse name, all warehouses if None
+
+    Returns:
+        List: One partial result per shard, in configuration order
+    """
+    shards = select_shards(warehouse)
+    if len(shards) <= 1:
+        return [partial(shard) for shard in shards]
+    return list(_pool().map(partial, shards))
+
+
+def data_version(warehouse: Optional[str] = None) -> Hashable:
+    """
+    Version of the data the analyses of a warehouse filter read.
+
+    It changes whenever rows are ingested, so caches of derived results
+    (agent responses, tool results) use it as part of their key. The SQL and
+    partitioned backends and the shards are versioned by the change counter
+    of each database (see ``sql_backend.database_version``), which neither
+    loads the in-memory snapshot nor scans any table.
+
+    Args:
+        warehouse (str): Warehouse name, all warehouses if None
+
+    Returns:
+        Hashable: Version marker, equal as long as the data is unchanged
+    """
+    if not sharded(warehouse) and settings.ANALYTICS_BACKEND not in ("sql", "partitions"):
+        return snapshot_version()
+    version = tuple((shard.name, sql_backend.database_version(shard.db_path)) for shard in select_shards(warehouse))
+    if settings.ANALYTICS_BACKEND == "partitions":
+        version += (partitions_version(),)
+    return version
+
+
+def _sum_totals(parts: List[pd.Series]) -> pd.Series:
+    parts = [part for part in parts if not part.empty]
+    if not parts:
+        return pd.Series(dtype="float64")
+    return pd.concat(parts).groupby(level=0, dropna=False).sum()
+
+
+def _top_keys(totals: pd.Series, limit: int) -> List[str]:
+    """Keys of the ``limit`` largest totals, ties broken by key like the SQL backend."""
+    ranked = sorted(totals.items(), key=lambda item: (-item[1], str(item[0])))
+    return [str(key) for key, _ in ranked[:limit]]
+
+
+def client_totals(year: Optional[int] = None, month: Optional[int] = None, warehouse: Optional[str] = None) -> pd.DataFrame:
+    """
+    Per-client totals for a year and/or month over the selected warehouses.
+
+    Args:
+        year (int): Year to filter
+        month (int): Month to filter
+        warehouse (str): Warehouse name, all warehouses if None
+
+    Returns:
+        pd.DataFrame: Purchased, Served and lines per Client, sorted by Client
+    """
+    parts = fan_out(lambda shard: sql_backend.client_totals(year, month, shard.db_path), warehouse)
+    parts = [part for part in parts if not part.empty]
+    if not parts:
+        return pd.DataFrame({column: pd.Series(dtype="float64") for column in CLIENT_TOTAL_COLUMNS})
+    return pd.concat(parts).groupby(level=0, dropna=False).sum().sort_index()
+
+
+def top_references(year: Optional[int] = None, month: Optional[int] = None, limit: int = 5, warehouse: Optional[str] = None) -> List[str]:
+    """
+    Top references by ordered quantity over the selected warehouses.
+
+    Args:
+        year (int): Year to filter
+        month (int): Month to filter
+        limit (int): Number of references
+        warehouse (str): Warehouse name, all warehouses if None
+
+    Returns:
+        List[str]: Reference ids
+    """
+    parts = fan_out(lambda shard: sql_backend.reference_totals(year, month, shard.db_path), warehouse)
+    return _top_keys(_sum_totals(parts), limit)
+
+
+def reference_time_series(
+    year: Optional[int], month: Optional[int], reference_list: List[str], warehouse: Optional[str] = None
+) -> Dict[str, dict]:
+    """
+    Monthly served quantity of the given references over the selected warehouses.
+
+    Args:
+        year (int): Year to filter
+        month (int): Month to filter
+        reference_list (List[str]): Reference ids
+        warehouse (str): Warehouse name, all warehouses if None
+
+    Returns:
+        Dict[str, dict]: "dates" (YYYY-MM) and "quantities" per reference
+        (empty lists for a period without expeditions), empty if no
+        warehouse has any expedition
+    """
+    parts = fan_out(
+        lambda shard: (
+            sql_backend.period_has_rows(db_path=shard.db_path),
+            sql_backend.monthly_served(year, month, reference_list, shard.db_path),
+        ),
+        warehouse,
+    )
+    if not any(has_rows for has_rows, _ in parts):
+        return {}
+    frames = [series for _, series in parts if not series.empty]
+    monthly = pd.DataFrame(columns=["idMaterial", "period", "Served"])
+    if frames:
+        monthly = pd.concat(frames).groupby(["idMaterial", "period"], as_index=False)["Served"].sum()
+    return sql_backend.time_series_from_monthly(monthly, reference_list)
+
+
+def top_stock_references(limit: int = 5, warehouse: Optional[str] = None) -> List[str]:
+    """
+    Top references by total pieces in stock over the selected warehouses.
+
+    Args:
+        limit (int): Number of references
+        warehouse (str): Warehouse name, all warehouses if None
+
+    Returns:
+        List[str]: Material names
+    """
+    parts = fan_out(lambda shard: sql_backend.stock_totals(shard.db_path), warehouse)
+    return _top_keys(_sum_totals(parts), limit)
+
+
+def stock_metrics(reference_list: List[str], warehouse: Optional[str] = None) -> Dict[str, dict]:
+    """
+    Total pieces, locations and HUs and entry date range of the given references over the selected warehouses.
+
+    Locations and handling units belong to one warehouse, so their distinct
+    counts add up across shards.
+
+    Args:
+        reference_list (List[str]): Material names
+        warehouse (str): Warehouse name, all warehouses if None
+
+    Returns:
+        Dict[str, dict]: Metrics per reference, empty if there is no stock data
+    """
+    parts = [part for part in fan_out(lambda shard: sql_backend.stock_metrics(reference_list, shard.db_path), warehouse) if part]
+    if not parts:
+        return {}
+    metrics = {}
+    for ref in reference_list:
+        oldest = [part[ref]['oldest_entry'] for part in parts if part[ref]['oldest_entry']]
+        newest = [part[ref]['newest_entry'] for part in parts if part[ref]['newest_entry']]
+        metrics[ref] = {
+            'total_pieces': float(sum(part[ref]['total_pieces'] for part in parts)),
+            'location_count': int(sum(part[ref]['location_count'] for part in parts)),
+            'hu_count': int(sum(part[ref]['hu_count'] for part in parts)),
+            # YYYY-MM-DD labels order like the dates
+            'oldest_entry': min(oldest, default=None),
+            'newest_entry': max(newest, default=None),
+        }
+    return metrics
+
+
+def avg_time_in_warehouse(reference_list: List[str], warehouse: Optional[str] = None, now: Optional[datetime] = None) -> Dict[str, float]:
+    """
+    Average whole days since entry of the HUs of the given references over the selected warehouses.
+
+    Each shard returns the sum and count of days per material, so the
+    merged average weighs every HU equally.
+
+    Args:
+        reference_list (List[str]): Material names
+        warehouse (str): Warehouse name, all warehouses if None
+        now (datetime): Reference time, defaults to the current time
+
+    Returns:
+        Dict[str, float]: Average days per reference present in stock
+    """
+    now = now or datetime.now()
+    parts = fan_out(lambda shard: sql_backend.stock_age_totals(reference_list, now, shard.db_path), warehouse)
+    parts = [part for part in parts if not part.empty]
+    if not parts:
+        return {}
+    return sql_backend.average_days(pd.concat(parts).groupby(level=0).sum())
+
+
+def aging_index(warehouse: Optional[str] = None) -> AgingIndex:
+    """
+    Aging index of the stock of the selected warehouses.
+
+    The per-shard indexes are cached until their Ubicaciones table changes;
+    merging them keeps every entry date, so ages and percentiles are exact.
+
+    Args:
+        warehouse (str): Warehouse name, all warehouses if None
+
+    Returns:
+        AgingIndex: Merged index
+    """
+    merged = AgingIndex()
+    for index in fan_out(lambda shard: database_index(shard.db_path), warehouse):
+        merged = merged.merged(index)
+    return merged
+
+
+def forecasts(model: str = DEFAULT_MODEL, warehouse: Optional[str] = None) -> Dict[str, float]:
+    """
+    Next month's forecast for every reference over the selected warehouses.
+
+    The monthly served quantities of the shards are merged into one demand
+    matrix; results are kept until a shard's Expediciones table changes.
+
+    Args:
+        model (str): Registered model name (see ``forecast_models``)
+        warehouse (str): Warehouse name, all warehouses if None
+
+    Returns:
+        Dict[str, float]: Forecast per idMaterial
+    """
+    signature = tuple(fan_out(lambda shard: (shard.name,) + sql_backend.table_signature("Expediciones", shard.db_path), warehouse))
+    key = (model, warehouse or "")
+    cached = _forecast_cache.get(key)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+
+    frames = [part for part in fan_out(lambda shard: sql_backend.monthly_served(db_path=shard.db_path), warehouse) if not part.empty]
+    monthly = pd.DataFrame(columns=["idMaterial", "Date", "Served"])
+    if frames:
+        monthly = pd.concat(frames).groupby(["idMaterial", "period"], as_index=False)["Served"].sum()
+        monthly["Date"] = pd.to_datetime(monthly["period"] + "-01")
+    result = compute_forecasts(build_demand_matrix(monthly), model)
+    _forecast_cache[key] = (signature, result)
+    return result
+
+
+def lookup_forecasts(reference_list: List[str], model: str = DEFAULT_MODEL, warehouse: Optional[str] = None) -> Dict[str, float]:
+    """
+    Look up merged forecasts, 0.0 for references without history.
+
+    Args:
+        reference_list (List[str]): List of reference IDs
+        model (str): Registered model name (see ``forecast_models``)
+        warehouse (str): Warehouse name, all warehouses if None
+
+    Returns:
+        Dict[str, float]: Forecast per reference, empty if there is no data
+    """
+    merged = forecasts(model, warehouse)
+    if not merged:
+        return {}
+    return {str(ref): merged.get(str(ref), 0.0) for ref in reference_list}
@@ -65,9 +65,10 @@ logger = setup_logger('dash_app.app')
 
 # Import our utility functions
 from common.utils.data_loader import load_expeditions_data, load_stock_data
-from common.utils.expedition_analysis import get_top_clients, get_client_service_level, get_expedition_metrics
+from common.utils.expedition_analysis import get_client_analytics
 from common.utils.reference_analysis import get_top_references_expeditions, get_reference_time_series, forecast_next_month_demand
 from common.utils.stock_analysis import get_top_references_stock, get_avg_time_in_warehouse, get_stock_metrics
+from common.utils.warehouses import available_warehouses
 
 import os
 
@@ -180,6 +181,17 @@ app.layout = html.Div([
 
     # Global Filters
     html.Div([
+        html.Div([
+            html.Label("Select Warehouse:", style={'fontWeight': 'bold'}),
+            dcc.Dropdown(
+                id='warehouse-filter',
+                options=[{'label': name, 'value': name} for name in available_warehouses()],
+                value=None,
+                clearable=True,
+                placeholder="All Warehouses"
+            )
+        ], style={'width': '18%', 'display': 'inline-block', 'padding': '10px'}),
+        
         html.Div([
             html.Label("Select Year:", style={'fontWeight': 'bold'}),
             dcc.Dropdown(
@@ -189,7 +201,7 @@ app.layout = html.Div([
                 clearable=True,
                 placeholder="All Years"
             )
-        ], style={'width': '23%', 'display': 'inline-block', 'padding': '10px'}),
+        ], style={'width': '18%', 'display': 'inline-block', 'padding': '10px'}),
         
         html.Div([
             html.Label("Select Month:", style={'fontWeight': 'bold'}),
@@ -200,7 +212,7 @@ app.layout = html.Div([
                 clearable=True,
                 placeholder="All Months"
             )
-        ], style={'width': '23%', 'display': 'inline-block', 'padding': '10px'}),
+        ], style={'width': '18%', 'display': 'inline-block', 'padding': '10px'}),
         
         html.Div([
             html.Label("Number of Clients:", style={'fontWeight': 'bold'}),
@@ -212,7 +224,7 @@ app.layout = html.Div([
                 value=5,
                 marks={i: str(i) for i in range(1, 9)}
             )
-        ], style={'width': '27%', 'display': 'inline-block', 'padding': '10px'}),
+        ], style={'width': '23%', 'display': 'inline-block', 'padding': '10px'}),
         
         html.Div([
             html.Label("Number of References:", style={'fontWeight': 'bold'}),
@@ -244,21 +256,23 @@ app.layout = html.Div([
      Input('year-filter', 'value'),
      Input('month-filter', 'value'),
      Input('client-slider', 'value'),
-     Input('reference-slider', 'value')]
+     Input('reference-slider', 'value'),
+     Input('warehouse-filter', 'value')]
 )
-def render_tab_content(tab, year, month, client_limit, reference_limit):
+def render_tab_content(tab, year, month, client_limit, reference_limit, warehouse):
     if tab == 'tab1':
-        return render_client_service_tab(year, month, client_limit)
+        return render_client_service_tab(year, month, client_limit, warehouse)
     elif tab == 'tab2':
-        return render_reference_expeditions_tab(year, month, reference_limit)
+        return render_reference_expeditions_tab(year, month, reference_limit, warehouse)
     elif tab == 'tab3':
-        return render_reference_stock_tab(reference_limit)
+        return render_reference_stock_tab(reference_limit, warehouse)
 
-def render_client_service_tab(year, month, client_limit):
+def render_client_service_tab(year, month, client_limit, warehouse=None):
     """Render content for Client Service Level tab"""
     
-    # Get top clients
-    top_clients = get_top_clients(limit=client_limit, year=year, month=month)
+    # Get top clients, service levels and metrics in a single pass
+    analytics = get_client_analytics(month=month, limit=client_limit, year=year, warehouse=warehouse)
+    top_clients = analytics['top_clients']
     
     if not top_clients:
         return html.Div([
@@ -266,9 +280,8 @@ def render_client_service_tab(year, month, client_limit):
             html.P("No data available for the selected filters.", style={'color': 'red'})
         ])
     
-    # Get service levels and metrics
-    service_levels = get_client_service_level(month=month, client_list=top_clients, year=year)
-    expedition_metrics = get_expedition_metrics(month=month, client_list=top_clients, year=year)
+    service_levels = analytics['service_levels']
+    expedition_metrics = analytics['metrics']
     
     # Create service level chart
     fig_service = go.Figure()
@@ -351,11 +364,11 @@ def render_client_service_tab(year, month, client_limit):
         ], style=table_style)
     ])
 
-def render_reference_expeditions_tab(year, month, reference_limit):
+def render_reference_expeditions_tab(year, month, reference_limit, warehouse=None):
     """Render content for Reference Importance (Expeditions) tab"""
     
     # Get top references
-    top_references = get_top_references_expeditions(limit=reference_limit, year=year, month=month)
+    top_references = get_top_references_expeditions(limit=reference_limit, year=year, month=month, warehouse=warehouse)
     
     if not top_references:
         return html.Div([
@@ -364,8 +377,8 @@ def render_reference_expeditions_tab(year, month, reference_limit):
         ])
     
     # Get time series data and forecasts
-    time_series = get_reference_time_series(month=month, reference_list=top_references, year=year)
-    forecasts = forecast_next_month_demand(top_references)
+    time_series = get_reference_time_series(month=month, reference_list=top_references, year=year, warehouse=warehouse)
+    forecasts = forecast_next_month_demand(top_references, warehouse=warehouse)
     
     # Create time series chart
     fig_time_series = go.Figure()
@@ -435,11 +448,11 @@ def render_reference_expeditions_tab(year, month, reference_limit):
         ], style=table_style)
     ])
 
-def render_reference_stock_tab(reference_limit):
+def render_reference_stock_tab(reference_limit, warehouse=None):
     """Render content for Reference Importance (Stock) tab"""
     
     # Get top references from stock
-    top_references = get_top_references_stock(limit=reference_limit)
+    top_references = get_top_references_stock(limit=reference_limit, warehouse=warehouse)
     
     if not top_references:
         return html.Div([
@@ -448,8 +461,8 @@ def render_reference_stock_tab(reference_limit):
         ])
     
     # Get stock metrics and average times
-    stock_metrics = get_stock_metrics(top_references)
-    avg_times = get_avg_time_in_warehouse(top_references)
+    stock_metrics = get_stock_metrics(top_references, warehouse=warehouse)
+    avg_times = get_avg_time_in_warehouse(top_references, warehouse=warehouse)
     
     # Create stock quantity chart
     quantities = [stock_metrics[ref]['total_pieces'] for ref in top_references]
@@ -549,10 +562,11 @@ def update_chat_input(example1, example2, example3, example4):
 @callback(
     Output('ai-chat-response', 'children'),
     [Input('ai-chat-button', 'n_clicks')],
-    [State('ai-chat-input', 'value')],
+    [State('ai-chat-input', 'value'),
+     State('warehouse-filter', 'value')],
     prevent_initial_call=True
 )
-def update_ai_chat(n_clicks, user_message):
+def update_ai_chat(n_clicks, user_message, warehouse=None):
     if not user_message or user_message.strip() == "":
         return html.Div([
             html.P("Please enter a question to get AI-powered insights.", 
@@ -560,7 +574,7 @@ def update_ai_chat(n_clicks, user_message):
         ])
     
     try:
-        query = {"message": user_message, "session_id": "user_id_from_dash"}
+        query = {"message": user_message, "session_id": "user_id_from_dash", "warehouse": warehouse}
         response = requests.post(
         f"{API_URL}/query",
         json=query